@@ -0,0 +1,87 @@
+import base64
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional, Tuple
+
+import orjson
+from sqlalchemy import select, tuple_
+
+from database import AccessLog
+from models import AccessLogResponse
+
+
+# Kolumny odpowiedzi /api/logs pobierane jako zwykłe wiersze – bez obiektów
+# ORM i walidacji Pydantic dla każdego wpisu (kształt jak AccessLogResponse)
+LOG_COLUMNS = [getattr(AccessLog, name) for name in AccessLogResponse.model_fields]
+
+
+def encode_cursor(timestamp: datetime, log_id: int) -> str:
+    """Nieprzezroczysty kursor strony: pozycja (timestamp, id) ostatniego wpisu."""
+    raw = orjson.dumps([timestamp.isoformat(), log_id])
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Odwrotność encode_cursor; ValueError dla uszkodzonego kursora."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, log_id = orjson.loads(raw)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except (ValueError, TypeError, orjson.JSONDecodeError) as e:
+        raise ValueError(f"Nieprawidłowy kursor: {cursor!r}") from e
+
+
+def logs_query(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    user_id: Optional[int] = None,
+    result: Optional[str] = None,
+    cursor: Optional[str] = None,
+):
+    """
+    Wpisy od najnowszych, w kolejności (timestamp, id) malejąco. Kolejna
+    strona zaczyna się za wpisem z kursora (keyset) – warunek na indeksie
+    zamiast OFFSET, więc każda strona kosztuje tyle samo niezależnie od
+    tego, jak daleko jest od początku. id rozstrzyga wpisy z tym samym czasem.
+    """
+    query = select(*LOG_COLUMNS)
+
+    # Filtry po użytkowniku i wyniku korzystają z indeksów (user_id, timestamp)
+    # i (result, timestamp)
+    if user_id is not None:
+        query = query.where(AccessLog.user_id == user_id)
+    if result:
+        query = query.where(AccessLog.result == result)
+    if start:
+        query = query.where(AccessLog.timestamp >= start)
+    if end:
+        query = query.where(AccessLog.timestamp <= end)
+    if cursor:
+        timestamp, log_id = decode_cursor(cursor)
+        query = query.where(tuple_(AccessLog.timestamp, AccessLog.id) < tuple_(timestamp, log_id))
+
+    return query.order_by(AccessLog.timestamp.desc(), AccessLog.id.desc())
+
+
+def next_cursor(rows: list, limit: int) -> Optional[str]:
+    """Kursor następnej strony albo None, gdy strona nie była pełna (koniec danych)."""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(last["timestamp"], last["id"])
+
+
+async def stream_ndjson(
+    session_factory: Callable, query, batch_size: int = 1000
+) -> AsyncIterator[bytes]:
+    """
+    Wpisy jako NDJSON (jeden obiekt JSON na linię) prosto z kursora bazy:
+    wiersze są pobierane i serializowane partiami po `batch_size`, więc
+    pamięć nie zależy od długości eksportowanego zakresu. Sesja bazy
+    (własna, nie z zależności handlera) jest otwarta przez cały eksport.
+    """
+    async with session_factory() as db:
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for partition in result.mappings().partitions():
+            yield b"".join(
+                orjson.dumps(dict(row), option=orjson.OPT_APPEND_NEWLINE) for row in partition
+            )
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from database import AccessLog
+
+
+class AccessLogWriter:
+    """
+    Zapis wpisów AccessLog z grupowym zatwierdzaniem: handlery wrzucają
+    rekordy do kolejki w procesie, a jedno zadanie zapisuje je partiami –
+    jeden commit (i jedna synchronizacja pliku SQLite) na partię zamiast
+    na żądanie. Partia jest zapisywana po zebraniu `max_batch` rekordów
+    albo `max_delay` sekund od pierwszego z nich. Przy max_delay = 0 partia
+    to wszystko, co czeka w kolejce – wpisy zebrane w trakcie poprzedniego
+    commitu, więc pojedyncze żądanie nie czeka na okno.
+
+    write() czeka na zatwierdzenie partii i zwraca id wpisu, więc handler
+    może je od razu odesłać (log_id), a audyt 1:N znajdzie wpis w bazie.
+    Zapis do bazy działa w osobnym wątku – pętla zdarzeń nie czeka na dysk.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable,
+        max_batch: int = 64,
+        max_delay: float = 0.0,
+    ):
+        self.session_factory = session_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self.records = 0
+        self.batches = 0
+        self.largest_batch = 0
+        self.commit_seconds = 0.0
+
+    def start(self):
+        """Uruchamia zadanie zapisu w bieżącej pętli zdarzeń."""
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Zapisuje rekordy z kolejki i kończy zadanie zapisu."""
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+        self._queue = None
+
+    async def write(self, **fields) -> int:
+        """Dodaje wpis (pola AccessLog) i zwraca jego id po zatwierdzeniu partii."""
+        # Obiekt powstaje tutaj – błędne pole trafia tylko do tego handlera
+        log = AccessLog(**fields)
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((log, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                try:
+                    if timeout > 0:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    else:
+                        item = self._queue.get_nowait()
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._commit(batch)
+
+    async def _commit(self, batch: list):
+        """
+        Zapis partii jednym commitem. Gdy się nie uda (np. jeden błędny
+        rekord), partia jest wycofana, a rekordy zapisywane pojedynczo –
+        błąd dostaje tylko handler rekordu, którego nie da się zapisać.
+        """
+        loop = asyncio.get_running_loop()
+        records = [log for log, _ in batch]
+        try:
+            ids = await loop.run_in_executor(self._executor, self._insert, records)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Błąd zapisu logu dostępu: {e}")
+                self._resolve(batch[0][1], error=e)
+                return
+            print(f"Błąd zapisu partii logów dostępu ({len(batch)}): {e} – zapis pojedynczo")
+            for log, future in batch:
+                try:
+                    (log_id,) = await loop.run_in_executor(self._executor, self._insert, [log])
+                except Exception as e:
+                    print(f"Błąd zapisu logu dostępu: {e}")
+                    self._resolve(future, error=e)
+                else:
+                    self._resolve(future, log_id)
+            return
+        for (_, future), log_id in zip(batch, ids):
+            self._resolve(future, log_id)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, log_id: Optional[int] = None, error: Optional[Exception] = None):
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(log_id)
+
+    def _insert(self, logs: List[AccessLog]) -> List[int]:
+        start = time.perf_counter()
+        db = self.session_factory()
+        try:
+            db.add_all(logs)
+            # id są znane po flush; po commit obiekty są wygaszane (odczyt = SELECT)
+            db.flush()
+            ids = [log.id for log in logs]
+            db.commit()
+        except Exception:
+            # Wycofanie odłącza rekordy od sesji – można je zapisać ponownie
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        self.commit_seconds += time.perf_counter() - start
+        self.records += len(logs)
+        self.batches += 1
+        self.largest_batch = max(self.largest_batch, len(logs))
+        return ids
+
+    def stats(self) -> dict:
+        return {
+            "records": self.records,
+            "batches": self.batches,
+            "largest_batch": self.largest_batch,
+            "mean_batch": self.records / self.batches if self.batches else 0.0,
+            "mean_commit_ms": self.commit_seconds * 1000.0 / self.batches if self.batches else 0.0,
+        }
@@ -0,0 +1,88 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+
+class AnalysisCache:
+    """
+    Ograniczony cache LRU/TTL wyników analyze_frame (lokalizacja twarzy,
+    landmarki, kodowanie, EAR, werdykt detekcji ekranu), kluczowany skrótem
+    bajtów uploadu. Kiosk i klienci ponawiający upload wysyłają często te
+    same klatki – trafienie oszczędza detekcję spoofingu i kodowanie.
+
+    Klucz to skrót dokładnej zawartości pliku i – dla analizy śledzonej –
+    ramki z poprzedniej klatki (track_from), więc trafienie oznacza identyczny
+    obraz analizowany w ten sam sposób i identyczny wynik. Analiza śledzona
+    (detekcja w oknie wokół ramki) nie zastępuje analizy całej klatki i odwrotnie.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        ttl: float = 60.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(data: bytes, track_from: Optional[tuple] = None) -> bytes:
+        digest = hashlib.blake2b(data, digest_size=16)
+        if track_from is not None:
+            digest.update(repr(tuple(int(v) for v in track_from)).encode("ascii"))
+        return digest.digest()
+
+    def get(self, key: bytes, check_spoof: bool = False) -> Optional[dict]:
+        """
+        Zwraca zapamiętaną analizę albo None. Wpis bez werdyktu detekcji
+        ekranu nie wystarcza, gdy check_spoof=True (klatka główna).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, analysis = entry
+                if self._clock() - stored_at > self.ttl:
+                    del self._entries[key]
+                    entry = None
+                elif check_spoof and analysis["screen_spoof"] is None:
+                    entry = None
+                else:
+                    self._entries.move_to_end(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: bytes, analysis: dict):
+        with self._lock:
+            self._entries[key] = (self._clock(), analysis)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Awaitable, Callable, Optional
+
+
+class ResolvedBadge:
+    """
+    Niezmienna migawka przepustki i jej właściciela – to, czego potrzebują
+    /api/check-qr, /api/verify i /ws/verify. Nie jest powiązana z sesją
+    SQLAlchemy, więc może żyć w cache dłużej niż sesja, która ją wczytała.
+    """
+
+    __slots__ = (
+        "badge_id", "user_id", "valid_until",
+        "user_exists", "is_active", "face_id", "first_name", "last_name",
+    )
+
+    def __init__(self, badge, user):
+        self.badge_id = badge.id
+        self.user_id = badge.user_id
+        self.valid_until = badge.valid_until
+        self.user_exists = user is not None
+        self.is_active = bool(user and user.is_active)
+        self.face_id = user.face_id if user else None
+        self.first_name = user.first_name if user else None
+        self.last_name = user.last_name if user else None
+
+    def expired(self, today: Optional[date] = None) -> bool:
+        # Ważność liczona przy każdym użyciu – wpis może przeżyć północ
+        return bool(self.valid_until and self.valid_until < (today or date.today()))
+
+    def error(self) -> Optional[str]:
+        """Powód odrzucenia przepustki albo None, gdy jest ważna."""
+        if self.expired():
+            return "Przepustka wygasła"
+        if not self.is_active:
+            return "Użytkownik nieaktywny"
+        return None
+
+
+# Wpis dla kodu QR, którego nie ma w bazie (odróżniony od braku wpisu w cache)
+MISSING = object()
+
+
+class BadgeCache:
+    """
+    Cache LRU/TTL w procesie: qr_code -> ResolvedBadge (albo MISSING dla
+    nieznanego kodu). Kiosk odpytuje check-qr wielokrotnie, gdy pracownik
+    stoi przy bramce – trafienie nie dotyka bazy.
+
+    Zapis przez API (create_user, create_badge, przyszłe zmiany i
+    dezaktywacje) po commicie unieważnia wpisy: invalidate_qr po kodzie
+    przepustki, invalidate_user po właścicielu. Licznik generacji odrzuca
+    wynik odczytu, który zaczął się przed unieważnieniem – bez tego
+    równoległy check-qr mógłby odłożyć do cache stan sprzed zapisu.
+    TTL ogranicza czas życia zmian wykonanych poza API (np. ręcznie w bazie).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        ttl: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, qr_code: str):
+        """Zapamiętany wynik (ResolvedBadge albo MISSING) lub None przy chybieniu."""
+        with self._lock:
+            entry = self._entries.get(qr_code)
+            if entry is not None and self._clock() - entry[0] > self.ttl:
+                del self._entries[qr_code]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(qr_code)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._generation
+
+    def put(self, qr_code: str, value, generation: Optional[int] = None):
+        """
+        Zapisuje wynik odczytu. Z podaną generacją (z generation() sprzed
+        odczytu) wynik jest pomijany, jeśli w międzyczasie coś unieważniono.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[qr_code] = (self._clock(), value)
+            self._entries.move_to_end(qr_code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def resolve(self, qr_code: str, load: Callable[[str], Awaitable]):
+        """
+        Wynik z cache albo z `load(qr_code)` (ResolvedBadge lub None dla
+        nieznanego kodu). Zwraca ResolvedBadge albo None.
+        """
+        value = self.get(qr_code)
+        if value is None:
+            generation = self.generation()
+            value = await load(qr_code)
+            if value is None:
+                value = MISSING
+            self.put(qr_code, value, generation)
+        return None if value is MISSING else value
+
+    def invalidate_qr(self, qr_code: str):
+        with self._lock:
+            self._generation += 1
+            if self._entries.pop(qr_code, None) is not None:
+                self.invalidations += 1
+
+    def invalidate_user(self, user_id: int):
+        """Usuwa wpisy wszystkich przepustek użytkownika (zmiana danych lub dezaktywacja)."""
+        with self._lock:
+            self._generation += 1
+            stale = [
+                qr_code for qr_code, (_, value) in self._entries.items()
+                if value is not MISSING and value.user_id == user_id
+            ]
+            for qr_code in stale:
+                del self._entries[qr_code]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
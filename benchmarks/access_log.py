@@ -0,0 +1,111 @@
+"""
+Zapis logu dostępu: commit na każde żądanie (dawny handler, dziennik
+rollback) względem AccessLogWriter (partie, tryb WAL).
+
+--gates bramek jednocześnie wysyła po --requests wpisów; każda bramka
+czeka na id swojego wpisu przed kolejnym. Raport: wpisy na sekundę,
+średnia i p99 czasu oczekiwania na id, liczba commitów.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.access_log --gates 16 --requests 50
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from access_log_writer import AccessLogWriter
+from database import AccessLog, Base, configure_sqlite
+
+
+def session_factory(path: str, wal: bool):
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    if wal:
+        configure_sqlite(engine)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def record(i: int) -> dict:
+    return {
+        "timestamp": datetime.now(),
+        "result": "ACCEPT",
+        "match_score": 0.9,
+        "badge_id": None,
+        "user_id": None,
+        "image_path": f"uploads/{i}.jpg",
+    }
+
+
+async def run_gates(write, gates: int, requests: int):
+    latencies = []
+
+    async def gate(g: int):
+        for r in range(requests):
+            start = time.perf_counter()
+            await write(record(g * requests + r))
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[gate(g) for g in range(gates)])
+    return time.perf_counter() - start, latencies
+
+
+def report(name: str, elapsed: float, latencies: list, commits: int):
+    ms = np.asarray(latencies) * 1000.0
+    print(
+        f"{name:<22} {len(ms) / elapsed:>9.0f} {ms.mean():>9.2f} "
+        f"{np.percentile(ms, 99):>9.2f} {commits:>8}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--gates", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+
+    print(f"{'wariant':<22} {'wpisy/s':>9} {'śr. ms':>9} {'p99 ms':>9} {'commity':>8}")
+
+    # Dawny handler: synchroniczny commit w pętli zdarzeń
+    Session = session_factory(os.path.join(directory, "per_request.db"), wal=False)
+
+    async def write_and_commit(fields):
+        db = Session()
+        try:
+            log = AccessLog(**fields)
+            db.add(log)
+            db.commit()
+            return log.id
+        finally:
+            db.close()
+
+    elapsed, latencies = asyncio.run(run_gates(write_and_commit, args.gates, args.requests))
+    report("commit na żądanie", elapsed, latencies, len(latencies))
+
+    writer = AccessLogWriter(
+        session_factory(os.path.join(directory, "group.db"), wal=True),
+        max_batch=args.max_batch,
+        max_delay=args.max_delay,
+    )
+
+    async def grouped():
+        result = await run_gates(lambda fields: writer.write(**fields), args.gates, args.requests)
+        await writer.stop()
+        return result
+
+    elapsed, latencies = asyncio.run(grouped())
+    report("partie + WAL", elapsed, latencies, writer.stats()["batches"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark recall vs latencja: indeks IVF względem dokładnego ExactIndex.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.ann_index --identities 20000 --per-identity 5
+"""
+import argparse
+import time
+
+import numpy as np
+
+from face_index import ExactIndex, IVFIndex
+
+
+def synthetic_gallery(identities: int, per_identity: int, queries: int, seed: int = 0):
+    # Rozkład zbliżony do kodowań dlib: odległość między osobami ~1.0,
+    # między zdjęciami tej samej osoby ~0.4.
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0, 0.06, (identities, 128)).astype(np.float32)
+    owners = np.repeat(np.arange(identities), per_identity)
+    vectors = centers[owners] + rng.normal(0, 0.025, (len(owners), 128)).astype(np.float32)
+    query_owners = rng.integers(0, identities, queries)
+    query_vectors = centers[query_owners] + rng.normal(0, 0.025, (queries, 128)).astype(np.float32)
+    return vectors, owners, query_vectors
+
+
+def timed_search(index, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(index.search(query)[0])
+    elapsed_ms = (time.perf_counter() - start) * 1000.0 / len(queries)
+    return np.asarray(results), elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--identities", type=int, default=20000)
+    parser.add_argument("--per-identity", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    vectors, owners, queries = synthetic_gallery(args.identities, args.per_identity, args.queries)
+    print(f"Galeria: {len(vectors)} kodowań, {args.identities} osób, {len(queries)} zapytań")
+
+    exact = ExactIndex()
+    exact.build(vectors)
+    exact_rows, exact_ms = timed_search(exact, queries)
+    print(f"{'backend':<16}{'recall@1':>10}{'owner recall':>14}{'ms/zapytanie':>14}{'przyspieszenie':>16}")
+    print(f"{'exact':<16}{1.0:>10.4f}{1.0:>14.4f}{exact_ms:>14.3f}{1.0:>16.1f}")
+
+    ivf = IVFIndex(nlist=args.nlist, min_train_size=1)
+    start = time.perf_counter()
+    ivf.build(vectors)
+    build_s = time.perf_counter() - start
+
+    for nprobe in args.nprobe:
+        ivf.nprobe = nprobe
+        rows, ms = timed_search(ivf, queries)
+        recall = float(np.mean(rows == exact_rows))
+        owner_recall = float(np.mean(owners[rows] == owners[exact_rows]))
+        print(f"{'ivf nprobe=' + str(nprobe):<16}{recall:>10.4f}{owner_recall:>14.4f}{ms:>14.3f}{exact_ms / ms:>16.1f}")
+
+    print(f"Budowa IVF ({len(ivf.centroids)} list): {build_s:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
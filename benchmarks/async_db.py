@@ -0,0 +1,153 @@
+"""
+Sesje synchroniczne (Session w handlerze async – zapytanie blokuje pętlę
+zdarzeń) względem warstwy asynchronicznej (AsyncSession, aiosqlite, pula
+połączeń i PRAGMA z database.SQLITE_PRAGMAS).
+
+Każde "żądanie" to zapytania handlerów /api/check-qr (przepustka po kodzie
+QR + użytkownik) i /api/logs (ostatnie --limit wpisów). --concurrency żądań
+działa jednocześnie, a zadanie kontrolne co 1 ms mierzy opóźnienie pętli
+zdarzeń (czas, w którym nie mogła obsłużyć innych klientów).
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.async_db --concurrency 32 --requests 2000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
+
+from database import AccessLog, Badge, Base, User, configure_sqlite
+
+
+def populate(path: str, users: int, logs: int):
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    with sessionmaker(bind=engine)() as db:
+        db.add_all(
+            User(id=i, face_id=f"F{i}", first_name="Jan", last_name="Kowalski", is_active=True)
+            for i in range(1, users + 1)
+        )
+        db.add_all(
+            Badge(id=i, qr_code=f"QR{i:06d}", valid_until=date(2030, 1, 1), user_id=i)
+            for i in range(1, users + 1)
+        )
+        now = datetime.now()
+        db.add_all(
+            AccessLog(
+                timestamp=now - timedelta(seconds=i), result="ACCEPT", match_score=0.9,
+                badge_id=i % users + 1, user_id=i % users + 1,
+            )
+            for i in range(logs)
+        )
+        db.commit()
+    engine.dispose()
+
+
+async def measure(request, concurrency: int, requests: int):
+    latencies = []
+    lag = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag.append(time.perf_counter() - start - 0.001)
+
+    async def client(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - start)
+
+    monitor = asyncio.ensure_future(heartbeat())
+    start = time.perf_counter()
+    await asyncio.gather(*[client(requests // concurrency) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    done.set()
+    await monitor
+    return elapsed, latencies, lag
+
+
+def report(name: str, elapsed: float, latencies: list, lag: list):
+    ms = np.asarray(latencies) * 1000.0
+    lag_ms = np.asarray(lag) * 1000.0
+    print(
+        f"{name:<24} {len(ms) / elapsed:>8.0f} {np.percentile(ms, 50):>8.2f} "
+        f"{np.percentile(ms, 99):>8.2f} {lag_ms.max():>11.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--logs", type=int, default=50000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    populate(path, args.users, args.logs)
+    rng = random.Random(0)
+
+    def qr_code():
+        return f"QR{rng.randint(1, args.users):06d}"
+
+    print(f"{'wariant':<24} {'żądania/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max lag ms':>11}")
+
+    # Dotychczasowy handler: Session z get_db (bez PRAGMA) wołana z async def
+    Session = sessionmaker(bind=create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    ))
+
+    async def sync_request():
+        db = Session()
+        try:
+            badge = db.query(Badge).filter(Badge.qr_code == qr_code()).first()
+            db.query(User).filter(User.id == badge.user_id).first()
+            db.query(AccessLog).order_by(AccessLog.timestamp.desc()).limit(args.limit).all()
+        finally:
+            db.close()
+
+    report("sync Session", *asyncio.run(measure(sync_request, args.concurrency, args.requests)))
+
+    def async_variant(name: str, **engine_options):
+        async def run():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{path}", **engine_options)
+            configure_sqlite(engine.sync_engine)
+            AsyncSession = async_sessionmaker(engine, expire_on_commit=False)
+
+            async def request():
+                async with AsyncSession() as db:
+                    badge = await db.scalar(select(Badge).where(Badge.qr_code == qr_code()))
+                    await db.get(User, badge.user_id)
+                    logs = await db.scalars(
+                        select(AccessLog).order_by(AccessLog.timestamp.desc()).limit(args.limit)
+                    )
+                    logs.all()
+
+            try:
+                return await measure(request, args.concurrency, args.requests)
+            finally:
+                await engine.dispose()
+
+        report(name, *asyncio.run(run()))
+
+    async_variant("async NullPool", poolclass=NullPool)
+    async_variant(
+        "async pula + PRAGMA", poolclass=AsyncAdaptedQueuePool, pool_size=8, max_overflow=8
+    )
+
+
+if __name__ == "__main__":
+    main()
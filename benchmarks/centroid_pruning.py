@@ -0,0 +1,72 @@
+"""
+Dopasowanie 1:N z przycinaniem po centroidach (GallerySnapshot z CentroidBounds)
+względem przeszukania wszystkich wierszy (ExactIndex.search).
+
+Zapytania to próbki znanych osób i osoby spoza galerii. Raport: zgodność
+wyników (wiersz i odległość muszą być identyczne), czas na zapytanie
+i odsetek wierszy pominiętych dzięki przycinaniu.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.centroid_pruning --identities 20000 --per-identity 5
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.ann_index import synthetic_gallery
+from face_index import ExactIndex
+from gallery import GallerySnapshot, PruningStats
+
+
+def timed(search, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(search(query))
+    return results, (time.perf_counter() - start) * 1000.0 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--identities", type=int, default=20000)
+    parser.add_argument("--per-identity", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors, owners, known = synthetic_gallery(
+        args.identities, args.per_identity, args.queries, args.seed
+    )
+    rng = np.random.default_rng(args.seed + 1)
+    unknown = rng.normal(0, 0.06, (args.queries, 128)).astype(np.float32)
+    face_ids = [f"ID{i}" for i in range(args.identities)]
+
+    index = ExactIndex()
+    index.build(vectors)
+    start = time.perf_counter()
+    stats = PruningStats()
+    gallery = GallerySnapshot.build(index, owners, face_ids, 0, pruning=True, stats=stats)
+    build_s = time.perf_counter() - start
+    print(f"Galeria: {len(vectors)} wektorów, {args.identities} osób (centroidy: {build_s:.2f} s)")
+    print(f"{'zapytania':<10} {'pełne ms':>9} {'przyc. ms':>10} {'pominięte':>10} {'różnice':>8}")
+
+    mismatches = 0
+    for name, queries in (("znane", known), ("nieznane", unknown)):
+        exhaustive, exhaustive_ms = timed(index.search, queries)
+        stats.drain()
+        pruned, pruned_ms = timed(gallery._pruned_search, queries)
+        counters = stats.stats()
+
+        differences = sum(1 for a, b in zip(exhaustive, pruned) if a != b)
+        mismatches += differences
+        print(
+            f"{name:<10} {exhaustive_ms:>9.2f} {pruned_ms:>10.2f} "
+            f"{counters['skipped_ratio']:>10.1%} {differences:>8}"
+        )
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Odczyt logu dostępu przez /api/logs: strona z OFFSET względem kursora
+(keyset), serializacja obiektów ORM przez AccessLogResponse względem
+wierszy przez orjson, oraz eksport całego zakresu jedną listą względem
+strumienia NDJSON (access_log_query.stream_ndjson).
+
+Raport: czas strony na różnej głębokości, czas serializacji strony
+i czas oraz szczyt pamięci (tracemalloc, osobny przebieg) eksportu --rows
+wpisów.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.log_export --rows 1000000
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import orjson
+from sqlalchemy import create_engine, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from access_log_query import encode_cursor, logs_query, stream_ndjson
+from benchmarks.log_indexes import populate
+from database import AccessLog, migrate_db
+from models import AccessLogResponse
+
+
+def measure(function, repeat: int = 1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        value = function()
+    return value, (time.perf_counter() - start) * 1000.0 / repeat
+
+
+async def measure_async(coroutine_function):
+    start = time.perf_counter()
+    value = await coroutine_function()
+    elapsed = time.perf_counter() - start
+    # Pamięć w osobnym przebiegu – tracemalloc wielokrotnie spowalnia alokacje
+    tracemalloc.start()
+    await coroutine_function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return value, elapsed, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "logs.db")
+    engine = create_engine(f"sqlite:///{path}")
+    populate(engine, args.rows, args.users, step_seconds=3)
+    migrate_db(engine)
+    engine.dispose()
+
+    print(f"Strona {args.page} wpisów (ms):")
+    print(f"{'głębokość':>10} {'OFFSET':>10} {'kursor':>10}")
+    with engine.connect() as connection:
+        for depth in (0, args.rows // 10, args.rows // 2, args.rows - args.page):
+            offset_query = (
+                select(AccessLog)
+                .order_by(AccessLog.timestamp.desc(), AccessLog.id.desc())
+                .offset(depth).limit(args.page)
+            )
+            _, offset_ms = measure(lambda: connection.execute(offset_query).all(), 10)
+            # Kursor wskazuje wpis tuż przed stroną (jak z poprzedniej odpowiedzi)
+            cursor = None
+            if depth:
+                row = connection.execute(
+                    logs_query().offset(depth - 1).limit(1)
+                ).mappings().first()
+                cursor = encode_cursor(row["timestamp"], row["id"])
+            _, keyset_ms = measure(
+                lambda: connection.execute(logs_query(cursor=cursor).limit(args.page)).all(), 10
+            )
+            print(f"{depth:>10} {offset_ms:>10.1f} {keyset_ms:>10.1f}")
+
+    with Session(engine) as db:
+        objects = db.scalars(
+            select(AccessLog).order_by(AccessLog.timestamp.desc()).limit(args.page)
+        ).all()
+        _, pydantic_ms = measure(lambda: json.dumps([
+            AccessLogResponse.model_validate(log).model_dump(mode="json") for log in objects
+        ]), 20)
+        rows = db.execute(logs_query().limit(args.page)).mappings().all()
+        _, orjson_ms = measure(lambda: orjson.dumps([dict(row) for row in rows]), 20)
+    print(f"\nSerializacja strony (ms): AccessLogResponse {pydantic_ms:.2f}, orjson {orjson_ms:.2f}")
+
+    async def export():
+        async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        Session = async_sessionmaker(async_engine)
+
+        async def as_list():
+            async with Session() as db:
+                logs = (await db.scalars(
+                    select(AccessLog).order_by(AccessLog.timestamp.desc())
+                )).all()
+                return len(json.dumps([
+                    AccessLogResponse.model_validate(log).model_dump(mode="json") for log in logs
+                ]))
+
+        async def as_stream():
+            size = 0
+            async for chunk in stream_ndjson(Session, logs_query(), batch_size=args.batch):
+                size += len(chunk)
+            return size
+
+        try:
+            return await measure_async(as_list), await measure_async(as_stream)
+        finally:
+            await async_engine.dispose()
+
+    listed, streamed = asyncio.run(export())
+    print(f"\nEksport {args.rows} wpisów:")
+    print(f"{'wariant':<16} {'s':>8} {'szczyt MB':>10} {'MB danych':>10}")
+    for name, (size, seconds, peak_mb) in (("lista + Pydantic", listed), ("NDJSON strumień", streamed)):
+        print(f"{name:<16} {seconds:>8.1f} {peak_mb:>10.1f} {size / 2**20:>10.1f}")
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Indeksy tabeli access_logs: plany i czasy zapytań /api/logs i raportów
+na syntetycznej tabeli (domyślnie 10 mln wpisów) przed i po migracji
+(database.migrate_db), oraz odczyt przepustki z właścicielem: dwa
+zapytania względem jednego z JOIN (database.badge_with_user).
+
+Tabela powstaje w pliku tymczasowym (ok. 0,6 GB przy 10 mln wierszy) za
+pomocą rekurencyjnego CTE – bez indeksów, jak w bazie sprzed migracji.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.log_indexes --rows 10000000
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.orm import sessionmaker
+
+from database import AccessLog, Badge, Base, User, badge_with_user, migrate_db
+
+
+def populate(engine, rows: int, users: int, step_seconds: int):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        # Tabela jak przed migracją – bez indeksów z __table_args__
+        for index in AccessLog.__table__.indexes:
+            connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        connection.execute(text(
+            "INSERT INTO users (id, face_id, is_active, first_name, last_name) "
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :users) "
+            "SELECT i, 'F' || i, 1, 'Jan', 'Kowalski' FROM n"
+        ), {"users": users})
+        connection.execute(text(
+            "INSERT INTO badges (id, qr_code, valid_until, user_id) "
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :users) "
+            "SELECT i, printf('QR%06d', i), '2030-01-01', i FROM n"
+        ), {"users": users})
+        # Format czasu jak zapisuje go SQLAlchemy (DateTime w SQLite to tekst)
+        connection.execute(text(
+            "INSERT INTO access_logs (timestamp, result, match_score, badge_id, user_id) "
+            "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows) "
+            "SELECT datetime('now', '-' || (i * :step) || ' seconds') || '.000000', "
+            "CASE WHEN i % 50 = 0 THEN 'SUSPICIOUS' WHEN i % 10 = 0 THEN 'REJECT' ELSE 'ACCEPT' END, "
+            "0.9, (i * 7919) % :users + 1, (i * 7919) % :users + 1 FROM n"
+        ), {"rows": rows, "step": step_seconds, "users": users})
+
+
+def queries(users: int):
+    day_ago = datetime.now() - timedelta(days=1)
+    month_ago = datetime.now() - timedelta(days=30)
+    now = datetime.now()
+    user_id = users // 2
+    return [
+        ("logi: ostatnie 100",
+         select(AccessLog).order_by(AccessLog.timestamp.desc()).limit(100)),
+        ("logi: ostatnia doba",
+         select(AccessLog).where(AccessLog.timestamp >= day_ago)
+         .order_by(AccessLog.timestamp.desc()).limit(100)),
+        ("raport: 30 dni",
+         select(AccessLog).where(AccessLog.timestamp >= month_ago, AccessLog.timestamp <= now)),
+        ("raport: użytkownik",
+         select(AccessLog).where(
+             AccessLog.user_id == user_id,
+             AccessLog.timestamp >= month_ago, AccessLog.timestamp <= now,
+         )),
+        ("raport: SUSPICIOUS",
+         select(AccessLog).where(
+             AccessLog.result == "SUSPICIOUS",
+             AccessLog.timestamp >= month_ago, AccessLog.timestamp <= now,
+         )),
+    ]
+
+
+def run_queries(engine, statements, repeat: int):
+    results = []
+    with engine.connect() as connection:
+        for name, statement in statements:
+            compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+            plan = "; ".join(
+                row[-1] for row in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+            )
+            start = time.perf_counter()
+            for _ in range(repeat):
+                rows = len(connection.execute(statement).all())
+            results.append((name, (time.perf_counter() - start) * 1000.0 / repeat, rows, plan))
+    return results
+
+
+def badge_lookups(engine, users: int, lookups: int):
+    Session = sessionmaker(bind=engine)
+    codes = [f"QR{random.Random(i).randint(1, users):06d}" for i in range(lookups)]
+    timings = {}
+    with Session() as db:
+        start = time.perf_counter()
+        for code in codes:
+            badge = db.scalar(select(Badge).where(Badge.qr_code == code))
+            db.get(User, badge.user_id)
+            db.expunge_all()
+        timings["dwa zapytania"] = time.perf_counter() - start
+        start = time.perf_counter()
+        for code in codes:
+            db.execute(badge_with_user(code)).first()
+            db.expunge_all()
+        timings["JOIN"] = time.perf_counter() - start
+    return {name: seconds * 1e6 / lookups for name, seconds in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--step", type=int, default=3, help="sekundy między wpisami")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "logs.db")
+    engine = create_engine(f"sqlite:///{path}")
+    start = time.perf_counter()
+    populate(engine, args.rows, args.users, args.step)
+    print(f"Tabela: {args.rows} wpisów, {args.users} użytkowników "
+          f"({time.perf_counter() - start:.0f} s, {os.path.getsize(path) / 2**30:.2f} GB)")
+
+    statements = queries(args.users)
+    before = run_queries(engine, statements, args.repeat)
+    start = time.perf_counter()
+    migrate_db(engine)
+    # Nowe połączenia – bez zapamiętanych (przygotowanych) planów sprzed migracji
+    engine.dispose()
+    print(f"Migracja (utworzenie indeksów): {time.perf_counter() - start:.1f} s")
+    after = run_queries(engine, statements, args.repeat)
+
+    print(f"{'zapytanie':<22} {'wiersze':>8} {'bez ms':>10} {'z ind. ms':>10}")
+    for (name, before_ms, rows, _), (_, after_ms, _, _) in zip(before, after):
+        print(f"{name:<22} {rows:>8} {before_ms:>10.1f} {after_ms:>10.1f}")
+    print("\nPlany zapytań:")
+    for (name, _, _, before_plan), (_, _, _, after_plan) in zip(before, after):
+        print(f"  {name}\n    przed: {before_plan}\n    po:    {after_plan}")
+
+    lookups = badge_lookups(engine, args.users, args.lookups)
+    print("\nOdczyt przepustki z właścicielem (µs/odczyt): "
+          + ", ".join(f"{name} {us:.0f}" for name, us in lookups.items()))
+    engine.dispose()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
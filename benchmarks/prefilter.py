@@ -0,0 +1,87 @@
+"""
+Filtr wstępny (kaskada Haara, FacePrefilter) przed detekcją HOG: czas
+detekcji na klatkę z filtrem i bez niego oraz pomyłki filtra.
+
+Klatki: zdjęcia z katalogu --images (z twarzą i bez) oraz --empty
+syntetycznych pustych klatek kiosku (jednolite tło z szumem i gradientem).
+Raport: ms/klatka bez filtra i z filtrem, liczba odrzuconych klatek i klatek
+z twarzą według HOG, które filtr odrzucił (pomyłki).
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.prefilter --images /ścieżka/do/zdjęć
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from face_recognition_service import FaceRecognitionService
+from frame import Frame
+
+
+def empty_frames(count: int, size, seed: int):
+    rng = np.random.default_rng(seed)
+    h, w = size
+    for _ in range(count):
+        base = rng.uniform(40, 200)
+        gradient = np.linspace(0, rng.uniform(-40, 40), w)[None, :]
+        noise = rng.normal(0, rng.uniform(2, 10), (h, w))
+        gray = np.clip(base + gradient + noise, 0, 255).astype(np.uint8)
+        yield cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+
+
+def detect_all(service: FaceRecognitionService, images):
+    found = []
+    start = time.perf_counter()
+    for bgr in images:
+        found.append(bool(service._face_locations(Frame(bgr))))
+    return found, (time.perf_counter() - start) * 1000.0 / max(1, len(images))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", required=True, help="katalog ze zdjęciami")
+    parser.add_argument("--empty", type=int, default=20, help="syntetyczne puste klatki")
+    parser.add_argument("--max-side", type=int, default=640, help="detection_max_side")
+    parser.add_argument("--min-neighbors", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    images = []
+    for filename in sorted(os.listdir(args.images)):
+        bgr = cv2.imread(os.path.join(args.images, filename))
+        if bgr is not None:
+            images.append(bgr)
+    images += list(empty_frames(args.empty, (480, 640), args.seed))
+
+    encodings_dir = tempfile.mkdtemp()
+    plain = FaceRecognitionService(
+        encodings_dir=encodings_dir,
+        detection_max_side=args.max_side,
+        prefilter_options={"enabled": False},
+    )
+    filtered = FaceRecognitionService(
+        encodings_dir=encodings_dir,
+        detection_max_side=args.max_side,
+        prefilter_options={"min_neighbors": args.min_neighbors, "audit_rate": 0.0},
+    )
+    if not filtered.prefilter.enabled:
+        print("Kaskada niedostępna w tej instalacji OpenCV")
+        return
+
+    reference, plain_ms = detect_all(plain, images)
+    found, filtered_ms = detect_all(filtered, images)
+    stats = filtered.prefilter.stats.stats()
+    misses = sum(1 for a, b in zip(reference, found) if a and not b)
+
+    print(f"Klatki: {len(images)} (z twarzą wg HOG: {sum(reference)}, puste syntetyczne: {args.empty})")
+    print(f"{'wariant':<10} {'ms/klatka':>10} {'odrzucone':>10} {'pomyłki':>8}")
+    print(f"{'HOG':<10} {plain_ms:>10.1f} {'-':>10} {'-':>8}")
+    print(f"{'filtr+HOG':<10} {filtered_ms:>10.1f} {stats['rejected']:>10} {misses:>8}")
+
+
+if __name__ == "__main__":
+    main()
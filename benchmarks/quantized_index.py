@@ -0,0 +1,98 @@
+"""
+Pamięć i latencja galerii skwantowanej (QuantizedIndex int8/float16)
+względem dawnego układu (słownik face_id -> lista wektorów float64)
+i dokładnego indeksu float32 (ExactIndex).
+
+Raport: MB pamięci procesu na 100 tys. kodowań, czas zapytania i zgodność
+z wynikiem dokładnym (wiersz, odległość i decyzja przy progu --threshold).
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.quantized_index --identities 20000 --per-identity 5
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.ann_index import synthetic_gallery
+from face_index import ExactIndex, QuantizedIndex
+
+
+def dict_gallery_bytes(gallery: dict) -> int:
+    # Tablica float64 (128 x 8 B) + nagłówek obiektu ndarray + wpis w liście
+    return sum(
+        sum(vector.nbytes + sys.getsizeof(vector) - vector.nbytes + 8 for vector in vectors)
+        + sys.getsizeof(vectors)
+        for vectors in gallery.values()
+    )
+
+
+def dict_gallery_search(gallery: dict, encoding: np.ndarray):
+    best = None
+    for face_id, vectors in gallery.items():
+        distance = float(np.min(np.linalg.norm(np.asarray(vectors) - encoding, axis=1)))
+        if best is None or distance < best[1]:
+            best = (face_id, distance)
+    return best
+
+
+def timed(search, queries):
+    results = []
+    start = time.perf_counter()
+    for query in queries:
+        results.append(search(query))
+    return results, (time.perf_counter() - start) * 1000.0 / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--identities", type=int, default=20000)
+    parser.add_argument("--per-identity", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors, owners, known = synthetic_gallery(
+        args.identities, args.per_identity, args.queries, args.seed
+    )
+    rng = np.random.default_rng(args.seed + 1)
+    unknown = rng.normal(0, 0.06, (args.queries // 2, 128)).astype(np.float32)
+    queries = np.concatenate([known, unknown])
+    per_100k = 100000.0 / len(vectors) / 1e6
+
+    legacy = {}
+    for vector, owner in zip(vectors, owners):
+        legacy.setdefault(int(owner), []).append(vector.astype(np.float64))
+    _, legacy_ms = timed(lambda q: dict_gallery_search(legacy, q), queries[:20])
+
+    exact = ExactIndex()
+    exact.build(vectors)
+    reference, exact_ms = timed(exact.search, queries)
+
+    print(f"Galeria: {len(vectors)} wektorów, zapytania: {len(queries)}")
+    print(f"{'wariant':<18} {'MB/100k':>8} {'ms/zapytanie':>13} {'różne wyniki':>13} {'różne decyzje':>14}")
+    print(f"{'dict float64':<18} {dict_gallery_bytes(legacy) * per_100k:>8.1f} {legacy_ms:>13.2f} {'-':>13} {'-':>14}")
+    print(f"{'exact float32':<18} {vectors.nbytes * per_100k:>8.1f} {exact_ms:>13.2f} {0:>13} {0:>14}")
+
+    mismatches = 0
+    for dtype in QuantizedIndex.DTYPES:
+        index = QuantizedIndex(dtype=dtype)
+        index.build(vectors)
+        results, elapsed_ms = timed(index.search, queries)
+        different = sum(1 for a, b in zip(results, reference) if a != b)
+        decisions = sum(
+            1 for a, b in zip(results, reference)
+            if (a[1] <= args.threshold) != (b[1] <= args.threshold)
+        )
+        mismatches += different
+        print(
+            f"{'quantized ' + dtype:<18} {index.memory_bytes() * per_100k:>8.1f} "
+            f"{elapsed_ms:>13.2f} {different:>13} {decisions:>14}"
+        )
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
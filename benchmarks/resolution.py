@@ -0,0 +1,199 @@
+"""
+Dokładność vs latencja dla polityki rozdzielczości i profili modeli
+(FaceRecognitionService: detection_max_side, profiles).
+
+Dla każdego zdjęcia z twarzą z katalogu --images:
+1. Rozdzielczość detekcji: zdjęcie powiększone do rozmiarów typowych dla
+   telefonów (--sizes) przechodzi detekcję i kodowanie przy różnych
+   detection_max_side. Raport: skuteczność detekcji, odległość kodowania
+   od referencyjnego (pełna rozdzielczość oryginału) i czas na klatkę.
+2. Profile: dla każdego wariantu (landmarks, num_jitters) wzorzec z oryginału
+   i próbki z zaburzeniami (jasność, szum, przesunięcie). Raport: średnia
+   odległość do własnego wzorca (im mniej, tym stabilniej), do wzorców
+   innych zdjęć (jeśli jest ich kilka) i czas kodowania.
+3. Wycinek vs cała klatka: normalizacja wycinka wokół twarzy
+   (Frame.normalized_crop) porównana z tym samym obszarem całej
+   znormalizowanej klatki. Raport: średnia i największa różnica pikseli
+   oraz odległość kodowań liczonych z obu obrazów.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.resolution --images /ścieżka/do/zdjęć
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+from face_recognition_service import FaceRecognitionService
+from frame import Frame
+
+
+MAX_SIDES = [None, 1280, 960, 800, 640, 480]
+PROFILES = [
+    {"landmarks": "large", "num_jitters": 1},
+    {"landmarks": "large", "num_jitters": 3},
+    {"landmarks": "large", "num_jitters": 5},
+    {"landmarks": "small", "num_jitters": 1},
+    {"landmarks": "small", "num_jitters": 3},
+]
+
+
+def load_faces(directory: str, service: FaceRecognitionService):
+    faces = []
+    for filename in sorted(os.listdir(directory)):
+        bgr = cv2.imread(os.path.join(directory, filename))
+        if bgr is None:
+            continue
+        frame = Frame(bgr)
+        locations = service._face_locations(frame)
+        if not locations:
+            continue
+        _, reference = service._landmarks_and_encoding(
+            frame, locations[0], service.profiles["verify"]
+        )
+        faces.append((filename, bgr, reference))
+    return faces
+
+
+def perturbed(bgr: np.ndarray, rng: np.random.Generator, count: int):
+    h, w = bgr.shape[:2]
+    for _ in range(count):
+        alpha, beta = rng.uniform(0.8, 1.2), rng.uniform(-25, 25)
+        img = cv2.convertScaleAbs(bgr, alpha=alpha, beta=beta)
+        shift = np.float32([[1, 0, rng.uniform(-8, 8)], [0, 1, rng.uniform(-8, 8)]])
+        img = cv2.warpAffine(img, shift, (w, h), borderMode=cv2.BORDER_REFLECT)
+        noise = rng.normal(0, rng.uniform(2, 8), img.shape)
+        yield np.clip(img.astype(np.float32) + noise, 0, 255).astype(np.uint8)
+
+
+def resolution_table(faces, sizes, encodings_dir):
+    print(f"{'max_side':>9} {'rozmiar':>8} {'detekcja':>9} {'odl. od ref.':>13} {'ms/klatka':>10}")
+    for max_side in MAX_SIDES:
+        service = FaceRecognitionService(encodings_dir=encodings_dir, detection_max_side=max_side)
+        for size in sizes:
+            found, drifts, elapsed = 0, [], 0.0
+            for _, bgr, reference in faces:
+                scale = float(size) / max(bgr.shape[:2])
+                big = cv2.resize(bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+                start = time.perf_counter()
+                analysis = service.analyze_frame(Frame(big))
+                elapsed += time.perf_counter() - start
+
+                if analysis is not None and analysis["encoding"] is not None:
+                    found += 1
+                    drifts.append(float(np.linalg.norm(analysis["encoding"] - reference)))
+            drift = f"{np.mean(drifts):.4f}" if drifts else "-"
+            label = "pełna" if max_side is None else str(max_side)
+            print(
+                f"{label:>9} {size:>8} {found:>4}/{len(faces):<4} {drift:>13} "
+                f"{elapsed * 1000.0 / len(faces):>10.1f}"
+            )
+
+
+def profile_table(faces, encodings_dir, samples: int, seed: int):
+    print(f"{'landmarks':>9} {'jitters':>7} {'odl. własna':>12} {'odl. inne':>10} {'ms/kodowanie':>13}")
+    for options in PROFILES:
+        service = FaceRecognitionService(
+            encodings_dir=encodings_dir, profiles={"verify": options}
+        )
+        profile = service.profiles["verify"]
+        rng = np.random.default_rng(seed)
+
+        templates = []
+        genuine = []
+        elapsed, encodings = 0.0, 0
+        for _, bgr, _ in faces:
+            frame = Frame(bgr)
+            location = service._face_locations(frame)[0]
+            _, template = service._landmarks_and_encoding(frame, location, profile)
+            templates.append(template)
+
+            for img in perturbed(bgr, rng, samples):
+                probe_frame = Frame(img)
+                locations = service._face_locations(probe_frame)
+                if not locations:
+                    continue
+                start = time.perf_counter()
+                _, probe = service._landmarks_and_encoding(probe_frame, locations[0], profile)
+                elapsed += time.perf_counter() - start
+                encodings += 1
+                genuine.append(float(np.linalg.norm(probe - template)))
+
+        impostor = [
+            float(np.linalg.norm(a - b))
+            for i, a in enumerate(templates)
+            for b in templates[i + 1 :]
+        ]
+        impostor_text = f"{np.mean(impostor):.4f}" if impostor else "-"
+        print(
+            f"{profile['landmarks']:>9} {profile['num_jitters']:>7} "
+            f"{np.mean(genuine) if genuine else float('nan'):>12.4f} {impostor_text:>10} "
+            f"{elapsed * 1000.0 / max(1, encodings):>13.1f}"
+        )
+
+
+def crop_parity_table(faces, sizes, encodings_dir):
+    service = FaceRecognitionService(encodings_dir=encodings_dir, detection_max_side=None)
+    print("Wycinek vs cała klatka")
+    print(f"{'rozmiar':>8} {'śr. różnica':>12} {'maks. różnica':>14} {'odl. kodowań':>13}")
+    for size in sizes:
+        mean_diffs, max_diff, drifts = [], 0, []
+        for _, bgr, _ in faces:
+            scale = float(size) / max(bgr.shape[:2])
+            frame = Frame(cv2.resize(bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC))
+            locations = service._face_locations(frame)
+            if not locations:
+                continue
+            top, right, bottom, left = locations[0]
+            crop, x0, y0 = frame.normalized_crop(locations[0])
+            h, w = crop.shape[:2]
+            whole = frame.normalized_rgb[y0:y0 + h, x0:x0 + w]
+
+            diff = np.abs(crop.astype(np.int16) - whole.astype(np.int16))
+            mean_diffs.append(float(diff.mean()))
+            max_diff = max(max_diff, int(diff.max()))
+
+            local = (top - y0, right - x0, bottom - y0, left - x0)
+            a = face_recognition.face_encodings(crop, [local])[0]
+            b = face_recognition.face_encodings(whole, [local])[0]
+            drifts.append(float(np.linalg.norm(a - b)))
+        if not drifts:
+            print(f"{size:>8} {'-':>12} {'-':>14} {'-':>13}")
+            continue
+        print(
+            f"{size:>8} {np.mean(mean_diffs):>12.2f} {max_diff:>14} "
+            f"{np.mean(drifts):>13.4f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", required=True, help="katalog ze zdjęciami twarzy")
+    parser.add_argument("--sizes", default="1280,1920,2560", help="dłuższe boki klatek testowych")
+    parser.add_argument("--samples", type=int, default=5, help="zaburzone próbki na zdjęcie")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    encodings_dir = tempfile.mkdtemp()
+    service = FaceRecognitionService(encodings_dir=encodings_dir)
+    faces = load_faces(args.images, service)
+    if not faces:
+        print("Brak zdjęć z wykrytą twarzą")
+        return
+    print(f"Zdjęcia z twarzą: {len(faces)}\n")
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    resolution_table(faces, sizes, encodings_dir)
+    print()
+    profile_table(faces, encodings_dir, args.samples, args.seed)
+    print()
+    crop_parity_table(faces, sizes, encodings_dir)
+
+
+if __name__ == "__main__":
+    main()
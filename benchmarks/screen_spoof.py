@@ -0,0 +1,256 @@
+"""
+Zgodność i czas detekcji ekranu/zdjęcia: etapowy detektor (screen_spoof)
+względem poprzedniej implementacji (kopia poniżej jako legacy_detect_screen_spoof).
+
+Zestaw testowy to syntetyczne klatki (tło, jasne prostokąty "ekranów" z ramką
+i wzorem moiré o losowych parametrach) oraz opcjonalnie zdjęcia z katalogu
+--images, także wklejone w sztuczny ekran.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.screen_spoof --fixtures 300 --images /ścieżka/do/zdjęć
+"""
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+import screen_spoof
+
+
+def legacy_detect_screen_spoof(gray: np.ndarray, has_face_fn) -> bool:
+    has_face = has_face_fn()
+
+    h, w = gray.shape[:2]
+    scale = 600.0 / max(h, w)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (int(w * scale), int(h * scale)))
+
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+
+    edges = cv2.Canny(blur, 50, 150)
+
+    contours, _ = cv2.findContours(
+        edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+    )
+
+    img_area = gray.shape[0] * gray.shape[1]
+    best_rect = None
+    best_area = 0.0
+
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < 0.15 * img_area:
+            continue
+
+        peri = cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
+
+        if len(approx) == 4:
+            x, y, w_box, h_box = cv2.boundingRect(approx)
+            aspect = w_box / float(h_box)
+
+            if 0.4 < aspect < 2.5:
+                if area > best_area:
+                    best_area = area
+                    best_rect = (x, y, w_box, h_box)
+
+    if best_rect is None:
+        return False
+
+    x, y, w_box, h_box = best_rect
+    roi = gray[y : y + h_box, x : x + w_box]
+    if roi.size == 0:
+        return False
+
+    mean_intensity = float(np.mean(roi))
+    std_intensity = float(np.std(roi))
+    uniform_score = 0
+    if mean_intensity > 160 and std_intensity < 35:
+        uniform_score = 1
+    if mean_intensity > 185 and std_intensity < 30:
+        uniform_score = 2
+
+    roi_edges = edges[y : y + h_box, x : x + w_box]
+    border = max(2, int(min(w_box, h_box) * 0.06))
+    top = roi_edges[:border, :]
+    bottom = roi_edges[-border:, :]
+    left = roi_edges[:, :border]
+    right = roi_edges[:, -border:]
+    border_edges = (
+        int(np.count_nonzero(top))
+        + int(np.count_nonzero(bottom))
+        + int(np.count_nonzero(left))
+        + int(np.count_nonzero(right))
+    )
+    border_area = (
+        top.size + bottom.size + left.size + right.size
+    )
+    border_edge_density = border_edges / float(max(1, border_area))
+    border_score = 0
+    if border_edge_density > 0.06:
+        border_score = 1
+    if border_edge_density > 0.10:
+        border_score = 2
+
+    moire_score = legacy_moire_score(roi)
+
+    area_ratio = best_area / float(img_area)
+    size_score = 0
+    if area_ratio > 0.25:
+        size_score = 1
+    if area_ratio > 0.40:
+        size_score = 2
+
+    total_score = uniform_score + border_score + moire_score + size_score
+
+    if has_face:
+        return total_score >= 5
+    else:
+        return total_score >= 4
+
+
+def legacy_moire_score(roi: np.ndarray) -> int:
+    moire_score = 0
+    try:
+        roi_small = cv2.resize(roi, (256, 256))
+        roi_small = roi_small.astype(np.float32)
+        roi_small -= float(np.mean(roi_small))
+        fft = np.fft.fft2(roi_small)
+        mag = np.abs(np.fft.fftshift(fft))
+        c = 128
+        r = 18
+        mag[c - r : c + r, c - r : c + r] = 0
+        m_mean = float(np.mean(mag))
+        m_std = float(np.std(mag))
+        flat = mag.reshape(-1)
+        if flat.size > 0:
+            topk = np.partition(flat, -10)[-10:]
+            peaks = [float(x) for x in topk if x > m_mean + 6.0 * m_std]
+            if len(peaks) >= 2:
+                moire_score = 1
+            if len(peaks) >= 5:
+                moire_score = 2
+    except Exception:
+        moire_score = 0
+    return moire_score
+
+
+def synthetic_fixtures(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    fixtures = []
+    for i in range(count):
+        h, w = int(rng.integers(360, 900)), int(rng.integers(480, 1200))
+        noise = rng.normal(0, 1, (h // 8 + 1, w // 8 + 1)).astype(np.float32)
+        background = cv2.resize(noise, (w, h), interpolation=cv2.INTER_CUBIC)
+        background = cv2.normalize(background, None, 20, int(rng.integers(90, 200)), cv2.NORM_MINMAX)
+        img = background.astype(np.uint8)
+
+        if i % 5 != 0:
+            # "Ekran": jasny prostokąt, szum, opcjonalna siatka moiré i ramka
+            ratio = rng.uniform(0.1, 0.8)
+            box_w = int(w * np.sqrt(ratio) * rng.uniform(0.8, 1.2))
+            box_h = int(h * np.sqrt(ratio) * rng.uniform(0.8, 1.2))
+            box_w, box_h = min(box_w, w - 4), min(box_h, h - 4)
+            x0 = int(rng.integers(0, w - box_w))
+            y0 = int(rng.integers(0, h - box_h))
+
+            yy, xx = np.mgrid[0:box_h, 0:box_w].astype(np.float32)
+            screen = np.full((box_h, box_w), rng.uniform(120, 235), dtype=np.float32)
+            screen += rng.normal(0, rng.uniform(2, 45), (box_h, box_w)).astype(np.float32)
+            amplitude = rng.choice([0.0, rng.uniform(3, 40)])
+            if amplitude:
+                fx, fy = rng.uniform(0.05, 0.45, 2)
+                screen += amplitude * np.sin(2 * np.pi * (fx * xx + fy * yy))
+            img[y0 : y0 + box_h, x0 : x0 + box_w] = np.clip(screen, 0, 255).astype(np.uint8)
+            thickness = int(rng.integers(1, 12))
+            cv2.rectangle(img, (x0, y0), (x0 + box_w - 1, y0 + box_h - 1), int(rng.integers(0, 60)), thickness)
+
+        fixtures.append((f"synthetic_{i}", cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)))
+    return fixtures
+
+
+def image_fixtures(directory: str):
+    fixtures = []
+    for filename in sorted(os.listdir(directory)):
+        bgr = cv2.imread(os.path.join(directory, filename))
+        if bgr is None:
+            continue
+        fixtures.append((filename, bgr))
+
+        # To samo zdjęcie "wyświetlone" na jasnym ekranie z ramką
+        h, w = bgr.shape[:2]
+        canvas = np.full((int(h * 1.4), int(w * 1.4), 3), 40, dtype=np.uint8)
+        y0, x0 = int(h * 0.2), int(w * 0.2)
+        bright = cv2.convertScaleAbs(bgr, alpha=0.6, beta=110)
+        canvas[y0 : y0 + h, x0 : x0 + w] = bright
+        cv2.rectangle(canvas, (x0, y0), (x0 + w - 1, y0 + h - 1), (0, 0, 0), 6)
+        fixtures.append((f"{filename} (ekran)", canvas))
+    return fixtures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fixtures", type=int, default=300, help="liczba klatek syntetycznych")
+    parser.add_argument("--images", default=None, help="katalog z dodatkowymi zdjęciami")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fixtures = synthetic_fixtures(args.fixtures, args.seed)
+    if args.images:
+        fixtures += image_fixtures(args.images)
+
+    face_calls = {"legacy": 0, "staged": 0}
+
+    def has_face_fn(bgr, name):
+        def has_face():
+            face_calls[name] += 1
+            return len(face_recognition.face_locations(cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB))) > 0
+        return has_face
+
+    mismatches = []
+    moire_mismatches = 0
+    timings = {"legacy": 0.0, "staged": 0.0}
+    for name, bgr in fixtures:
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+
+        start = time.perf_counter()
+        legacy = legacy_detect_screen_spoof(gray, has_face_fn(bgr, "legacy"))
+        timings["legacy"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        staged = screen_spoof.detect_screen_spoof(gray, has_face_fn(bgr, "staged"))
+        timings["staged"] += time.perf_counter() - start
+
+        if legacy != staged:
+            mismatches.append(name)
+
+        # Ocena moiré porównywana osobno – w werdykcie bywa maskowana przez inne oceny
+        small = screen_spoof.downscale(gray)
+        best_rect, _, _ = screen_spoof.find_screen_quad(small)
+        if best_rect is not None:
+            x, y, w_box, h_box = best_rect
+            roi = small[y : y + h_box, x : x + w_box]
+            if legacy_moire_score(roi) != screen_spoof.moire_score(roi):
+                moire_mismatches += 1
+
+    spoofs = sum(
+        legacy_detect_screen_spoof(cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY), lambda: False)
+        for _, bgr in fixtures
+    )
+    n = len(fixtures)
+    print(f"Klatki: {n} (werdykt 'ekran' bez twarzy: {spoofs})")
+    print(f"{'wariant':<10} {'ms/klatka':>10} {'detekcje twarzy':>16}")
+    for name in ("legacy", "staged"):
+        print(f"{name:<10} {timings[name] * 1000.0 / n:>10.2f} {face_calls[name]:>16}")
+    print(f"Różne werdykty: {len(mismatches)}, różne oceny moiré: {moire_mismatches}")
+    for name in mismatches:
+        print(f"  {name}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
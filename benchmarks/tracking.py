@@ -0,0 +1,81 @@
+"""
+Serie klatek weryfikacji: pełna detekcja w każdej klatce (analyze_frame bez
+śledzenia) względem śledzenia twarzy (analyze_burst – detekcja w oknie wokół
+ramki z poprzedniej klatki).
+
+Dla każdego zdjęcia z twarzą z katalogu --images budowana jest seria
+--frames klatek (zdjęcie w rozmiarze --size z zaburzeniami jasności, szumu
+i przesunięcia jak w benchmarks.resolution). Raport: czas na serię,
+klatki obsłużone przez śledzenie i największa różnica kodowania oraz EAR
+względem pełnej detekcji.
+
+Uruchomienie (z katalogu głównego projektu):
+    python -m benchmarks.tracking --images /ścieżka/do/zdjęć
+"""
+import argparse
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.resolution import load_faces, perturbed
+from face_recognition_service import FaceRecognitionService
+from frame import Frame
+
+
+def timed_burst(analyze, images):
+    start = time.perf_counter()
+    analyses = analyze([Frame(img) for img in images])
+    return analyses, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", required=True, help="katalog ze zdjęciami twarzy")
+    parser.add_argument("--size", type=int, default=1280, help="dłuższy bok klatek serii")
+    parser.add_argument("--frames", type=int, default=6, help="klatek w serii")
+    parser.add_argument("--max-side", type=int, default=640, help="detection_max_side (0 = pełna)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    service = FaceRecognitionService(
+        encodings_dir=tempfile.mkdtemp(), detection_max_side=args.max_side or None
+    )
+    faces = load_faces(args.images, service)
+    if not faces:
+        print("Brak zdjęć z wykrytą twarzą")
+        return
+    rng = np.random.default_rng(args.seed)
+
+    full_s, tracked_s, tracked, frames = 0.0, 0.0, 0, 0
+    encoding_drift, ear_drift = 0.0, 0.0
+    for _, bgr, _ in faces:
+        scale = float(args.size) / max(bgr.shape[:2])
+        big = cv2.resize(bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+        burst = list(perturbed(big, rng, args.frames))
+
+        full, elapsed = timed_burst(
+            lambda frames: [service.analyze_frame(frame) for frame in frames], burst
+        )
+        full_s += elapsed
+        followed, elapsed = timed_burst(service.analyze_burst, burst)
+        tracked_s += elapsed
+
+        for a, b in zip(full, followed):
+            frames += 1
+            if a is None or b is None or a["encoding"] is None or b["encoding"] is None:
+                continue
+            tracked += int(b["tracked"])
+            encoding_drift = max(encoding_drift, float(np.linalg.norm(a["encoding"] - b["encoding"])))
+            ear_drift = max(ear_drift, abs(a["ear"] - b["ear"]))
+
+    print(f"Serie: {len(faces)} x {args.frames} klatek, bok {args.size}, detection_max_side {args.max_side}")
+    print(f"{'tryb':<12} {'ms/seria':>9} {'śledzone':>9}")
+    print(f"{'pełna':<12} {full_s * 1000.0 / len(faces):>9.1f} {'-':>9}")
+    print(f"{'śledzenie':<12} {tracked_s * 1000.0 / len(faces):>9.1f} {tracked:>4}/{frames:<4}")
+    print(f"Największa różnica kodowania: {encoding_drift:.4f}, EAR: {ear_drift:.4f}")
+
+
+if __name__ == "__main__":
+    main()
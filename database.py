@@ -1,16 +1,51 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Date
+from sqlalchemy import create_engine, event, inspect, select, text, Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Date, Index
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime, date
 import enum
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./access_control.db"
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./access_control.db"
+
+# Ustawienia każdego połączenia SQLite: WAL (odczyty nie blokują zapisu),
+# synchronous=NORMAL (w WAL fsync tylko przy checkpoincie – awaria zasilania
+# może cofnąć ostatnie transakcje, ale nie uszkodzi bazy) i odczyt stron
+# przez mmap (256 MB)
+SQLITE_PRAGMAS = {"journal_mode": "WAL", "synchronous": "NORMAL", "mmap_size": 268435456}
 
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+
+def configure_sqlite(bind, pragmas: dict = SQLITE_PRAGMAS):
+    """Ustawia SQLITE_PRAGMAS przy każdym nowym połączeniu silnika (także async – sync_engine)."""
+    @event.listens_for(bind, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+configure_sqlite(engine)
+
+# Warstwa asynchroniczna dla handlerów FastAPI (aiosqlite): zapytania nie
+# blokują pętli zdarzeń. Domyślny NullPool otwierałby połączenie (i wątek
+# aiosqlite) na każdą sesję – pula trzyma je otwarte razem z ustawieniami PRAGMA.
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=8,
+    max_overflow=8,
+    pool_timeout=10,
+)
+configure_sqlite(async_engine.sync_engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False)
+
 Base = declarative_base()
 
 
@@ -55,13 +90,62 @@ class AccessLog(Base):
     badge_id = Column(Integer, ForeignKey("badges.id"), nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     image_path = Column(String, nullable=True)
+    # Weryfikacja wieloklatkowa: wynik połączony (score_fusion) i wyniki
+    # kolejnych klatek jako lista JSON (null = klatka pominięta lub bez twarzy)
+    fused_score = Column(Float, nullable=True)
+    frame_scores = Column(String, nullable=True)
+    # Wersja galerii (GallerySnapshot.version), względem której dopasowano twarz
+    gallery_version = Column(String, nullable=True)
     
     user = relationship("User", back_populates="access_logs")
     badge = relationship("Badge", back_populates="access_logs")
 
+    # /api/logs i raporty filtrują i sortują po czasie, także w obrębie
+    # użytkownika lub wyniku – bez indeksów każde zapytanie skanuje całą tabelę
+    __table_args__ = (
+        Index("ix_access_logs_timestamp", "timestamp"),
+        Index("ix_access_logs_user_id_timestamp", "user_id", "timestamp"),
+        Index("ix_access_logs_result_timestamp", "result", "timestamp"),
+    )
+
 
 def init_db():
     Base.metadata.create_all(bind=engine)
+    migrate_db()
+
+
+def migrate_db(bind=engine):
+    """
+    Dodaje do istniejących tabel kolumny i indeksy, które pojawiły się
+    w modelach później (create_all nie zmienia już utworzonych tabel).
+    Nowe kolumny muszą dopuszczać NULL. Utworzenie indeksu na dużej
+    tabeli logów trwa (jednorazowo) i blokuje na ten czas zapis.
+    """
+    inspector = inspect(bind)
+    with bind.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=bind.dialect)
+                    connection.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                    ))
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(bind=connection)
+
+
+def badge_with_user(qr_code: str):
+    """Przepustka i jej właściciel (None, gdy brak) jednym zapytaniem z JOIN."""
+    return (
+        select(Badge, User)
+        .outerjoin(User, User.id == Badge.user_id)
+        .where(Badge.qr_code == qr_code)
+    )
 
 
 def get_db():
@@ -72,5 +156,10 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 
 
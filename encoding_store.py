@@ -0,0 +1,400 @@
+import argparse
+import fcntl
+import json
+import os
+import pickle
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+ENCODING_DIM = 128
+
+JOURNAL_MAGIC = b"FEJ1"
+JOURNAL_HEADER = struct.Struct("<4sI")
+RECORD_HEADER = struct.Struct("<BH")
+COUNT_HEADER = struct.Struct("<H")
+OP_APPEND = 1
+# Zastąpienie całego zbioru wektorów danego face_id (po deduplikacji / limicie)
+OP_REPLACE = 2
+
+
+class EncodingStore:
+    """
+    Binarny magazyn kodowań twarzy w katalogu `directory`:
+
+    - encodings.<generacja>.npy – macierz float32 (N, 128), otwierana przez mmap,
+    - owners.<generacja>.npy    – indeks właściciela (pozycja w face_ids) dla
+      każdego wiersza,
+    - face_ids.json – manifest bazy: numer generacji, lista face_id i nazwy
+      plików wektorów i właścicieli tej generacji,
+    - journal.bin   – dziennik dopisywanych wektorów (tylko append).
+
+    Nowe kodowania trafiają wyłącznie do dziennika; `compact()` (offline)
+    przepisuje bazę razem z dziennikiem i zaczyna nową generację. Pliki
+    generacji nie są nadpisywane, więc czytelnik zawsze dostaje spójny
+    zestaw z jednego manifestu (bazy sprzed generacji w nazwach plików
+    mają w manifeście encodings.npy i owners.npy).
+
+    Rekord OP_REPLACE zastępuje wszystkie wektory jednego face_id. Przy
+    odczycie jest rozwijany w parę (face_id, None) – "usuń dotychczasowe
+    wektory" – i kolejne (face_id, wektor).
+
+    Nagłówek dziennika niesie numer generacji bazy, do której należy.
+    Dziennik innej generacji (np. po przerwanym zapisie nowej bazy) jest
+    przy odczycie pomijany, a przy pierwszym zapisie zakładany od nowa.
+    Zapisy (dziennik, nowa baza) są szeregowane między procesami blokadą
+    `lock()` na pliku store.lock.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.face_ids_path = os.path.join(directory, "face_ids.json")
+        self.journal_path = os.path.join(directory, "journal.bin")
+        self.lock_path = os.path.join(directory, "store.lock")
+        self._thread_lock = threading.RLock()
+        self._lock_file = None
+        self._lock_depth = 0
+
+    @contextmanager
+    def lock(self):
+        """
+        Wyłączna blokada zapisu magazynu – między procesami (flock) i wątkami.
+        Można ją zagnieżdżać w obrębie jednego obiektu EncodingStore.
+        """
+        with self._thread_lock:
+            if self._lock_depth == 0:
+                self._lock_file = open(self.lock_path, "a+b")
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.face_ids_path) or os.path.exists(self.journal_path)
+
+    def _read_manifest(self) -> Optional[dict]:
+        if not os.path.exists(self.face_ids_path):
+            return None
+        with open(self.face_ids_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta.setdefault("encodings", "encodings.npy")
+        meta.setdefault("owners", "owners.npy")
+        return meta
+
+    def generation(self) -> int:
+        meta = self._read_manifest()
+        return int(meta.get("generation", 0)) if meta else 0
+
+    def load_base(self) -> Tuple[np.ndarray, np.ndarray, List[str], int]:
+        """Zwraca (wektory jako mmap tylko do odczytu, właściciele, face_ids, generacja)."""
+        meta = self._read_manifest()
+        if meta is None:
+            return (
+                np.empty((0, ENCODING_DIM), dtype=np.float32),
+                np.empty(0, dtype=np.int32),
+                [],
+                0,
+            )
+
+        vectors = np.load(os.path.join(self.directory, meta["encodings"]), mmap_mode="r")
+        owners = np.load(os.path.join(self.directory, meta["owners"]), mmap_mode="r")
+        return vectors, owners, list(meta["face_ids"]), int(meta.get("generation", 0))
+
+    def _journal_generation(self) -> Optional[int]:
+        """Generacja z nagłówka dziennika albo None, gdy dziennika (nagłówka) nie ma."""
+        if not os.path.exists(self.journal_path):
+            return None
+        with open(self.journal_path, "rb") as f:
+            header = f.read(JOURNAL_HEADER.size)
+        if len(header) < JOURNAL_HEADER.size:
+            return None
+        magic, generation = JOURNAL_HEADER.unpack(header)
+        if magic != JOURNAL_MAGIC:
+            raise ValueError(f"Nieprawidłowy plik dziennika: {self.journal_path}")
+        return generation
+
+    def _reset_journal(self, generation: int):
+        tmp_journal = self._write_temp(
+            self.journal_path,
+            lambda f: f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, generation)),
+        )
+        os.replace(tmp_journal, self.journal_path)
+        self._sync_directory()
+
+    def _write_record(self, record: bytes):
+        with self.lock():
+            generation = self.generation()
+            if self._journal_generation() != generation:
+                # Brak dziennika albo dziennik innej generacji (jego wpisy
+                # są już w bazie) – zakładamy nowy z nagłówkiem bieżącej
+                self._reset_journal(generation)
+            with open(self.journal_path, "ab") as f:
+                f.write(record)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def append(self, face_id: str, encoding) -> None:
+        vector = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        key = face_id.encode("utf-8")
+        self._write_record(RECORD_HEADER.pack(OP_APPEND, len(key)) + key + vector.tobytes())
+
+    def replace(self, face_id: str, encodings) -> None:
+        """Jednym rekordem (atomowo) zastępuje wszystkie wektory face_id podanym zbiorem."""
+        vectors = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        key = face_id.encode("utf-8")
+        self._write_record(
+            RECORD_HEADER.pack(OP_REPLACE, len(key)) + key
+            + COUNT_HEADER.pack(len(vectors)) + vectors.tobytes()
+        )
+
+    def read_journal(
+        self, offset: int = 0, base_generation: Optional[int] = None
+    ) -> Tuple[List[Tuple[str, Optional[np.ndarray]]], int, Optional[int]]:
+        """
+        Czyta rekordy dziennika od pozycji `offset` (0 = od początku).
+        Zwraca (wpisy, nowy offset, generacja z nagłówka). Wpis (face_id, None)
+        oznacza usunięcie dotychczasowych wektorów face_id. Niedokończony
+        rekord na końcu pliku (przerwany zapis) jest pomijany. Dziennik
+        generacji innej niż `base_generation` (domyślnie bieżąca generacja
+        bazy) nie należy do tej bazy – wtedy wpisów nie ma.
+        """
+        if base_generation is None:
+            base_generation = self.generation()
+        if not os.path.exists(self.journal_path):
+            return [], 0, None
+
+        with open(self.journal_path, "rb") as f:
+            header = f.read(JOURNAL_HEADER.size)
+            if len(header) < JOURNAL_HEADER.size:
+                return [], 0, None
+            magic, generation = JOURNAL_HEADER.unpack(header)
+            if magic != JOURNAL_MAGIC:
+                raise ValueError(f"Nieprawidłowy plik dziennika: {self.journal_path}")
+            if generation != base_generation:
+                return [], 0, generation
+
+            offset = max(offset, JOURNAL_HEADER.size)
+            f.seek(offset)
+            data = f.read()
+
+        entries = []
+        pos = 0
+        payload_size = ENCODING_DIM * 4
+        while pos + RECORD_HEADER.size <= len(data):
+            op, key_len = RECORD_HEADER.unpack_from(data, pos)
+            key_start = pos + RECORD_HEADER.size
+            payload_start = key_start + key_len
+            count = 1
+            if op == OP_REPLACE:
+                if payload_start + COUNT_HEADER.size > len(data):
+                    break
+                (count,) = COUNT_HEADER.unpack_from(data, payload_start)
+                payload_start += COUNT_HEADER.size
+            end = payload_start + count * payload_size
+            if end > len(data):
+                break
+
+            face_id = data[key_start : key_start + key_len].decode("utf-8")
+            vectors = np.frombuffer(
+                data, dtype=np.float32, count=count * ENCODING_DIM, offset=payload_start
+            ).reshape(count, ENCODING_DIM)
+            if op == OP_REPLACE:
+                entries.append((face_id, None))
+            if op in (OP_APPEND, OP_REPLACE):
+                entries.extend((face_id, vector.copy()) for vector in vectors)
+            pos = end
+
+        return entries, offset + pos, generation
+
+    def load(self) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """Pełny obraz galerii (baza + dziennik) skopiowany do pamięci."""
+        vectors, owners, face_ids, generation = self.load_base()
+        entries, _, _ = self.read_journal(base_generation=generation)
+
+        owner_index = {face_id: i for i, face_id in enumerate(face_ids)}
+        extra_vectors = []
+        extra_owners = []
+        cleared = set()
+        for face_id, vector in entries:
+            if face_id not in owner_index:
+                owner_index[face_id] = len(face_ids)
+                face_ids.append(face_id)
+            if vector is None:
+                # Wektory sprzed zastąpienia (z bazy i wcześniej z dziennika) odpadają
+                owner = owner_index[face_id]
+                cleared.add(owner)
+                kept = [i for i, o in enumerate(extra_owners) if o != owner]
+                extra_vectors = [extra_vectors[i] for i in kept]
+                extra_owners = [extra_owners[i] for i in kept]
+                continue
+            extra_vectors.append(vector)
+            extra_owners.append(owner_index[face_id])
+
+        if cleared:
+            alive = ~np.isin(owners, list(cleared))
+            vectors, owners = vectors[alive], owners[alive]
+        if extra_vectors:
+            vectors = np.concatenate([vectors, np.stack(extra_vectors)])
+            owners = np.concatenate([owners, np.asarray(extra_owners, dtype=np.int32)])
+        return np.array(vectors, dtype=np.float32), np.array(owners, dtype=np.int32), face_ids
+
+    def write_base(self, vectors: np.ndarray, owners: np.ndarray, face_ids: List[str]) -> int:
+        """
+        Zapisuje nową bazę, zeruje dziennik i zwraca numer nowej generacji.
+
+        Wektory i właściciele trafiają do nowych plików tej generacji
+        (zsynchronizowanych na dysk), a bazę zatwierdza jedno os.replace
+        manifestu face_ids.json. Przerwany zapis zostawia poprzednią bazę
+        razem z jej dziennikiem; dziennik zerujemy dopiero po zatwierdzeniu.
+        """
+        with self.lock():
+            return self._write_base(vectors, owners, face_ids)
+
+    def _write_base(self, vectors: np.ndarray, owners: np.ndarray, face_ids: List[str]) -> int:
+        previous = self._read_manifest()
+        generation = (int(previous.get("generation", 0)) if previous else 0) + 1
+        manifest = {
+            "generation": generation,
+            "face_ids": face_ids,
+            "encodings": f"encodings.{generation}.npy",
+            "owners": f"owners.{generation}.npy",
+        }
+
+        for name, array, dtype in (
+            (manifest["encodings"], vectors, np.float32),
+            (manifest["owners"], owners, np.int32),
+        ):
+            tmp_path = self._write_temp(
+                name, lambda f: np.save(f, np.ascontiguousarray(array, dtype=dtype))
+            )
+            os.replace(tmp_path, os.path.join(self.directory, name))
+        tmp_face_ids = self._write_temp(
+            self.face_ids_path, lambda f: f.write(json.dumps(manifest).encode("utf-8"))
+        )
+        self._sync_directory()
+        # Punkt zatwierdzenia nowej bazy
+        os.replace(tmp_face_ids, self.face_ids_path)
+        self._sync_directory()
+
+        self._reset_journal(generation)
+        self._remove_stale_bases(previous, manifest)
+        return generation
+
+    def _remove_stale_bases(self, previous: Optional[dict], current: dict):
+        # Pliki poprzedniej generacji zostają – procesy, które przeczytały
+        # jej manifest, mogą ich jeszcze nie otworzyć
+        keep = {current["encodings"], current["owners"]}
+        if previous is not None:
+            keep.update((previous["encodings"], previous["owners"]))
+        for filename in os.listdir(self.directory):
+            stem = filename.split(".", 1)[0]
+            if stem in ("encodings", "owners") and filename.endswith(".npy") and filename not in keep:
+                os.remove(os.path.join(self.directory, filename))
+
+    def _sync_directory(self):
+        fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _write_temp(self, path: str, write) -> str:
+        """
+        Zapisuje plik tymczasowy o unikalnej nazwie w katalogu magazynu
+        (do późniejszego os.replace na `path`), synchronizuje go na dysk
+        i zwraca jego ścieżkę – dwa zapisy naraz nie podmieniają sobie
+        nawzajem plików tymczasowych.
+        """
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.directory, prefix=os.path.basename(path) + ".", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path
+
+    def compact(self) -> int:
+        """Scala dziennik z bazą. Uruchamiać przy zatrzymanym serwerze."""
+        with self.lock():
+            vectors, owners, face_ids = self.load()
+            self.write_base(vectors, owners, face_ids)
+        return len(vectors)
+
+    def migrate_pickles(self, pickle_dir: Optional[str] = None) -> int:
+        """
+        Jednorazowa migracja ze starego układu `face_encodings/<face_id>.pkl`
+        (pojedynczy wektor lub lista wektorów w pliku) do bazy binarnej.
+        """
+        pickle_dir = pickle_dir or self.directory
+        with self.lock():
+            return self._migrate_pickles(pickle_dir)
+
+    def _migrate_pickles(self, pickle_dir: str) -> int:
+        vectors, owners, face_ids = self.load()
+        owner_index = {face_id: i for i, face_id in enumerate(face_ids)}
+
+        new_vectors = []
+        new_owners = []
+        for filename in sorted(os.listdir(pickle_dir)):
+            if not filename.endswith(".pkl"):
+                continue
+            face_id = filename[:-4]
+            if face_id in owner_index:
+                # Już zmigrowany – migracja jest jednorazowa i idempotentna
+                continue
+            with open(os.path.join(pickle_dir, filename), "rb") as f:
+                loaded = pickle.load(f)
+            if not isinstance(loaded, list):
+                loaded = [loaded]
+            owner_index[face_id] = len(face_ids)
+            face_ids.append(face_id)
+            for encoding in loaded:
+                new_vectors.append(np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM))
+                new_owners.append(owner_index[face_id])
+
+        if new_vectors:
+            vectors = np.concatenate([vectors, np.stack(new_vectors)])
+            owners = np.concatenate([owners, np.asarray(new_owners, dtype=np.int32)])
+        self.write_base(vectors, owners, face_ids)
+        return len(new_vectors)
+
+
+def has_pickle_encodings(directory: str) -> bool:
+    return os.path.isdir(directory) and any(
+        filename.endswith(".pkl") for filename in os.listdir(directory)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Narzędzia magazynu kodowań twarzy")
+    parser.add_argument("command", choices=["compact", "migrate"])
+    parser.add_argument("--dir", default="face_encodings", help="katalog magazynu")
+    parser.add_argument(
+        "--pickle-dir", default=None, help="katalog z plikami .pkl (domyślnie --dir)"
+    )
+    args = parser.parse_args()
+
+    store = EncodingStore(args.dir)
+    if args.command == "compact":
+        count = store.compact()
+        print(f"Skompaktowano magazyn: {count} wektorów")
+    else:
+        count = store.migrate_pickles(args.pickle_dir)
+        print(f"Zmigrowano {count} wektorów z plików .pkl")
@@ -0,0 +1,418 @@
+import argparse
+import copy
+import json
+import os
+import tempfile
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+ENCODING_DIM = 128
+
+
+class ExactIndex:
+    """
+    Dokładne wyszukiwanie (brute force) po wszystkich kodowaniach galerii.
+
+    Indeks przechowuje wektory: bazę z magazynu (zwykle mmap, tylko do odczytu)
+    oraz bufor w pamięci na wektory dopisane później. Wiersze są numerowane
+    kolejno – najpierw baza, potem bufor.
+    """
+
+    name = "exact"
+    # Czy build(..., directory) zapisuje wynik w katalogu magazynu
+    persistent = False
+
+    def __init__(self):
+        self._base = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self._tail = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def build(self, base_vectors: np.ndarray, directory: Optional[str] = None, generation: int = 0):
+        self._base = base_vectors
+        self._tail = np.empty((0, ENCODING_DIM), dtype=np.float32)
+        self._size = len(base_vectors)
+
+    def add(self, vector) -> int:
+        # Bufor rośnie geometrycznie, więc dopisanie wektora jest zamortyzowane O(1)
+        tail_size = self._size - len(self._base)
+        if tail_size == len(self._tail):
+            tail = np.empty((max(16, 2 * len(self._tail)), ENCODING_DIM), dtype=np.float32)
+            tail[:tail_size] = self._tail[:tail_size]
+            self._tail = tail
+        self._tail[tail_size] = np.asarray(vector, dtype=np.float32)
+        row = self._size
+        self._size += 1
+        return row
+
+    def extended(self, vectors) -> "ExactIndex":
+        """
+        Zwraca nowy indeks z dopisanymi wektorami, bez zmiany bieżącego
+        (copy-on-write). Bufor wektorów jest współdzielony – nowy indeks pisze
+        tylko za zakresem widocznym dla starego, więc rozszerzać wolno
+        wyłącznie najnowszy indeks.
+        """
+        clone = copy.copy(self)
+        for vector in vectors:
+            clone.add(vector)
+        return clone
+
+    def get(self, rows) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        base_size = len(self._base)
+        in_base = rows < base_size
+        if in_base.all():
+            return np.asarray(self._base[rows], dtype=np.float32)
+        vectors = np.empty((len(rows), ENCODING_DIM), dtype=np.float32)
+        vectors[in_base] = self._base[rows[in_base]]
+        vectors[~in_base] = self._tail[rows[~in_base] - base_size]
+        return vectors
+
+    @staticmethod
+    def distances(vectors: np.ndarray, encoding: np.ndarray) -> np.ndarray:
+        diff = vectors - encoding
+        return np.sqrt(np.einsum("ij,ij->i", diff, diff))
+
+    def search(self, encoding, exclude: Optional[np.ndarray] = None) -> Optional[Tuple[int, float]]:
+        """
+        Zwraca (wiersz, odległość) najbliższego kodowania albo None dla pustej
+        galerii. `exclude` to maska wierszy pomijanych (usuniętych); może być
+        krótsza od indeksu – wiersze za jej końcem są brane pod uwagę.
+        """
+        if self._size == 0:
+            return None
+
+        encoding = np.asarray(encoding, dtype=np.float32)
+        tail_size = self._size - len(self._base)
+        distances = np.concatenate([
+            self.distances(self._base, encoding),
+            self.distances(self._tail[:tail_size], encoding),
+        ])
+        if exclude is not None:
+            masked = exclude[: self._size]
+            distances[: len(masked)][masked] = np.inf
+        best_row = int(np.argmin(distances))
+        if not np.isfinite(distances[best_row]):
+            return None
+        return best_row, float(distances[best_row])
+
+
+def _kmeans(
+    vectors: np.ndarray,
+    k: int,
+    iterations: int = 15,
+    seed: int = 0,
+    initial: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if initial is not None:
+        centroids = np.array(initial, dtype=vectors.dtype)
+    else:
+        centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    vector_norms = np.einsum("ij,ij->i", vectors, vectors)
+
+    for _ in range(iterations):
+        assignments = _nearest_centroids(vectors, centroids, vector_norms)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=k)
+        empty = counts == 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        sums = np.add.reduceat(vectors[order], starts, axis=0)
+        centroids[~empty] = sums / counts[~empty, None]
+        # Puste listy dostają losowe punkty, żeby nie marnować komórek
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()))]
+    return centroids
+
+
+def _nearest_centroids(
+    vectors: np.ndarray, centroids: np.ndarray, vector_norms: Optional[np.ndarray] = None
+) -> np.ndarray:
+    if vector_norms is None:
+        vector_norms = np.einsum("ij,ij->i", vectors, vectors)
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    # Porcjami, żeby macierz odległości nie zajmowała za dużo pamięci
+    for start in range(0, len(vectors), 16384):
+        chunk = vectors[start : start + 16384]
+        d = vector_norms[start : start + 16384, None] - 2.0 * chunk @ centroids.T + centroid_norms
+        assignments[start : start + 16384] = np.argmin(d, axis=1)
+    return assignments
+
+
+class IVFIndex(ExactIndex):
+    """
+    Przybliżony indeks IVF (inverted file) w czystym NumPy: wektory są
+    przypisane do najbliższego z `nlist` centroidów (k-means), a zapytanie
+    przeszukuje dokładnie tylko `nprobe` najbliższych list.
+
+    `nprobe` jest pokrętłem recall/latencja: więcej list = wyższy recall,
+    nprobe >= nlist daje wynik identyczny z ExactIndex.
+    """
+
+    name = "ivf"
+    persistent = True
+    CENTROIDS_FILE = "ivf_centroids.npy"
+    ASSIGNMENTS_FILE = "ivf_assignments.npy"
+    META_FILE = "ivf_meta.json"
+
+    def __init__(self, nprobe: int = 8, nlist: Optional[int] = None, min_train_size: int = 1000):
+        super().__init__()
+        self.nprobe = nprobe
+        self.nlist = nlist
+        self.min_train_size = min_train_size
+        self.centroids: Optional[np.ndarray] = None
+        self._lists = []
+        self._extra = []
+
+    def build(self, base_vectors: np.ndarray, directory: Optional[str] = None, generation: int = 0):
+        super().build(base_vectors, directory, generation)
+        self.centroids = None
+        self._lists = []
+        self._extra = []
+
+        if directory is not None and self.load(directory, generation):
+            return
+        if len(base_vectors) < self.min_train_size:
+            # Za mało danych na sensowny podział – do czasu kompaktowania
+            # magazynu wyszukiwanie działa dokładnie (brute force).
+            return
+
+        self.train(np.asarray(base_vectors, dtype=np.float32))
+        if directory is not None:
+            self.save(directory, generation)
+
+    def train(self, vectors: np.ndarray, sample_size: int = 50000):
+        nlist = self.nlist or max(1, int(np.sqrt(len(vectors))))
+        sample = vectors
+        if len(vectors) > sample_size:
+            rng = np.random.default_rng(0)
+            sample = vectors[np.sort(rng.choice(len(vectors), size=sample_size, replace=False))]
+        self.centroids = _kmeans(sample, min(nlist, len(sample)))
+        self._set_assignments(_nearest_centroids(vectors, self.centroids))
+
+    def _set_assignments(self, assignments: np.ndarray):
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=len(self.centroids))
+        self._lists = np.split(order.astype(np.int64), np.cumsum(counts)[:-1])
+        # Wiersze dopisane po zbudowaniu indeksu trafiają do osobnych list
+        self._extra = [[] for _ in range(len(self.centroids))]
+
+    def add(self, vector) -> int:
+        row = super().add(vector)
+        if self.centroids is not None:
+            encoding = np.asarray(vector, dtype=np.float32).reshape(1, -1)
+            list_id = int(_nearest_centroids(encoding, self.centroids)[0])
+            # Listy podmieniamy zamiast dopisywać w miejscu, żeby starsze
+            # kopie indeksu (migawki galerii) nie widziały nowych wierszy
+            extra = list(self._extra)
+            extra[list_id] = extra[list_id] + [row]
+            self._extra = extra
+        return row
+
+    def search(self, encoding, exclude: Optional[np.ndarray] = None) -> Optional[Tuple[int, float]]:
+        if self.centroids is None or self.nprobe >= len(self.centroids):
+            return super().search(encoding, exclude)
+        if self._size == 0:
+            return None
+
+        encoding = np.asarray(encoding, dtype=np.float32)
+        centroid_distances = self.distances(self.centroids, encoding)
+        probe = np.argpartition(centroid_distances, self.nprobe)[: self.nprobe]
+        candidates = np.concatenate(
+            [self._lists[list_id] for list_id in probe]
+            + [np.asarray(self._extra[list_id], dtype=np.int64) for list_id in probe]
+        )
+        if exclude is not None:
+            in_mask = candidates < len(exclude)
+            in_mask[in_mask] = exclude[candidates[in_mask]]
+            candidates = candidates[~in_mask]
+        if len(candidates) == 0:
+            return None
+
+        distances = self.distances(self.get(candidates), encoding)
+        best = int(np.argmin(distances))
+        return int(candidates[best]), float(distances[best])
+
+    def save(self, directory: str, generation: int = 0):
+        assignments = np.empty(len(self._base), dtype=np.int32)
+        for list_id, rows in enumerate(self._lists):
+            assignments[rows[rows < len(self._base)]] = list_id
+
+        files = [
+            (self.CENTROIDS_FILE, lambda f: np.save(f, self.centroids)),
+            (self.ASSIGNMENTS_FILE, lambda f: np.save(f, assignments)),
+            (self.META_FILE, lambda f: f.write(
+                json.dumps({"generation": generation, "rows": int(len(self._base))}).encode("utf-8")
+            )),
+        ]
+        # Plik meta zapisujemy na końcu – dopiero on "zatwierdza" zapisany indeks.
+        # Unikalne pliki tymczasowe: równoległy zapis nie podmienia cudzych.
+        for filename, write in files:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=filename + ".", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            os.replace(tmp_path, os.path.join(directory, filename))
+
+    def load(self, directory: str, generation: int = 0) -> bool:
+        """Wczytuje zapisany podział, jeśli pasuje do bieżącej bazy magazynu."""
+        meta_path = os.path.join(directory, self.META_FILE)
+        if not os.path.exists(meta_path):
+            return False
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("generation") != generation or meta.get("rows") != len(self._base):
+            return False
+
+        self.centroids = np.load(os.path.join(directory, self.CENTROIDS_FILE))
+        self._set_assignments(np.load(os.path.join(directory, self.ASSIGNMENTS_FILE)))
+        return True
+
+
+class QuantizedIndex(ExactIndex):
+    """
+    Zwarta galeria: baza magazynu trzymana w pamięci procesu jako int8
+    (skala i przesunięcie per wymiar) albo float16, zamiast pełnych float32.
+
+    Pierwszy przebieg liczy odległości od wektorów skwantowanych. Dla każdego
+    wiersza znany jest błąd kwantyzacji e = |x - x̂|, więc prawdziwa odległość
+    leży w [d̂ - e, d̂ + e]. Dokładnie (float32 z mmap) sprawdzamy tylko wiersze,
+    których dolne ograniczenie nie przekracza najlepszego górnego – wynik jest
+    identyczny z ExactIndex, a z pliku bazy czytamy kilka wierszy na zapytanie.
+    Wektory dopisane po zbudowaniu indeksu są przeszukiwane dokładnie.
+    """
+
+    name = "quantized"
+    DTYPES = ("int8", "float16")
+    # Zapas na błąd zaokrągleń float32 w rozwinięciu |x̂|² - 2x̂·q + |q|²
+    SQUARED_SLACK = 1e-4
+
+    def __init__(self, dtype: str = "int8", chunk_size: int = 16384):
+        super().__init__()
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Nieobsługiwany typ kwantyzacji: {dtype}")
+        self.dtype = dtype
+        self.chunk_size = chunk_size
+        self._codes = np.empty((0, ENCODING_DIM), dtype=np.int8)
+        self._scale = np.ones(ENCODING_DIM, dtype=np.float32)
+        self._offset = np.zeros(ENCODING_DIM, dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._errors = np.empty(0, dtype=np.float32)
+
+    def build(self, base_vectors: np.ndarray, directory: Optional[str] = None, generation: int = 0):
+        super().build(base_vectors, directory, generation)
+        n = len(base_vectors)
+        chunks = range(0, n, self.chunk_size)
+
+        if self.dtype == "int8" and n:
+            low = np.min([base_vectors[i : i + self.chunk_size].min(axis=0) for i in chunks], axis=0)
+            high = np.max([base_vectors[i : i + self.chunk_size].max(axis=0) for i in chunks], axis=0)
+            self._offset = ((high + low) / 2.0).astype(np.float32)
+            self._scale = np.maximum((high - low) / 254.0, 1e-12).astype(np.float32)
+
+        self._codes = np.empty((n, ENCODING_DIM), dtype=np.int8 if self.dtype == "int8" else np.float16)
+        self._norms = np.empty(n, dtype=np.float32)
+        self._errors = np.empty(n, dtype=np.float32)
+        for start in chunks:
+            vectors = np.asarray(base_vectors[start : start + self.chunk_size], dtype=np.float32)
+            end = start + len(vectors)
+            if self.dtype == "int8":
+                codes = np.clip(np.rint((vectors - self._offset) / self._scale), -127, 127)
+                self._codes[start:end] = codes
+            else:
+                self._codes[start:end] = vectors
+            decoded = self._decode(self._codes[start:end])
+            self._norms[start:end] = np.einsum("ij,ij->i", decoded, decoded)
+            # Błąd kwantyzacji z minimalnym zapasem na zaokrąglenia
+            self._errors[start:end] = self.distances(decoded, vectors) * (1.0 + 1e-5) + 1e-6
+
+    def _decode(self, codes: np.ndarray) -> np.ndarray:
+        if self.dtype == "int8":
+            return codes.astype(np.float32) * self._scale + self._offset
+        return codes.astype(np.float32)
+
+    def memory_bytes(self) -> int:
+        """Pamięć procesu zajęta przez wektory bazy (bez pliku mmap) i bufor dopisanych."""
+        return int(
+            self._codes.nbytes + self._norms.nbytes + self._errors.nbytes
+            + self._scale.nbytes + self._offset.nbytes + self._tail.nbytes
+        )
+
+    def search(self, encoding, exclude: Optional[np.ndarray] = None) -> Optional[Tuple[int, float]]:
+        base_size = len(self._base)
+        if base_size == 0:
+            return super().search(encoding, exclude)
+
+        encoding = np.asarray(encoding, dtype=np.float32)
+        if self.dtype == "int8":
+            # x̂·q = kody·(skala∘q) + przesunięcie·q
+            weights = self._scale * encoding
+            shift = float(np.dot(self._offset, encoding))
+        else:
+            weights, shift = encoding, 0.0
+
+        squared = np.empty(base_size, dtype=np.float32)
+        for start in range(0, base_size, self.chunk_size):
+            codes = self._codes[start : start + self.chunk_size]
+            squared[start : start + len(codes)] = codes.astype(np.float32) @ weights
+        squared = self._norms - 2.0 * (squared + shift) + float(np.dot(encoding, encoding))
+        lower = np.sqrt(np.maximum(squared - self.SQUARED_SLACK, 0.0)) - self._errors
+        upper = np.sqrt(np.maximum(squared, 0.0) + self.SQUARED_SLACK) + self._errors
+
+        tail_size = self._size - base_size
+        tail_distances = self.distances(self._tail[:tail_size], encoding)
+        if exclude is not None:
+            masked = exclude[: self._size]
+            base_masked = masked[:base_size]
+            lower[: len(base_masked)][base_masked] = np.inf
+            upper[: len(base_masked)][base_masked] = np.inf
+            tail_distances[: max(0, len(masked) - base_size)][masked[base_size:]] = np.inf
+
+        bound = min(float(upper.min()), float(tail_distances.min(initial=np.inf)))
+        if not np.isfinite(bound):
+            return None
+
+        # Dokładne odległości dla kandydatów z bazy i wszystkich dopisanych
+        # wierszy; wiersze rosnąco, więc argmin przy remisie wybiera najniższy
+        candidates = np.flatnonzero(lower <= bound)
+        distances = np.concatenate([
+            self.distances(np.asarray(self._base[candidates], dtype=np.float32), encoding),
+            tail_distances,
+        ])
+        rows = np.concatenate([candidates, base_size + np.arange(tail_size)])
+        best = int(np.argmin(distances))
+        return int(rows[best]), float(distances[best])
+
+
+def make_index(backend: str = "exact", **options) -> ExactIndex:
+    if backend == ExactIndex.name:
+        return ExactIndex()
+    if backend == IVFIndex.name:
+        return IVFIndex(**options)
+    if backend == QuantizedIndex.name:
+        return QuantizedIndex(**options)
+    raise ValueError(f"Nieznany typ indeksu: {backend}")
+
+
+if __name__ == "__main__":
+    from encoding_store import EncodingStore
+
+    parser = argparse.ArgumentParser(description="Budowa indeksu IVF dla magazynu kodowań")
+    parser.add_argument("--dir", default="face_encodings", help="katalog magazynu")
+    parser.add_argument("--nlist", type=int, default=None, help="liczba list (domyślnie sqrt(N))")
+    args = parser.parse_args()
+
+    store = EncodingStore(args.dir)
+    vectors, _, _, generation = store.load_base()
+    index = IVFIndex(nlist=args.nlist, min_train_size=1)
+    index.build(vectors)
+    index.save(args.dir, generation)
+    print(f"Zbudowano indeks IVF: {len(index.centroids)} list, {len(vectors)} wektorów")
@@ -0,0 +1,144 @@
+import os
+import random
+import threading
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# Kaskada Haara dołączana do pakietu opencv-python
+DEFAULT_CASCADE = "haarcascade_frontalface_default.xml"
+
+
+class PrefilterStats:
+    """
+    Liczniki pierwszego etapu detekcji: ile klatek odrzucono bez dlib
+    i ile odrzuconych klatek sprawdzono mimo to (audyt), w tym ile z nich
+    miało twarz według HOG (pomyłki filtra).
+    """
+
+    FIELDS = ("frames", "rejected", "audited", "misses")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self._counters[name] += int(value)
+
+    def merge(self, counters: dict):
+        self.record(**counters)
+
+    def drain(self) -> dict:
+        """Zwraca liczniki od ostatniego odczytu i zeruje je (przekazywanie z procesów roboczych)."""
+        with self._lock:
+            counters = self._counters
+            self._counters = dict.fromkeys(self.FIELDS, 0)
+        return counters
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        counters["passed"] = counters["frames"] - counters["rejected"]
+        # Odsetek pomyłek wśród audytowanych odrzuceń – szacunek dla wszystkich odrzuceń
+        counters["miss_rate"] = counters["misses"] / counters["audited"] if counters["audited"] else 0.0
+        return counters
+
+
+class FacePrefilter:
+    """
+    Tani pierwszy etap detekcji twarzy: kaskada Haara (OpenCV) na
+    pomniejszonej klatce w skali szarości. Klatka bez choćby
+    prawdopodobnej twarzy (pusty kiosk, kamera skierowana w ścianę)
+    nie trafia do detektora HOG z dlib.
+
+    Czułość ustawiają `min_neighbors` (mniej = więcej kandydatów)
+    i `scale_factor` (bliżej 1 = gęstsza piramida skal). `min_size` to
+    najmniejszy bok twarzy w pikselach pełnej klatki – klatka jest
+    pomniejszana do `max_side`, ale nie tak, by twarz tej wielkości
+    spadła poniżej okna kaskady. Ułamek
+    `audit_rate` odrzuconych klatek i tak przechodzi detekcję dlib –
+    z tego wynika licznik pomyłek filtra (PrefilterStats.misses).
+    Bez pliku kaskady filtr przepuszcza wszystkie klatki.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        cascade_path: Optional[str] = None,
+        max_side: int = 240,
+        scale_factor: float = 1.2,
+        min_neighbors: int = 3,
+        min_size: int = 60,
+        audit_rate: float = 0.05,
+        seed: Optional[int] = None,
+    ):
+        self.max_side = max_side
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        # Najmniejszy bok twarzy w pikselach pełnej klatki
+        self.min_size = min_size
+        self.audit_rate = audit_rate
+        self.stats = PrefilterStats()
+        self._random = random.Random(seed)
+
+        self.cascade = None
+        # Kaskady są w opencv-python 4.x; kompilacje bez modułu objdetect ich nie mają
+        if enabled and hasattr(cv2, "CascadeClassifier"):
+            path = cascade_path or os.path.join(cv2.data.haarcascades, DEFAULT_CASCADE)
+            cascade = cv2.CascadeClassifier(path) if os.path.exists(path) else None
+            if cascade is None or cascade.empty():
+                print(f"Brak kaskady detekcji twarzy ({path}) – filtr wstępny wyłączony")
+            else:
+                self.cascade = cascade
+
+    @property
+    def enabled(self) -> bool:
+        return self.cascade is not None
+
+    def _small_gray(self, gray: np.ndarray) -> Tuple[np.ndarray, int]:
+        """Pomniejszona klatka dla kaskady i min_size przeliczony na jej piksele."""
+        h, w = gray.shape[:2]
+        window = max(self.cascade.getOriginalWindowSize())
+        scale = min(1.0, max(float(self.max_side) / max(h, w), float(window) / self.min_size))
+        if scale < 1.0:
+            gray = cv2.resize(
+                gray, (max(1, int(w * scale)), max(1, int(h * scale))),
+                interpolation=cv2.INTER_AREA,
+            )
+        return cv2.equalizeHist(gray), max(window, int(round(self.min_size * scale)))
+
+    def plausible_face(self, gray: np.ndarray) -> bool:
+        """Czy kaskada widzi w klatce choć jednego kandydata na twarz."""
+        if self.cascade is None:
+            return True
+        small, min_size = self._small_gray(gray)
+        faces = self.cascade.detectMultiScale(
+            small,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            minSize=(min_size, min_size),
+        )
+        return len(faces) > 0
+
+    def screen(self, gray: np.ndarray) -> Optional[bool]:
+        """
+        Decyzja dla klatki przed detekcją HOG: True – przepuścić, False –
+        odrzucić bez dlib, None – odrzucona, ale wylosowana do audytu
+        (wynik dlib należy przekazać do record_audit).
+        """
+        if self.cascade is None:
+            return True
+        self.stats.record(frames=1)
+        if self.plausible_face(gray):
+            return True
+        self.stats.record(rejected=1)
+        if self.audit_rate > 0 and self._random.random() < self.audit_rate:
+            return None
+        return False
+
+    def record_audit(self, found_face: bool):
+        self.stats.record(audited=1, misses=int(found_face))
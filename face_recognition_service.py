@@ -1,158 +1,619 @@
+import dlib
 import face_recognition
 import numpy as np
 import cv2
 import os
+import threading
 from typing import Optional, Tuple
-import pickle
+
+from encoding_store import EncodingStore, has_pickle_encodings
+from face_index import ExactIndex, make_index
+from face_prefilter import FacePrefilter
+from frame import Frame, ImageInput, as_frame
+from gallery import GallerySnapshot, PruningStats
+from gallery_maintenance import select_representatives
+from quality_gate import QualityGate
+import score_fusion
+import screen_spoof
+
+
+# Ustawienia modeli osobno dla rejestracji ("enroll") i weryfikacji ("verify"):
+# detector – "hog" (CPU) albo "cnn" (dokładniejszy, wolny bez GPU),
+# upsample – ile razy powiększyć obraz przy detekcji (małe twarze),
+# landmarks – "large" (68 punktów) albo "small" (5 punktów) jako wejście kodera,
+# num_jitters – liczba losowych przesunięć uśrednianych przy kodowaniu.
+# Wartości domyślne uzasadnia `python -m benchmarks.resolution`.
+DEFAULT_PROFILES = {
+    "enroll": {"detector": "hog", "upsample": 1, "landmarks": "large", "num_jitters": 3},
+    "verify": {"detector": "hog", "upsample": 1, "landmarks": "large", "num_jitters": 1},
+}
+
+# Śledzenie twarzy w serii klatek (kiosk, statyczna kamera): kolejna klatka
+# szuka twarzy tylko w oknie wokół ramki z poprzedniej, powiększonym o
+# TRACK_MARGIN rozmiaru twarzy z każdej strony. Bez twarzy w oknie – pełna detekcja.
+TRACK_MARGIN = 0.5
 
 
 class FaceRecognitionService:
-    def __init__(self, encodings_dir: str = "face_encodings"):
+    def __init__(
+        self,
+        encodings_dir: str = "face_encodings",
+        detection_scale: float = 1.0,
+        index_backend: str = "exact",
+        index_options: Optional[dict] = None,
+        quality_options: Optional[dict] = None,
+        detection_max_side: Optional[int] = None,
+        profiles: Optional[dict] = None,
+        maintenance_options: Optional[dict] = None,
+        centroid_pruning: bool = True,
+        prefilter_options: Optional[dict] = None,
+    ):
         self.encodings_dir = encodings_dir
-        os.makedirs(encodings_dir, exist_ok=True)
-        self.known_encodings = {}
-        self.known_face_ids = {}
+        # Skala obrazu, na którym działa detektor HOG (np. 0.5 = połowa
+        # rozdzielczości); współrzędne twarzy są przeliczane z powrotem.
+        self.detection_scale = detection_scale
+        # Polityka rozdzielczości: detekcja na klatce pomniejszonej do
+        # detection_max_side (dłuższy bok), a kodowanie na wycinku twarzy
+        # z oryginału – CLAHE i HOG nie przechodzą po każdym pikselu zdjęcia.
+        self.detection_max_side = detection_max_side
+        self.profiles = {
+            path: dict(defaults, **(profiles or {}).get(path, {}))
+            for path, defaults in DEFAULT_PROFILES.items()
+        }
+        self.store = EncodingStore(encodings_dir)
+        # Filtr jakości klatki (ekspozycja, ostrość, rozmiar twarzy) przed kodowaniem
+        self.quality_gate = QualityGate(**(quality_options or {}))
+        # Kaskada Haara przed detekcją HOG przy weryfikacji – pusta klatka
+        # nie trafia do dlib (enabled, min_neighbors, audit_rate – patrz face_prefilter).
+        # Najmniejsza twarz domyślnie taka jak w filtrze jakości (pełna rozdzielczość).
+        self.prefilter = FacePrefilter(**{
+            "min_size": self.quality_gate.min_face_size, **(prefilter_options or {})
+        })
+        # Deduplikacja i limit wektorów na face_id przy rejestracji
+        # (dedup_distance, max_per_user – patrz gallery_maintenance)
+        self.maintenance_options = maintenance_options or {}
+        # Wektory galerii (float32, wiersz = jedno kodowanie) trzyma wymienny
+        # indeks: "exact" (brute force) albo "ivf" (przybliżony, patrz face_index).
+        self.index_backend = index_backend
+        self.index_options = index_options or {}
+        # Dopasowanie 1:N przycinane po centroidach i promieniach zbiorów
+        # użytkowników (wynik identyczny z przeszukaniem wszystkich wierszy);
+        # tylko dla indeksu dokładnego – IVF sam ogranicza przeszukiwane wiersze.
+        self.centroid_pruning = centroid_pruning and index_backend == "exact"
+        self.match_stats = PruningStats()
+        # Galeria jest publikowana jako niezmienne migawki: odczyt bez blokad,
+        # zapis buduje nową migawkę i podmienia referencję pod _write_lock.
+        self._write_lock = threading.Lock()
+        self._gallery = GallerySnapshot.build(
+            make_index(index_backend, **self.index_options), [], [], 0,
+            self.centroid_pruning, self.match_stats,
+        )
+        self._store_generation = 0
+        self._journal_offset = 0
         self.load_encodings()
 
-    def _load_and_normalize_image(self, image_path: str) -> Optional[np.ndarray]:
-        img_bgr = cv2.imread(image_path)
-        if img_bgr is None:
-            return None
-
-        ycrcb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2YCrCb)
-        y, cr, cb = cv2.split(ycrcb)
-
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        y_eq = clahe.apply(y)
+    def _detection_scale(self, frame: Frame) -> float:
+        scale = self.detection_scale
+        if scale <= 0 or scale > 1.0:
+            scale = 1.0
+        if self.detection_max_side:
+            scale = min(scale, float(self.detection_max_side) / max(frame.bgr.shape[:2]))
+        return scale
+
+    def _detect_face_locations(self, frame: Frame, profile: dict) -> list:
+        scale = self._detection_scale(frame)
+        if scale >= 1.0:
+            return face_recognition.face_locations(
+                frame.normalized_rgb, profile["upsample"], profile["detector"]
+            )
 
-        ycrcb_eq = cv2.merge((y_eq, cr, cb))
-        img_eq_bgr = cv2.cvtColor(ycrcb_eq, cv2.COLOR_YCrCb2BGR)
+        h, w = frame.bgr.shape[:2]
+        small = frame.normalized_rgb_scaled(scale)
+        locations = []
+        for top, right, bottom, left in face_recognition.face_locations(
+            small, profile["upsample"], profile["detector"]
+        ):
+            locations.append((
+                max(0, int(round(top / scale))),
+                min(w, int(round(right / scale))),
+                min(h, int(round(bottom / scale))),
+                max(0, int(round(left / scale))),
+            ))
+        return locations
+
+    def _track_face_locations(self, frame: Frame, previous: tuple, profile: dict) -> list:
+        """
+        Detekcja tylko w oknie wokół ramki `previous` z poprzedniej klatki
+        (wycinek oryginału, ta sama skala detekcji co dla całej klatki).
+        Zwraca ramki w układzie całej klatki albo pustą listę.
+        """
+        roi, x0, y0 = frame.normalized_crop(previous, TRACK_MARGIN)
+        scale = self._detection_scale(frame)
+        if scale < 1.0:
+            h, w = roi.shape[:2]
+            roi = cv2.resize(
+                roi, (max(1, int(w * scale)), max(1, int(h * scale))),
+                interpolation=cv2.INTER_AREA,
+            )
 
-        img_rgb = cv2.cvtColor(img_eq_bgr, cv2.COLOR_BGR2RGB)
-        return img_rgb
+        h, w = frame.bgr.shape[:2]
+        locations = []
+        for top, right, bottom, left in face_recognition.face_locations(
+            roi, profile["upsample"], profile["detector"]
+        ):
+            locations.append((
+                max(0, int(round(top / scale)) + y0),
+                min(w, int(round(right / scale)) + x0),
+                min(h, int(round(bottom / scale)) + y0),
+                max(0, int(round(left / scale)) + x0),
+            ))
+        return locations
+
+    def _prefiltered_face_locations(
+        self, frame: Frame, path: str, profile: dict, prefilter: bool = True
+    ) -> list:
+        # Rejestracja zawsze przechodzi pełną detekcję – pomyłka filtra
+        # oznaczałaby nieudane zapisanie twarzy
+        if path == "enroll" or not prefilter:
+            return self._detect_face_locations(frame, profile)
+        verdict = self.prefilter.screen(frame.gray)
+        if verdict is False:
+            frame.prefilter_rejected = True
+            return []
+        locations = self._detect_face_locations(frame, profile)
+        if verdict is None:
+            self.prefilter.record_audit(bool(locations))
+        return locations
+
+    def drain_counters(self) -> dict:
+        """Liczniki od ostatniego odczytu (dopasowania 1:N i filtr wstępny), zerowane."""
+        return {"match": self.match_stats.drain(), "prefilter": self.prefilter.stats.drain()}
+
+    def _face_locations(
+        self,
+        frame: Frame,
+        path: str = "verify",
+        previous: Optional[tuple] = None,
+        prefilter: bool = True,
+    ) -> list:
+        # Detekcja jest najdroższym krokiem, więc wynik zapamiętujemy w klatce
+        # i przekazujemy dalej do kodowania i landmarków. Ścieżka jest częścią
+        # klucza: wynik weryfikacji po odrzuceniu przez filtr wstępny nie może
+        # zastąpić pełnej detekcji rejestracji na tej samej klatce. Z tego
+        # samego powodu prefilter=False (wynik dlib) nie przyjmuje odrzucenia filtra.
+        profile = self.profiles[path]
+        key = (path, profile["detector"], profile["upsample"])
+        if (
+            frame.face_locations is None
+            or frame.face_locations_key != key
+            or (not prefilter and frame.prefilter_rejected)
+        ):
+            frame.prefilter_rejected = False
+            locations = []
+            if previous is not None:
+                locations = self._track_face_locations(frame, previous, profile)
+                frame.tracked = bool(locations)
+            if not locations:
+                locations = self._prefiltered_face_locations(frame, path, profile, prefilter)
+            frame.face_locations = locations
+            frame.face_locations_key = key
+        return frame.face_locations
+
+    def _encoding_input(self, frame: Frame, location: tuple) -> Tuple[np.ndarray, tuple, int, int]:
+        """
+        Obraz dla predyktora kształtu i kodera: cała znormalizowana klatka,
+        gdy detekcja działała w pełnej rozdzielczości, a przy pomniejszonej
+        detekcji lub twarzy śledzonej z poprzedniej klatki – znormalizowany
+        wycinek oryginału wokół twarzy (całej klatki wtedy nie normalizujemy).
+        Zwraca (RGB, ramka w układzie obrazu, x0, y0).
+        """
+        if self._detection_scale(frame) >= 1.0 and not frame.tracked:
+            return frame.normalized_rgb, location, 0, 0
+
+        img, x0, y0 = frame.normalized_crop(location)
+        top, right, bottom, left = location
+        return img, (top - y0, right - x0, bottom - y0, left - x0), x0, y0
+
+    @property
+    def gallery(self) -> GallerySnapshot:
+        return self._gallery
+
+    @property
+    def gallery_version(self) -> str:
+        return self._gallery.version
+
+    @property
+    def known_face_ids(self) -> dict:
+        return {face_id: face_id for face_id in self._gallery.rows_by_face_id}
 
     def load_encodings(self):
-        for filename in os.listdir(self.encodings_dir):
-            if filename.endswith(".pkl"):
-                face_id = filename[:-4]
-                filepath = os.path.join(self.encodings_dir, filename)
-                with open(filepath, "rb") as f:
-                    encoding = pickle.load(f)
-                    self.known_encodings[face_id] = encoding
-                    self.known_face_ids[face_id] = face_id
-
-    def save_encoding(self, face_id: str, encoding):
-        filepath = os.path.join(self.encodings_dir, f"{face_id}.pkl")
-
-        existing_encodings = []
-        if os.path.exists(filepath):
-            try:
-                with open(filepath, "rb") as f:
-                    loaded = pickle.load(f)
-                    if isinstance(loaded, list):
-                        existing_encodings = loaded
-                    else:
-                        existing_encodings = [loaded]
-            except Exception:
-                existing_encodings = []
+        # Migracja przed blokadą galerii – blokadę magazynu bierzemy zawsze pierwszą
+        migrate_pickle_store(self.store)
+        with self._write_lock:
+            base_vectors, base_owners, face_ids, generation = self.store.load_base()
+            index = make_index(self.index_backend, **self.index_options)
+            index.build(base_vectors, self.encodings_dir, generation)
+
+            entries, offset, _ = self.store.read_journal(base_generation=generation)
+            self._gallery = GallerySnapshot.build(
+                index, base_owners, face_ids, generation, self.centroid_pruning, self.match_stats
+            ).extended(entries)
+            self._store_generation = generation
+            self._journal_offset = offset
+
+    def refresh_encodings(self):
+        """Dociąga wektory dopisane do dziennika magazynu (także przez inne procesy)."""
+        if self.store.generation() != self._store_generation:
+            # Magazyn został skompaktowany – otwieramy nową bazę
+            self.load_encodings()
+        else:
+            self._apply_journal()
+
+    def _apply_journal(self):
+        with self._write_lock:
+            entries, offset, _ = self.store.read_journal(
+                self._journal_offset, self._store_generation
+            )
+            self._gallery = self._gallery.extended(entries)
+            self._journal_offset = offset
 
-        all_encodings = existing_encodings + [encoding]
+    def get_encodings(self, face_id: str) -> np.ndarray:
+        return self._gallery.get_encodings(face_id)
 
-        with open(filepath, "wb") as f:
-            pickle.dump(all_encodings, f)
+    def _match_gallery(self, encoding) -> Optional[Tuple[str, float]]:
+        return self._gallery.match(encoding)
 
-        self.known_encodings[face_id] = all_encodings
-        self.known_face_ids[face_id] = face_id
+    def save_encoding(self, face_id: str, encoding):
+        # Zapis to jeden rekord w dzienniku; odczyt dziennika dopisuje wektor
+        # do galerii razem z ewentualnymi wpisami innych procesów.
+        self.store.append(face_id, encoding)
+        self._apply_journal()
+
+    def enroll_encoding(self, face_id: str, encoding) -> str:
+        """
+        Dodaje kodowanie z rejestracji z utrzymaniem zbioru użytkownika:
+        wektor bliski już zapisanemu jest pomijany, a po przekroczeniu limitu
+        zbiór jest zastępowany reprezentatywnym podzbiorem (jeden rekord
+        OP_REPLACE w dzienniku). Zwraca "appended", "duplicate" albo "replaced".
+        """
+        # Odczyt zbioru, deduplikacja/limit i zapis pod blokadą magazynu –
+        # rejestracje w innych procesach puli nie przeplatają się z tą
+        with self.store.lock():
+            # Najpierw wpisy innych procesów, żeby liczyć na aktualnym zbiorze
+            self.refresh_encodings()
+            with self._write_lock:
+                existing = self._gallery.get_encodings(face_id)
+                vectors = np.vstack([existing, np.asarray(encoding, dtype=np.float32)[None, :]])
+                keep = select_representatives(vectors, **self.maintenance_options)
+
+                if len(keep) == len(vectors):
+                    self.store.append(face_id, encoding)
+                    action = "appended"
+                elif keep.tolist() == list(range(len(existing))):
+                    return "duplicate"
+                else:
+                    self.store.replace(face_id, vectors[keep])
+                    action = "replaced"
+        self._apply_journal()
+        return action
 
-    def register_face(self, image_path: str, face_id: str) -> bool:
+    def register_face(self, image: ImageInput, face_id: str) -> bool:
         try:
-            if not os.path.exists(image_path):
-                print(f"Plik nie istnieje: {image_path}")
-                return False
-
-            if self.detect_screen_spoof(image_path):
-                print("Wykryto możliwe użycie ekranu/zdjęcia przy rejestracji – odrzucono")
+            if isinstance(image, str) and not os.path.exists(image):
+                print(f"Plik nie istnieje: {image}")
                 return False
 
-            image = self._load_and_normalize_image(image_path)
-            if image is None:
+            frame = as_frame(image)
+            if frame is None:
                 print("Nie udało się wczytać obrazu przy rejestracji")
                 return False
 
-            encodings = face_recognition.face_encodings(
-                image, model="large", num_jitters=3
-            )
+            if self.detect_screen_spoof(frame):
+                print("Wykryto możliwe użycie ekranu/zdjęcia przy rejestracji – odrzucono")
+                return False
 
-            if len(encodings) == 0:
-                print("Nie wykryto twarzy na zdjęciu")
+            reason = self.quality_gate.check_image(frame.gray)
+            if reason is None:
+                reason = self.quality_gate.check_face(self._face_locations(frame, "enroll"))
+            if reason is not None:
+                print(f"Zdjęcie odrzucone przez filtr jakości: {reason}")
                 return False
+            face_locations = self._face_locations(frame, "enroll")
 
-            encoding = encodings[0]
-            self.save_encoding(face_id, encoding)
+            _, encoding = self._landmarks_and_encoding(
+                frame, face_locations[0], self.profiles["enroll"]
+            )
+            # Duplikat też kończy rejestrację sukcesem – twarz jest już w galerii
+            self.enroll_encoding(face_id, encoding)
             return True
         except Exception as e:
             print(f"Błąd podczas rejestracji twarzy: {e}")
             return False
 
-    def recognize_face(
-        self, image_path: str, threshold: float = 0.6
-    ) -> Optional[Tuple[str, float]]:
+    def _landmarks_and_encoding(
+        self, frame: Frame, location: tuple, profile: dict
+    ) -> Tuple[list, np.ndarray]:
+        """
+        Punkty charakterystyczne (68, w układzie całej klatki) i kodowanie
+        twarzy. Przy modelu "large" ten sam kształt służy obu celom –
+        face_encodings i face_landmarks liczyłyby go osobno.
+        """
+        img, (top, right, bottom, left), x0, y0 = self._encoding_input(frame, location)
+        rect = dlib.rectangle(left, top, right, bottom)
+        shape = face_recognition.api.pose_predictor_68_point(img, rect)
+        points = [(p.x + x0, p.y + y0) for p in shape.parts()]
+
+        if profile["landmarks"] == "small":
+            shape = face_recognition.api.pose_predictor_5_point(img, rect)
+        encoding = np.array(
+            face_recognition.api.face_encoder.compute_face_descriptor(
+                img, shape, profile["num_jitters"]
+            )
+        )
+        return points, encoding
+
+    def analyze_frame(
+        self,
+        image: ImageInput,
+        check_spoof: bool = False,
+        track_from: Optional[tuple] = None,
+    ) -> Optional[dict]:
+        """
+        Analiza jednej klatki w jednym przejściu: lokalizacja twarzy, landmarki
+        oczu, kodowanie i EAR (przy check_spoof także werdykt detekcji ekranu).
+        Klatki są niezależne, więc RecognitionPool może je liczyć równolegle.
+        `track_from` to ramka twarzy z poprzedniej klatki serii – wtedy twarz
+        jest szukana tylko w jej otoczeniu (pole "tracked"), a przy braku
+        twarzy w oknie w całej klatce.
+        Zwraca None, gdy obrazu nie da się wczytać. Klatka odrzucona przez
+        filtr jakości ma kod w polu "quality", a pola twarzy równe None.
+        """
         try:
-            if self.detect_screen_spoof(image_path):
-                print("Podejrzenie spoofingu ekranu/telefonu – rozpoznawanie przerwane")
-                return None
-
-            unknown_image = self._load_and_normalize_image(image_path)
-            if unknown_image is None:
+            frame = as_frame(image)
+            if frame is None:
                 return None
 
-            unknown_encodings = face_recognition.face_encodings(
-                unknown_image, model="large"
+            analysis = {
+                "location": None,
+                "landmarks": None,
+                "encoding": None,
+                "ear": None,
+                "screen_spoof": self.detect_screen_spoof(frame) if check_spoof else None,
+                "quality": None,
+                "sharpness": None,
+                "tracked": False,
+            }
+
+            # Tanie bramki (ekspozycja, ostrość) przed CLAHE i detekcją,
+            # rozmiar twarzy przed kodowaniem
+            reason, analysis["sharpness"] = self.quality_gate.assess_image(frame.gray)
+            if reason is None:
+                face_locations = self._face_locations(frame, previous=track_from)
+                reason = self.quality_gate.check_face(face_locations)
+            if reason is not None:
+                analysis["quality"] = reason
+                return analysis
+
+            points, encoding = self._landmarks_and_encoding(
+                frame, face_locations[0], self.profiles["verify"]
             )
+            left, right = points[36:42], points[42:48]
+            analysis.update(
+                location=tuple(face_locations[0]),
+                landmarks={"left_eye": left, "right_eye": right},
+                encoding=encoding,
+                ear=(self._eye_aspect_ratio(left) + self._eye_aspect_ratio(right)) / 2.0,
+                tracked=frame.tracked,
+            )
+            return analysis
+        except Exception as e:
+            print(f"Błąd podczas analizy klatki: {e}")
+            return None
 
-            if len(unknown_encodings) == 0:
-                return None
-
-            unknown_encoding = unknown_encodings[0]
-
-            best_match = None
-            best_distance = float("inf")
+    def _encode_probe(self, image: ImageInput) -> Optional[np.ndarray]:
+        frame = as_frame(image)
+        if frame is None:
+            return None
 
-            for face_id, known_encoding in self.known_encodings.items():
-                if isinstance(known_encoding, list):
-                    distances = face_recognition.face_distance(
-                        known_encoding, unknown_encoding
-                    )
-                    distance = float(np.min(distances))
-                else:
-                    distance = face_recognition.face_distance(
-                        [known_encoding], unknown_encoding
-                    )[0]
+        analysis = self.analyze_frame(frame, check_spoof=True)
+        if analysis is None:
+            return None
+        if analysis["screen_spoof"]:
+            print("Podejrzenie spoofingu ekranu/telefonu – rozpoznawanie przerwane")
+            return None
+        return analysis["encoding"]
 
-                if distance < best_distance:
-                    best_distance = distance
-                    best_match = face_id
+    @staticmethod
+    def _score_if_accepted(distance: float, threshold: float) -> Optional[float]:
+        match_score = 1.0 - distance
 
-            match_score = 1.0 - best_distance
+        effective_threshold = max(0.0, threshold - 0.1)
 
-            effective_threshold = max(0.0, threshold - 0.1)
+        if match_score >= effective_threshold:
+            return match_score
+        else:
+            return None
 
-            if match_score >= effective_threshold:
-                return (best_match, match_score)
-            else:
+    def recognize_face(
+        self,
+        image: ImageInput,
+        threshold: float = 0.6,
+        gallery: Optional[GallerySnapshot] = None,
+    ) -> Optional[Tuple[str, float]]:
+        gallery = gallery or self._gallery
+        try:
+            unknown_encoding = self._encode_probe(image)
+            if unknown_encoding is None:
                 return None
+            return self.recognize_encoding(unknown_encoding, threshold, gallery)
 
         except Exception as e:
             print(f"Błąd podczas rozpoznawania twarzy: {e}")
             return None
 
-    def detect_face(self, image_path: str) -> bool:
+    def recognize_encoding(
+        self,
+        encoding: np.ndarray,
+        threshold: float = 0.6,
+        gallery: Optional[GallerySnapshot] = None,
+    ) -> Optional[Tuple[str, float]]:
+        """Dopasowanie 1:N dla gotowego kodowania (np. probe_encoding z finish_verification)."""
+        gallery = gallery or self._gallery
+        match = gallery.match(encoding)
+        if match is None:
+            return None
+        best_match, best_distance = match
+
+        match_score = self._score_if_accepted(best_distance, threshold)
+        if match_score is None:
+            return None
+        return (best_match, match_score)
+
+    def verify_face(
+        self,
+        image: ImageInput,
+        face_id: str,
+        threshold: float = 0.6,
+        gallery: Optional[GallerySnapshot] = None,
+    ) -> Optional[float]:
+        """
+        Weryfikacja 1:1 – porównanie tylko z kodowaniami deklarowanego face_id
+        (z przepustki), więc koszt nie rośnie wraz z rozmiarem galerii.
+        Klatka przechodzi analyze_frame z detekcją ekranu; klatka oznaczona
+        jako ekran/zdjęcie nie jest porównywana (score_fusion.matchable).
+        Zwraca match_score albo None, gdy twarz nie została rozpoznana.
+        """
+        gallery = gallery or self._gallery
+        if not gallery.rows_by_face_id.get(face_id):
+            return None
+        analysis = self.analyze_frame(image, check_spoof=True)
+        if not score_fusion.matchable(analysis):
+            return None
+        return self._verify_encoding(analysis["encoding"], face_id, threshold, gallery)
+
+    def verify_encoding(
+        self,
+        encoding: np.ndarray,
+        face_id: str,
+        threshold: float = 0.6,
+        gallery: Optional[GallerySnapshot] = None,
+    ) -> Optional[float]:
+        """Dopasowanie 1:1 gotowego kodowania (np. kolejnych klatek sesji /ws/verify)."""
+        return self._verify_encoding(encoding, face_id, threshold, gallery or self._gallery)
+
+    def score_encoding(self, encoding: np.ndarray, face_id: str, threshold: float = 0.6) -> dict:
+        """
+        verify_encoding razem z surowym wynikiem klatki (frame_score) i wersją
+        galerii, z której je policzono – dla kolumn logu sesji /ws/verify.
+        """
+        gallery = self._gallery
+        frame_score = self.frame_score(encoding, face_id, gallery)
+        return {
+            "frame_score": frame_score,
+            "match_score": (
+                None if frame_score is None
+                else self._score_if_accepted(1.0 - frame_score, threshold)
+            ),
+            "gallery_version": gallery.version,
+        }
+
+    def _verify_encoding(
+        self, encoding: np.ndarray, face_id: str, threshold: float, gallery: GallerySnapshot
+    ) -> Optional[float]:
+        score = self.frame_score(encoding, face_id, gallery)
+        if score is None:
+            return None
+        return self._score_if_accepted(1.0 - score, threshold)
+
+    def frame_score(
+        self, encoding: np.ndarray, face_id: str, gallery: Optional[GallerySnapshot] = None
+    ) -> Optional[float]:
+        """Surowy wynik 1:1 (1 - najmniejsza odległość) bez progu; None bez kodowań face_id."""
+        rows = (gallery or self._gallery).get_encodings(face_id)
+        if len(rows) == 0:
+            return None
+        distances = ExactIndex.distances(rows, np.asarray(encoding, dtype=np.float32))
+        return 1.0 - float(np.min(distances))
+
+    def finish_verification(
+        self,
+        analyses: list,
+        face_id: Optional[str],
+        threshold: float = 0.6,
+        gallery: Optional[GallerySnapshot] = None,
+        fusion: str = score_fusion.QUALITY_WEIGHTED,
+        scores: Optional[list] = None,
+    ) -> dict:
+        """
+        Decyzja na podstawie wyników analyze_frame z werdyktem detekcji ekranu
+        (None = klatka nieprzeanalizowana, np. po wczesnym zakończeniu).
+        Z deklarowanym face_id porównywane są tylko klatki z kodowaniem
+        i czystym werdyktem detekcji ekranu (score_fusion.matchable), a wyniki
+        łączy score_fusion (`fusion`). Klatka 0 oznaczona jako ekran/zdjęcie
+        wyklucza dopasowanie całej serii. Kodowanie najlepiej dopasowanej
+        klatki wraca jako probe_encoding, żeby audyt 1:N nie liczył go drugi raz.
+        `scores` to już policzone wyniki frame_score klatek (None = do policzenia).
+        """
+        gallery = gallery or self._gallery
+        primary = analyses[0] if analyses else None
+
+        liveness_ok = False
+        if len(analyses) >= 3:
+            # Detekcja mrugnięcia – traktujemy ją jako dodatkową informację,
+            # ale NIE blokujemy całej weryfikacji, gdy mrugnięcie nie zostanie wykryte.
+            liveness_ok = self.blink_liveness(analyses)
+
+        primary_spoof = bool(primary and primary["screen_spoof"])
+        screen_spoof = (not liveness_ok) and primary_spoof
+
+        probe_encoding = None
+        if score_fusion.matchable(primary):
+            probe_encoding = primary["encoding"]
+
+        frame_scores = [None] * len(analyses)
+        fused_score = None
+        match_score = None
+        # Klatka główna oznaczona jako ekran/zdjęcie wyklucza dopasowanie także
+        # po mrugnięciu (jak przy dopasowaniu samej klatki głównej); pozostałe
+        # oznaczone lub niesprawdzone klatki nie wnoszą wyniku
+        if not primary_spoof and face_id is not None:
+            try:
+                for i, analysis in enumerate(analyses):
+                    if not score_fusion.matchable(analysis):
+                        continue
+                    if scores is not None and scores[i] is not None:
+                        frame_scores[i] = scores[i]
+                    else:
+                        frame_scores[i] = self.frame_score(analysis["encoding"], face_id, gallery)
+                weights = [score_fusion.frame_weight(analysis) for analysis in analyses]
+                fused_score = score_fusion.fuse_scores(frame_scores, weights, fusion)
+                if fused_score is not None:
+                    match_score = self._score_if_accepted(1.0 - fused_score, threshold)
+                    best = max(
+                        (i for i, score in enumerate(frame_scores) if score is not None),
+                        key=lambda i: frame_scores[i],
+                    )
+                    probe_encoding = analyses[best]["encoding"]
+            except Exception as e:
+                print(f"Błąd podczas weryfikacji twarzy: {e}")
+
+        return {
+            "liveness_ok": liveness_ok,
+            "screen_spoof": screen_spoof,
+            "match_score": match_score,
+            "fused_score": fused_score,
+            "frame_scores": frame_scores,
+            "gallery_version": gallery.version,
+            "probe_encoding": probe_encoding,
+            "quality_reason": primary["quality"] if primary is not None else None,
+        }
+
+    def detect_face(self, image: ImageInput) -> bool:
         try:
-            image = self._load_and_normalize_image(image_path)
-            if image is None:
+            frame = as_frame(image)
+            if frame is None:
                 return False
-            face_locations = face_recognition.face_locations(image)
-            return len(face_locations) > 0
+            return len(self._face_locations(frame)) > 0
         except Exception as e:
             print(f"Błąd podczas wykrywania twarzy: {e}")
             return False
@@ -169,35 +630,40 @@ class FaceRecognitionService:
         except Exception:
             return 0.0
 
-    def detect_blink_liveness(self, image_paths) -> bool:
+    def analyze_burst(self, images, check_spoof: bool = False) -> list:
+        """
+        Analiza serii klatek po kolei ze śledzeniem twarzy: pełna detekcja
+        tylko do pierwszego trafienia, dalej okno wokół ostatniej ramki.
+        `check_spoof` dotyczy każdej klatki serii.
+        """
+        analyses = []
+        previous = None
+        for image in images:
+            analysis = self.analyze_frame(image, check_spoof, previous)
+            if analysis is not None and analysis["location"] is not None:
+                previous = analysis["location"]
+            analyses.append(analysis)
+        return analyses
+
+    def detect_blink_liveness(self, images) -> bool:
+        if not images or len(images) < 3:
+            return False
+        return self.blink_liveness(self.analyze_burst(images))
+
+    def blink_liveness(self, analyses: list) -> bool:
+        """Decyzja o mrugnięciu na podstawie wyników analyze_frame kolejnych klatek."""
         try:
-            if not image_paths or len(image_paths) < 3:
+            if not analyses or len(analyses) < 3:
                 return False
 
             ears = []
             encs = []
 
-            for p in image_paths:
-                img = self._load_and_normalize_image(p)
-                if img is None:
-                    return False
-
-                e = face_recognition.face_encodings(img, model="large")
-                if len(e) == 0:
+            for analysis in analyses:
+                if analysis is None or analysis["encoding"] is None:
                     return False
-                encs.append(e[0])
-
-                lm = face_recognition.face_landmarks(img)
-                if not lm:
-                    return False
-
-                left = lm[0].get("left_eye")
-                right = lm[0].get("right_eye")
-                if not left or not right or len(left) < 6 or len(right) < 6:
-                    return False
-
-                ear = (self._eye_aspect_ratio(left) + self._eye_aspect_ratio(right)) / 2.0
-                ears.append(float(ear))
+                encs.append(analysis["encoding"])
+                ears.append(float(analysis["ear"]))
 
             # Sprawdzenie spójności twarzy między klatkami – próg poluzowany
             base = encs[0]
@@ -223,130 +689,53 @@ class FaceRecognitionService:
             print(f"Błąd podczas detekcji liveness (blink): {e}")
             return False
 
-    def detect_screen_spoof(self, image_path: str) -> bool:
-        try:
-            img = cv2.imread(image_path)
-            if img is None:
-                return False
-
-            try:
-                face_image = face_recognition.load_image_file(image_path)
-                face_locations = face_recognition.face_locations(face_image)
-                has_face = len(face_locations) > 0
-            except:
-                has_face = False
-
-            h, w = img.shape[:2]
-            scale = 600.0 / max(h, w)
-            if scale < 1.0:
-                img = cv2.resize(img, (int(w * scale), int(h * scale)))
-
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            blur = cv2.GaussianBlur(gray, (5, 5), 0)
-
-            edges = cv2.Canny(blur, 50, 150)
-
-            contours, _ = cv2.findContours(
-                edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
-            )
-
-            img_area = img.shape[0] * img.shape[1]
-            best_rect = None
-            best_area = 0.0
-
-            for cnt in contours:
-                area = cv2.contourArea(cnt)
-                if area < 0.15 * img_area:
-                    continue
-
-                peri = cv2.arcLength(cnt, True)
-                approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
-
-                if len(approx) == 4:
-                    x, y, w_box, h_box = cv2.boundingRect(approx)
-                    aspect = w_box / float(h_box)
-
-                    if 0.4 < aspect < 2.5:
-                        if area > best_area:
-                            best_area = area
-                            best_rect = (x, y, w_box, h_box)
-
-            if best_rect is None:
-                return False
-
-            x, y, w_box, h_box = best_rect
-            roi = gray[y : y + h_box, x : x + w_box]
-            if roi.size == 0:
-                return False
-
-            mean_intensity = float(np.mean(roi))
-            std_intensity = float(np.std(roi))
-            uniform_score = 0
-            if mean_intensity > 160 and std_intensity < 35:
-                uniform_score = 1
-            if mean_intensity > 185 and std_intensity < 30:
-                uniform_score = 2
-
-            roi_edges = edges[y : y + h_box, x : x + w_box]
-            border = max(2, int(min(w_box, h_box) * 0.06))
-            top = roi_edges[:border, :]
-            bottom = roi_edges[-border:, :]
-            left = roi_edges[:, :border]
-            right = roi_edges[:, -border:]
-            border_edges = (
-                int(np.count_nonzero(top))
-                + int(np.count_nonzero(bottom))
-                + int(np.count_nonzero(left))
-                + int(np.count_nonzero(right))
-            )
-            border_area = (
-                top.size + bottom.size + left.size + right.size
-            )
-            border_edge_density = border_edges / float(max(1, border_area))
-            border_score = 0
-            if border_edge_density > 0.06:
-                border_score = 1
-            if border_edge_density > 0.10:
-                border_score = 2
-
-            moire_score = 0
+    def detect_screen_spoof(self, image: ImageInput) -> bool:
+        frame = as_frame(image)
+        if frame is None:
+            return False
+        if frame.screen_spoof is None:
+            frame.screen_spoof = self._detect_screen_spoof(frame)
+        return frame.screen_spoof
+
+    def _detect_screen_spoof(self, frame: Frame) -> bool:
+        # Obecność twarzy zmienia próg werdyktu, więc rozstrzyga ją detektor
+        # dlib – nie pierwszy etap (kaskada), którego pomyłka zmieniłaby werdykt
+        def has_face() -> bool:
             try:
-                roi_small = cv2.resize(roi, (256, 256))
-                roi_small = roi_small.astype(np.float32)
-                roi_small -= float(np.mean(roi_small))
-                fft = np.fft.fft2(roi_small)
-                mag = np.abs(np.fft.fftshift(fft))
-                c = 128
-                r = 18
-                mag[c - r : c + r, c - r : c + r] = 0
-                m_mean = float(np.mean(mag))
-                m_std = float(np.std(mag))
-                flat = mag.reshape(-1)
-                if flat.size > 0:
-                    topk = np.partition(flat, -10)[-10:]
-                    peaks = [float(x) for x in topk if x > m_mean + 6.0 * m_std]
-                    if len(peaks) >= 2:
-                        moire_score = 1
-                    if len(peaks) >= 5:
-                        moire_score = 2
+                return len(self._face_locations(frame, prefilter=False)) > 0
             except Exception:
-                moire_score = 0
-
-            area_ratio = best_area / float(img_area)
-            size_score = 0
-            if area_ratio > 0.25:
-                size_score = 1
-            if area_ratio > 0.40:
-                size_score = 2
-
-            total_score = uniform_score + border_score + moire_score + size_score
-
-            if has_face:
-                return total_score >= 5
-            else:
-                return total_score >= 4
+                return False
 
+        try:
+            return screen_spoof.detect_screen_spoof(frame.gray, has_face)
         except Exception as e:
             print(f"Błąd podczas detekcji spoofingu: {e}")
             return False
 
+
+def migrate_pickle_store(store: EncodingStore):
+    """Jednorazowa migracja starych plików .pkl, gdy magazyn binarny jeszcze nie istnieje."""
+    if not store.exists() and has_pickle_encodings(store.directory):
+        count = store.migrate_pickles()
+        print(f"Zmigrowano {count} kodowań z plików .pkl do magazynu binarnego")
+
+
+def prepare_storage(
+    encodings_dir: str = "face_encodings",
+    index_backend: str = "exact",
+    index_options: Optional[dict] = None,
+    **service_options,
+):
+    """
+    Przygotowuje magazyn w procesie głównym, przed uruchomieniem puli procesów
+    (opcje jak w konstruktorze FaceRecognitionService): migruje pliki .pkl
+    i buduje zapisywany indeks (IVF). Procesy robocze zastają gotowy magazyn
+    i indeks i tylko je wczytują, zamiast równolegle migrować i trenować
+    na tych samych plikach.
+    """
+    store = EncodingStore(encodings_dir)
+    migrate_pickle_store(store)
+    index = make_index(index_backend, **(index_options or {}))
+    if index.persistent:
+        base_vectors, _, _, generation = store.load_base()
+        index.build(base_vectors, encodings_dir, generation)
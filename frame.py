@@ -0,0 +1,128 @@
+import cv2
+import numpy as np
+from typing import Optional, Tuple, Union
+
+
+class Frame:
+    """
+    Klatka zdekodowana jeden raz z bajtów uploadu (lub z pliku).
+    Kolejne reprezentacje (RGB, skala szarości, RGB po normalizacji CLAHE)
+    są liczone leniwie i zapamiętywane, więc detekcja spoofingu, detekcja
+    twarzy i kodowanie korzystają z tych samych tablic.
+    """
+
+    def __init__(self, bgr: np.ndarray, data: Optional[bytes] = None):
+        self.bgr = bgr
+        self.data = data
+        self._rgb = None
+        self._gray = None
+        self._normalized_rgb = None
+        self._scaled = None
+        # Wyniki uzupełniane przez FaceRecognitionService przy pierwszym użyciu:
+        # twarze (top, right, bottom, left) w pełnej rozdzielczości oraz werdykt
+        # detekcji ekranu/zdjęcia.
+        self.face_locations = None
+        self.face_locations_key = None
+        # face_locations to odrzucenie przez filtr wstępny (dlib nie był wołany)
+        self.prefilter_rejected = False
+        # Twarz znaleziona w oknie śledzenia (ramka z poprzedniej klatki serii)
+        self.tracked = False
+        self.screen_spoof = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> Optional["Frame"]:
+        if not data:
+            return None
+        bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bgr is None:
+            return None
+        return cls(bgr, data)
+
+    @classmethod
+    def from_path(cls, image_path: str) -> Optional["Frame"]:
+        bgr = cv2.imread(image_path)
+        if bgr is None:
+            return None
+        return cls(bgr)
+
+    @property
+    def rgb(self) -> np.ndarray:
+        if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    @property
+    def gray(self) -> np.ndarray:
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def normalized_rgb(self) -> np.ndarray:
+        if self._normalized_rgb is None:
+            self._normalized_rgb = normalize(self.bgr)
+        return self._normalized_rgb
+
+    def normalized_rgb_scaled(self, scale: float) -> np.ndarray:
+        """
+        Klatka pomniejszona w skali `scale` i dopiero potem znormalizowana –
+        CLAHE liczy się na mniejszej liczbie pikseli (wejście detektora).
+        """
+        if self._scaled is None or self._scaled[0] != scale:
+            h, w = self.bgr.shape[:2]
+            small = cv2.resize(
+                self.bgr, (max(1, int(w * scale)), max(1, int(h * scale))),
+                interpolation=cv2.INTER_AREA,
+            )
+            self._scaled = (scale, normalize(small))
+        return self._scaled[1]
+
+    def normalized_crop(self, location: tuple, margin: float = 0.5) -> Tuple[np.ndarray, int, int]:
+        """
+        Wycinek oryginału wokół ramki twarzy (top, right, bottom, left)
+        z marginesem, znormalizowany własnym CLAHE. Zwraca (RGB, x0, y0).
+        Granice wycinka są wyrównane do siatki kafli CLAHE całej klatki, ale
+        wynik jest tylko przybliżeniem normalizacji całości: gdy bok klatki
+        nie jest wielokrotnością siatki, OpenCV dopełnia obraz odbiciem i kafle
+        wycinka mają inny rozmiar, a interpolacja przy brzegach wycinka nie
+        widzi sąsiednich kafli. Rzeczywistą różnicę mierzy
+        benchmarks.resolution (tabela "wycinek vs cała klatka").
+        """
+        top, right, bottom, left = location
+        h, w = self.bgr.shape[:2]
+        pad_y = int((bottom - top) * margin)
+        pad_x = int((right - left) * margin)
+
+        # Kafle całej klatki mają bok ceil(rozmiar / 8) (po dopełnieniu odbiciem)
+        tile_w, tile_h = -(-w // 8), -(-h // 8)
+        x0 = max(0, left - pad_x) // tile_w * tile_w
+        y0 = max(0, top - pad_y) // tile_h * tile_h
+        x1 = min(w, -(-min(w, right + pad_x) // tile_w) * tile_w)
+        y1 = min(h, -(-min(h, bottom + pad_y) // tile_h) * tile_h)
+
+        tiles = (-(-(x1 - x0) // tile_w), -(-(y1 - y0) // tile_h))
+        return normalize(self.bgr[y0:y1, x0:x1], tiles), x0, y0
+
+def normalize(bgr: np.ndarray, tiles: Tuple[int, int] = (8, 8)) -> np.ndarray:
+    """Wyrównanie jasności (CLAHE na kanale Y w YCrCb); zwraca obraz RGB."""
+    ycrcb = cv2.cvtColor(bgr, cv2.COLOR_BGR2YCrCb)
+    y, cr, cb = cv2.split(ycrcb)
+
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=tiles)
+    y_eq = clahe.apply(y)
+
+    ycrcb_eq = cv2.merge((y_eq, cr, cb))
+    img_eq_bgr = cv2.cvtColor(ycrcb_eq, cv2.COLOR_YCrCb2BGR)
+
+    return cv2.cvtColor(img_eq_bgr, cv2.COLOR_BGR2RGB)
+
+
+ImageInput = Union[str, bytes, Frame]
+
+
+def as_frame(image: Optional[ImageInput]) -> Optional[Frame]:
+    if image is None or isinstance(image, Frame):
+        return image
+    if isinstance(image, bytes):
+        return Frame.from_bytes(image)
+    return Frame.from_path(image)
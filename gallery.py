@@ -0,0 +1,397 @@
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from face_index import ENCODING_DIM, ExactIndex
+
+
+# Odległości od centroidów liczymy z rozwinięcia |c|² - 2c·q + |q|² (float32);
+# zapas na kwadrat odległości pokrywa błąd zaokrągleń z nadmiarem, żeby
+# przycinanie nigdy nie odrzuciło użytkownika, którego wiersz by wygrał.
+SQUARED_SLACK = 1e-4
+# Liczba użytkowników sprawdzanych dokładnie w pierwszej porcji (kolejne rosną 2x)
+PRUNING_BATCH = 16
+# Gdy przycinanie nie odrzuca nawet tej części użytkowników (np. twarz spoza
+# galerii), szybsze jest przeszukanie wszystkich wierszy jedną operacją
+PRUNING_MIN_SKIP = 0.5
+BUILD_CHUNK = 65536
+
+
+class PruningStats:
+    """
+    Liczniki dopasowań 1:N z przycinaniem po centroidach: ile porównań
+    wykonałoby przeszukanie wyczerpujące, a ile faktycznie wykonano.
+    """
+
+    FIELDS = ("queries", "rows_total", "rows_compared", "centroids_compared", "users_pruned")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                self._counters[name] += int(value)
+
+    def merge(self, counters: dict):
+        self.record(**counters)
+
+    def drain(self) -> dict:
+        """Zwraca liczniki od ostatniego odczytu i zeruje je (przekazywanie z procesów roboczych)."""
+        with self._lock:
+            counters = self._counters
+            self._counters = dict.fromkeys(self.FIELDS, 0)
+        return counters
+
+    def stats(self) -> dict:
+        with self._lock:
+            counters = dict(self._counters)
+        skipped = counters["rows_total"] - counters["rows_compared"]
+        counters["rows_skipped"] = skipped
+        counters["skipped_ratio"] = skipped / counters["rows_total"] if counters["rows_total"] else 0.0
+        return counters
+
+
+class CentroidBounds:
+    """
+    Centroid i promień (odległość najdalszego wektora od centroidu) zbioru
+    kodowań każdego face_id. Z nierówności trójkąta odległość zapytania od
+    dowolnego wektora użytkownika jest nie mniejsza niż d(zapytanie, centroid)
+    - promień, więc użytkownik z takim ograniczeniem powyżej bieżącego
+    najlepszego wyniku nie musi być sprawdzany.
+
+    Dopisanie wektora przesuwa centroid (średnia krocząca) i zwiększa promień
+    o przesunięcie – ograniczenie pozostaje poprawne bez przeliczania
+    wszystkich wektorów. Nowe wartości trafiają do nowego slotu za końcem
+    buforów, a migawka trzyma tylko tablicę slot per właściciel.
+    """
+
+    def __init__(
+        self,
+        centroids: np.ndarray,
+        radii: np.ndarray,
+        counts: np.ndarray,
+        slot_count: int,
+        slots: np.ndarray,
+        norms: Optional[np.ndarray] = None,
+    ):
+        self._centroids = centroids
+        self._norms = norms if norms is not None else np.einsum("ij,ij->i", centroids, centroids)
+        self._radii = radii
+        self._counts = counts
+        self.slot_count = slot_count
+        # Slot właściciela (indeks w face_ids) albo -1, gdy nie ma wektorów
+        self.slots = slots
+
+    @classmethod
+    def build(cls, index: ExactIndex, owners: np.ndarray, owner_count: int) -> "CentroidBounds":
+        owners = np.asarray(owners, dtype=np.int64)
+        counts = np.bincount(owners, minlength=owner_count)
+        present = counts > 0
+
+        # Dwa przebiegi porcjami, żeby nie kopiować całej bazy (mmap) do pamięci
+        sums = np.zeros((owner_count, ENCODING_DIM), dtype=np.float64)
+        for start in range(0, len(owners), BUILD_CHUNK):
+            rows = np.arange(start, min(start + BUILD_CHUNK, len(owners)))
+            np.add.at(sums, owners[rows], index.get(rows))
+        centroids = np.zeros((owner_count, ENCODING_DIM), dtype=np.float32)
+        centroids[present] = sums[present] / counts[present, None]
+
+        radii = np.zeros(owner_count, dtype=np.float64)
+        for start in range(0, len(owners), BUILD_CHUNK):
+            rows = np.arange(start, min(start + BUILD_CHUNK, len(owners)))
+            diff = index.get(rows) - centroids[owners[rows]]
+            np.maximum.at(radii, owners[rows], np.sqrt(np.einsum("ij,ij->i", diff, diff)))
+
+        slots = np.where(present, np.arange(owner_count), -1).astype(np.int32)
+        return cls(centroids, radii, counts.astype(np.int32), owner_count, slots)
+
+    def updated(self, changes: List[Tuple[int, Optional[np.ndarray]]], owner_count: int) -> "CentroidBounds":
+        """Nowe ograniczenia po zmianach (właściciel, wektor); wektor None usuwa zbiór właściciela."""
+        slots = np.full(owner_count, -1, dtype=np.int32)
+        slots[: len(self.slots)] = self.slots
+
+        centroids, norms, radii, counts = self._centroids, self._norms, self._radii, self._counts
+        slot_count = self.slot_count
+        needed = slot_count + sum(1 for _, vector in changes if vector is not None)
+        if needed > len(centroids):
+            capacity = max(16, 2 * needed)
+            centroids = _grown(centroids, slot_count, capacity)
+            norms = _grown(norms, slot_count, capacity)
+            radii = _grown(radii, slot_count, capacity)
+            counts = _grown(counts, slot_count, capacity)
+
+        for owner, vector in changes:
+            if vector is None:
+                slots[owner] = -1
+                continue
+
+            vector = np.asarray(vector, dtype=np.float32)
+            slot = slots[owner]
+            if slot < 0:
+                centroid, radius, count = vector, 0.0, 1
+            else:
+                count = int(counts[slot]) + 1
+                centroid = centroids[slot] + (vector - centroids[slot]) / count
+                shift = float(np.linalg.norm(centroid - centroids[slot]))
+                radius = max(radii[slot] + shift, float(np.linalg.norm(vector - centroid)))
+
+            centroids[slot_count] = centroid
+            norms[slot_count] = np.dot(centroids[slot_count], centroids[slot_count])
+            radii[slot_count] = radius
+            counts[slot_count] = count
+            slots[owner] = slot_count
+            slot_count += 1
+
+        return CentroidBounds(centroids, radii, counts, slot_count, slots, norms)
+
+    def bounds(self, encoding: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Zwraca (właściciele z wektorami, dolne i górne ograniczenia odległości
+        zapytania od najbliższego wektora każdego z nich).
+        """
+        owners = np.flatnonzero(self.slots >= 0)
+        slots = self.slots[owners]
+        # Sloty nieaktualne (po późniejszych dopisaniach) też są liczone –
+        # to jeden wiersz na rejestrację, do najbliższego przeładowania galerii
+        squared = (
+            self._norms[: self.slot_count]
+            - 2.0 * (self._centroids[: self.slot_count] @ encoding)
+            + np.dot(encoding, encoding)
+        )[slots].astype(np.float64)
+        radii = self._radii[slots]
+        lower = np.sqrt(np.maximum(squared - SQUARED_SLACK, 0.0)) - radii
+        upper = np.sqrt(np.maximum(squared, 0.0) + SQUARED_SLACK) + radii
+        return owners, lower, upper
+
+
+def _grown(buffer: np.ndarray, size: int, capacity: int) -> np.ndarray:
+    grown = np.empty((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:size] = buffer[:size]
+    return grown
+
+
+class GallerySnapshot:
+    """
+    Niezmienna, wersjonowana migawka galerii kodowań twarzy.
+
+    Czytelnicy pobierają bieżącą migawkę bez blokad i używają jej do końca
+    operacji. Zapis (`extended`) buduje nową migawkę, a serwis podmienia
+    referencję jednym przypisaniem. Bufory wektorów i właścicieli są
+    współdzielone: nowa migawka dopisuje dane wyłącznie za końcem zakresu
+    widocznego dla starej, dlatego rozszerzać można tylko najnowszą migawkę
+    (serwis pilnuje tego blokadą zapisu).
+
+    Wiersze zastąpione w dzienniku (OP_REPLACE) zostają w indeksie, ale są
+    oznaczone w masce `dead` i pomijane przy dopasowaniu – do kompaktowania.
+
+    Z `bounds` (CentroidBounds) dopasowanie przycina użytkowników po
+    centroidach i dokładnie porównuje tylko kandydatów; wynik jest taki sam
+    jak przy przeszukaniu wszystkich wierszy.
+    """
+
+    def __init__(
+        self,
+        index: ExactIndex,
+        owners: np.ndarray,
+        size: int,
+        face_ids: List[str],
+        owner_index: dict,
+        rows_by_face_id: dict,
+        generation: int,
+        dead: Optional[np.ndarray] = None,
+        bounds: Optional[CentroidBounds] = None,
+        stats: Optional[PruningStats] = None,
+    ):
+        self.index = index
+        self._owners = owners
+        self.size = size
+        self.face_ids = face_ids
+        self._owner_index = owner_index
+        self.rows_by_face_id = rows_by_face_id
+        self.generation = generation
+        self._dead = dead
+        self.bounds = bounds
+        self.stats = stats
+        self.live_rows = size - (int(np.count_nonzero(dead[:size])) if dead is not None else 0)
+
+    @property
+    def version(self) -> str:
+        """
+        Wersja galerii: generacja magazynu i liczba wierszy. Wiersze tylko
+        przybywają (zastąpienie dopisuje nowe i oznacza stare jako usunięte).
+        """
+        return f"{self.generation}.{self.size}"
+
+    @classmethod
+    def build(
+        cls,
+        index: ExactIndex,
+        owners: np.ndarray,
+        face_ids: List[str],
+        generation: int,
+        pruning: bool = False,
+        stats: Optional[PruningStats] = None,
+    ) -> "GallerySnapshot":
+        owners = np.array(owners, dtype=np.int32)
+        grouped = {face_id: [] for face_id in face_ids}
+        for row, owner in enumerate(owners.tolist()):
+            grouped[face_ids[owner]].append(row)
+        bounds = None
+        if pruning:
+            bounds = CentroidBounds.build(index, owners, len(face_ids))
+        return cls(
+            index=index,
+            owners=owners,
+            size=len(owners),
+            face_ids=list(face_ids),
+            owner_index={face_id: i for i, face_id in enumerate(face_ids)},
+            rows_by_face_id={face_id: tuple(rows) for face_id, rows in grouped.items()},
+            generation=generation,
+            bounds=bounds,
+            stats=stats,
+        )
+
+    def extended(self, entries: Iterable[Tuple[str, Optional[np.ndarray]]]) -> "GallerySnapshot":
+        """Nowa migawka z wpisami dziennika; (face_id, None) usuwa dotychczasowe wiersze face_id."""
+        entries = list(entries)
+        if not entries:
+            return self
+
+        vectors = [vector for _, vector in entries if vector is not None]
+        index = self.index.extended(vectors)
+
+        owners = self._owners
+        size = self.size
+        if size + len(vectors) > len(owners):
+            grown = np.empty(max(16, 2 * (size + len(vectors))), dtype=np.int32)
+            grown[:size] = owners[:size]
+            owners = grown
+
+        dead = self._dead
+        rows_by_face_id = dict(self.rows_by_face_id)
+        # Listę i słownik właścicieli kopiujemy przy pierwszym nowym face_id –
+        # starsze migawki (czytane bez blokady) nie mogą zobaczyć zmian
+        face_ids = self.face_ids
+        owner_index = self._owner_index
+        changes = []
+        for face_id, vector in entries:
+            if vector is None:
+                removed = rows_by_face_id.pop(face_id, ())
+                if removed:
+                    changes.append((owner_index[face_id], None))
+                    # Maska jest kopiowana – starsze migawki widzą nadal stare wiersze
+                    mask = np.zeros(size + len(vectors), dtype=bool)
+                    if dead is not None:
+                        mask[: len(dead)] = dead
+                    mask[list(removed)] = True
+                    dead = mask
+                continue
+
+            owner = owner_index.get(face_id)
+            if owner is None:
+                if face_ids is self.face_ids:
+                    face_ids = list(face_ids)
+                    owner_index = dict(owner_index)
+                owner = len(face_ids)
+                face_ids.append(face_id)
+                owner_index[face_id] = owner
+            owners[size] = owner
+            rows_by_face_id[face_id] = rows_by_face_id.get(face_id, ()) + (size,)
+            changes.append((owner, vector))
+            size += 1
+
+        bounds = self.bounds
+        if bounds is not None:
+            bounds = bounds.updated(changes, len(face_ids))
+
+        return GallerySnapshot(
+            index=index,
+            owners=owners,
+            size=size,
+            face_ids=face_ids,
+            owner_index=owner_index,
+            rows_by_face_id=rows_by_face_id,
+            generation=self.generation,
+            dead=dead,
+            bounds=bounds,
+            stats=self.stats,
+        )
+
+    def get_encodings(self, face_id: str) -> np.ndarray:
+        rows = self.rows_by_face_id.get(face_id)
+        if not rows:
+            return np.empty((0, 128), dtype=np.float32)
+        return self.index.get(rows)
+
+    def match(self, encoding) -> Optional[Tuple[str, float]]:
+        if self.bounds is not None:
+            match = self._pruned_search(np.asarray(encoding, dtype=np.float32))
+        else:
+            match = self.index.search(encoding, self._dead)
+        if match is None:
+            return None
+
+        # Najbliższy wiersz wyznacza zarazem minimum z minimów per face_id,
+        # więc jego właściciel to najlepsze dopasowanie.
+        best_row, distance = match
+        owner = int(self._owners[best_row])
+        return self.face_ids[owner], distance
+
+    def _pruned_search(self, encoding: np.ndarray) -> Optional[Tuple[int, float]]:
+        """
+        Użytkownicy w kolejności rosnącego dolnego ograniczenia, porcjami;
+        przerywamy, gdy ograniczenie przekracza najlepszą znalezioną odległość.
+        Remis rozstrzyga niższy numer wiersza – tak jak argmin po wszystkich.
+        Gdy kandydatów jest zbyt wielu, przeszukujemy wszystkie wiersze.
+        """
+        owners, lower, upper = self.bounds.bounds(encoding)
+        # Najlepszy wynik nie przekracza najmniejszego górnego ograniczenia,
+        # więc sortujemy tylko użytkowników, którzy mogą go jeszcze pobić
+        candidates = np.flatnonzero(lower <= upper.min()) if len(owners) else owners
+        if len(candidates) > (1.0 - PRUNING_MIN_SKIP) * len(owners):
+            if self.stats is not None:
+                self.stats.record(
+                    queries=1,
+                    rows_total=self.live_rows,
+                    rows_compared=self.live_rows,
+                    centroids_compared=self.bounds.slot_count,
+                )
+            return self.index.search(encoding, self._dead)
+        order = candidates[np.argsort(lower[candidates], kind="stable")]
+
+        best_row, best_distance = -1, np.inf
+        compared = users_checked = 0
+        start, batch_size = 0, PRUNING_BATCH
+        while start < len(order):
+            batch = order[start : start + batch_size]
+            start += batch_size
+            batch_size *= 2
+            batch = batch[lower[batch] <= best_distance]
+            if len(batch) == 0:
+                break
+            rows = np.sort(np.concatenate([
+                self.rows_by_face_id[self.face_ids[owner]] for owner in owners[batch]
+            ]).astype(np.int64))
+            distances = self.index.distances(self.index.get(rows), encoding)
+            compared += len(rows)
+            users_checked += len(batch)
+
+            best = int(np.argmin(distances))
+            distance = float(distances[best])
+            if distance < best_distance or (distance == best_distance and rows[best] < best_row):
+                best_row, best_distance = int(rows[best]), distance
+
+        if self.stats is not None:
+            self.stats.record(
+                queries=1,
+                rows_total=self.live_rows,
+                rows_compared=compared,
+                centroids_compared=self.bounds.slot_count,
+                users_pruned=len(owners) - users_checked,
+            )
+        if best_row < 0:
+            return None
+        return best_row, best_distance
@@ -0,0 +1,146 @@
+import argparse
+import time
+
+import numpy as np
+
+from encoding_store import EncodingStore
+from face_index import ExactIndex, _kmeans
+
+
+# Kodowania bliżej niż DEDUP_DISTANCE to praktycznie to samo zdjęcie/ujęcie
+# (ten sam użytkownik w innych warunkach ma zwykle odległość 0.3–0.5).
+DEDUP_DISTANCE = 0.1
+# Maksymalna liczba wektorów jednego face_id w galerii
+MAX_PER_USER = 10
+
+
+def _farthest_points(vectors: np.ndarray, k: int) -> np.ndarray:
+    """Start k-means: najstarszy wektor, potem kolejno najdalszy od już wybranych."""
+    chosen = [0]
+    distances = ExactIndex.distances(vectors, vectors[0])
+    for _ in range(1, k):
+        chosen.append(int(np.argmax(distances)))
+        distances = np.minimum(distances, ExactIndex.distances(vectors, vectors[chosen[-1]]))
+    return vectors[chosen]
+
+
+def select_representatives(
+    vectors: np.ndarray,
+    dedup_distance: float = DEDUP_DISTANCE,
+    max_per_user: int = MAX_PER_USER,
+) -> np.ndarray:
+    """
+    Wybiera podzbiór kodowań jednego użytkownika i zwraca indeksy
+    zachowanych wierszy (rosnąco, czyli w kolejności rejestracji).
+
+    1. Deduplikacja: wektor bliższy niż `dedup_distance` od już zachowanego
+       odpada (zostaje starszy).
+    2. Limit: jeśli nadal jest ich więcej niż `max_per_user`, k-means dzieli
+       je na `max_per_user` skupień i z każdego zostaje wektor najbliższy
+       centroidowi – podzbiór pokrywa różne warunki (oświetlenie, okulary).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    kept = []
+    for i, vector in enumerate(vectors):
+        if kept and ExactIndex.distances(vectors[kept], vector).min() < dedup_distance:
+            continue
+        kept.append(i)
+
+    if max_per_user > 0 and len(kept) > max_per_user:
+        candidates = vectors[kept]
+        centroids = _kmeans(
+            candidates, max_per_user, initial=_farthest_points(candidates, max_per_user)
+        )
+        chosen = set()
+        for centroid in centroids:
+            distances = ExactIndex.distances(candidates, centroid)
+            # Ten sam wektor może być najbliższy dwóm centroidom – bierzemy następny wolny
+            for row in np.argsort(distances):
+                if int(row) not in chosen:
+                    chosen.add(int(row))
+                    break
+        kept = [kept[row] for row in sorted(chosen)]
+
+    return np.asarray(kept, dtype=np.int64)
+
+
+def _match_time_ms(vectors: np.ndarray, probes: np.ndarray) -> float:
+    index = ExactIndex()
+    index.build(vectors)
+    start = time.perf_counter()
+    for probe in probes:
+        index.search(probe)
+    return (time.perf_counter() - start) * 1000.0 / max(1, len(probes))
+
+
+def maintain_store(
+    store: EncodingStore,
+    dedup_distance: float = DEDUP_DISTANCE,
+    max_per_user: int = MAX_PER_USER,
+    dry_run: bool = False,
+    probes: int = 200,
+    seed: int = 0,
+) -> dict:
+    """
+    Zadanie wsadowe dla całej galerii: deduplikacja i limit wektorów dla
+    każdego face_id, po czym magazyn jest przepisywany (nowa generacja, jak
+    przy kompaktowaniu – uruchamiać przy zatrzymanym serwerze).
+
+    Zwraca raport: liczba wierszy przed/po, zmienieni użytkownicy i średni
+    czas dopasowania (brute force) przed/po na losowych zapytaniach.
+    """
+    vectors, owners, face_ids = store.load()
+
+    keep = np.zeros(len(vectors), dtype=bool)
+    users_changed = 0
+    for owner in range(len(face_ids)):
+        rows = np.flatnonzero(owners == owner)
+        if len(rows) == 0:
+            continue
+        selected = rows[select_representatives(vectors[rows], dedup_distance, max_per_user)]
+        keep[selected] = True
+        if len(selected) != len(rows):
+            users_changed += 1
+
+    report = {
+        "users": int(len(np.unique(owners))),
+        "users_changed": users_changed,
+        "rows_before": int(len(vectors)),
+        "rows_after": int(keep.sum()),
+        "match_ms_before": 0.0,
+        "match_ms_after": 0.0,
+    }
+    if len(vectors):
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.integers(0, len(vectors), size=probes)]
+        queries = sample + rng.normal(0, 0.05, sample.shape).astype(np.float32)
+        report["match_ms_before"] = _match_time_ms(vectors, queries)
+        report["match_ms_after"] = _match_time_ms(vectors[keep], queries)
+
+    if not dry_run and users_changed:
+        store.write_base(vectors[keep], owners[keep], face_ids)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplikacja i limit kodowań na użytkownika")
+    parser.add_argument("--dir", default="face_encodings", help="katalog magazynu")
+    parser.add_argument("--dedup-distance", type=float, default=DEDUP_DISTANCE)
+    parser.add_argument("--max-per-user", type=int, default=MAX_PER_USER)
+    parser.add_argument("--dry-run", action="store_true", help="tylko raport, bez zapisu")
+    args = parser.parse_args()
+
+    report = maintain_store(
+        EncodingStore(args.dir), args.dedup_distance, args.max_per_user, args.dry_run
+    )
+    speedup = report["match_ms_before"] / report["match_ms_after"] if report["match_ms_after"] else 1.0
+    print(
+        f"Użytkownicy: {report['users']} (zmienieni: {report['users_changed']}), "
+        f"wiersze: {report['rows_before']} -> {report['rows_after']}"
+    )
+    print(
+        f"Dopasowanie: {report['match_ms_before']:.3f} ms -> {report['match_ms_after']:.3f} ms "
+        f"(x{speedup:.2f})"
+    )
+    if args.dry_run:
+        print("Tryb --dry-run: magazyn nie został zmieniony")
@@ -1,23 +1,34 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Query, status
+from fastapi import WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 from datetime import datetime, date, timedelta
 from jose import JWTError, jwt
+import asyncio
+import json
 import os
-import shutil
 from typing import List, Optional
 
-from database import get_db, init_db, User, Badge, AccessLog, ResultEnum
+from database import (
+    get_db, init_db, SessionLocal, AsyncSessionLocal, async_engine,
+    User, Badge, AccessLog, ResultEnum, badge_with_user,
+)
 from models import (
     UserCreate, UserResponse, BadgeCreate, BadgeResponse,
     VerificationRequest, VerificationResponse, AccessLogResponse
 )
-from face_recognition_service import FaceRecognitionService
+from access_log_query import logs_query, next_cursor, stream_ndjson
+from access_log_writer import AccessLogWriter
+from analysis_cache import AnalysisCache
+from badge_cache import BadgeCache, ResolvedBadge
+from recognition_pool import RecognitionPool
 from qr_service import QRService
 from report_service import ReportService
+from verification_session import VerificationSession
 
 app = FastAPI(title="System Weryfikacji Tożsamości")
 
@@ -25,7 +36,112 @@ SECRET_KEY = "admin-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ADMIN_PASSWORD = "admin"
 
-face_service = FaceRecognitionService()
+# Dodatkowe sprawdzenie 1:N (czy twarz nie należy do innej osoby niż właściciel
+# przepustki) wykonywane w tle, już po udzieleniu odpowiedzi bramce.
+IDENTITY_AUDIT_ENABLED = True
+
+# Liczba procesów roboczych dla rozpoznawania twarzy: domyślnie o jeden mniej
+# niż rdzeni, co najmniej jeden. Wpisanie 0 uruchamia rozpoznawanie w procesie
+# serwera (osobny wątek, bez puli procesów).
+RECOGNITION_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Indeks galerii: "exact" (brute force) albo "ivf" (przybliżony, dla bardzo dużych
+# galerii); dla "ivf" opcja nprobe reguluje kompromis recall/latencja.
+# "quantized" ({"dtype": "int8"} lub "float16") trzyma bazę w pamięci w zwartej
+# postaci i daje te same wyniki co "exact" (dokładne sprawdzenie kandydatów).
+FACE_INDEX_BACKEND = "exact"
+FACE_INDEX_OPTIONS = {}
+
+# Cache wyników analizy klatek (kodowanie, lokalizacja twarzy, werdykt detekcji
+# ekranu) po skrócie bajtów uploadu – kiosk i ponowienia wysyłają te same klatki.
+ANALYSIS_CACHE_SIZE = 256
+ANALYSIS_CACHE_TTL = 60.0
+
+# Filtr jakości klatek przed kodowaniem twarzy (patrz quality_gate.QualityGate):
+# np. {"min_sharpness": 15.0, "min_face_size": 60}; {"enabled": False} wyłącza bramki.
+QUALITY_OPTIONS = {}
+
+# Komunikaty dla kodów odrzucenia z filtra jakości (pole `reason` odpowiedzi)
+QUALITY_MESSAGES = {
+    "too_dark": "Zdjęcie zbyt ciemne – popraw oświetlenie",
+    "too_bright": "Zdjęcie prześwietlone – odsuń się od źródła światła",
+    "blurry": "Zdjęcie nieostre – nie ruszaj się podczas weryfikacji",
+    "no_face": "Nie wykryto twarzy – ustaw twarz na środku kadru",
+    "face_too_small": "Twarz zbyt mała – podejdź bliżej kamery",
+}
+
+# Polityka rozdzielczości: detekcja twarzy na klatce pomniejszonej do tego
+# dłuższego boku, kodowanie na wycinku z oryginału (None = pełna rozdzielczość).
+DETECTION_MAX_SIDE = 640
+
+# Nadpisania profili modeli dla ścieżek "enroll"/"verify"
+# (patrz face_recognition_service.DEFAULT_PROFILES), np. {"enroll": {"num_jitters": 5}}
+RECOGNITION_PROFILES = {}
+
+# Utrzymanie zbioru kodowań użytkownika przy rejestracji: odrzucanie
+# niemal identycznych wektorów i limit na face_id (reprezentanci z k-means).
+# Całą galerię porządkuje `python -m gallery_maintenance`.
+MAINTENANCE_OPTIONS = {"dedup_distance": 0.1, "max_per_user": 10}
+
+# Sesja strumieniowa /ws/verify: limit klatek i czasu bez rozstrzygnięcia
+# (patrz verification_session.VerificationSession)
+STREAM_SESSION_OPTIONS = {"max_frames": 15, "timeout": 10.0}
+
+# Weryfikacja wieloklatkowa (/api/verify): każda przesłana klatka jest
+# porównywana z deklarowaną tożsamością, a wyniki łączone są sposobem
+# "best", "mean" albo "quality_weighted" (waga = ostrość i rozmiar twarzy).
+# Przy early_stop pozostałe klatki są pomijane, gdy wynik jest już pewny
+# (co najmniej min_frames klatek i odstęp margin od progu akceptacji).
+# Limit klatek żądania jak przed łączeniem wyników – dalsze zdjęcia są pomijane.
+VERIFY_MAX_FRAMES = 3
+SCORE_FUSION = {"method": "quality_weighted", "early_stop": True, "margin": 0.1, "min_frames": 2}
+
+# Śledzenie twarzy w serii klatek: klatka analizowana po poprzedniej szuka
+# twarzy tylko wokół jej ramki (pełna detekcja, gdy tam jej nie ma).
+# Porównanie z pełną detekcją: `python -m benchmarks.tracking`.
+FRAME_TRACKING = True
+
+# Filtr wstępny przed detekcją HOG: kaskada Haara na pomniejszonej klatce
+# odrzuca klatki bez twarzy (pusty kiosk). min_neighbors – czułość (mniej =
+# więcej kandydatów), audit_rate – ułamek odrzuceń sprawdzanych mimo to przez
+# dlib (licznik pomyłek w /api/metrics). Pomiar: `python -m benchmarks.prefilter`.
+PREFILTER_OPTIONS = {"enabled": True, "min_neighbors": 3, "audit_rate": 0.05}
+
+# Log dostępu zapisywany partiami (jeden commit na partię, baza w trybie WAL):
+# partia zamykana po max_batch wpisach albo max_delay sekundach (0 = bez
+# czekania – partię tworzą wpisy zebrane w trakcie poprzedniego commitu).
+# Pomiar: `python -m benchmarks.access_log`.
+ACCESS_LOG_WRITER_OPTIONS = {"max_batch": 64, "max_delay": 0.0}
+
+# Cache przepustek (qr_code -> przepustka + właściciel) dla check-qr, verify
+# i /ws/verify. Zapisy przez API unieważniają wpisy od razu; TTL ogranicza
+# czas życia zmian wprowadzonych z pominięciem API.
+BADGE_CACHE_SIZE = 4096
+BADGE_CACHE_TTL = 30.0
+
+# Eksport logów /api/logs?format=ndjson: liczba wierszy pobieranych z kursora
+# bazy i serializowanych naraz (pamięć eksportu nie zależy od długości zakresu)
+LOG_EXPORT_BATCH = 1000
+# Strona JSON /api/logs: domyślna i największa dopuszczalna liczba wpisów
+# (dłuższe zakresy – kursorem albo eksportem NDJSON)
+LOG_PAGE_SIZE = 100
+LOG_PAGE_MAX = 1000
+
+recognition_pool = RecognitionPool(
+    workers=RECOGNITION_WORKERS,
+    cache=AnalysisCache(max_entries=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL),
+    fusion=SCORE_FUSION,
+    tracking=FRAME_TRACKING,
+    index_backend=FACE_INDEX_BACKEND,
+    index_options=FACE_INDEX_OPTIONS,
+    quality_options=QUALITY_OPTIONS,
+    detection_max_side=DETECTION_MAX_SIDE,
+    profiles=RECOGNITION_PROFILES,
+    maintenance_options=MAINTENANCE_OPTIONS,
+    prefilter_options=PREFILTER_OPTIONS,
+)
+access_log_writer = AccessLogWriter(SessionLocal, **ACCESS_LOG_WRITER_OPTIONS)
+badge_cache = BadgeCache(max_entries=BADGE_CACHE_SIZE, ttl=BADGE_CACHE_TTL)
 qr_service = QRService()
 report_service = ReportService()
 
@@ -39,8 +155,18 @@ os.makedirs("reports", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 @app.on_event("startup")
-def startup_event():
+async def startup_event():
     init_db()
+    recognition_pool.start()
+    access_log_writer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # Najpierw zapis oczekujących wpisów logu
+    await access_log_writer.stop()
+    await async_engine.dispose()
+    recognition_pool.shutdown()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -111,235 +237,470 @@ async def check_auth(credentials: Optional[HTTPAuthorizationCredentials] = Depen
 
 
 @app.get("/api/check-qr")
-async def check_qr_code(qr_code: str, db: Session = Depends(get_db)):
+async def check_qr_code(qr_code: str):
     """
     Proste sprawdzenie kodu QR, używane przed przejściem do weryfikacji twarzy.
     Tutaj sprawdzamy tylko, czy podany ciąg znaków istnieje jako qr_code w tabeli Badge
-    i czy przepustka / użytkownik są nadal ważni.
+    i czy przepustka / użytkownik są nadal ważni. Powtórne sprawdzenie tego samego
+    kodu obsługuje cache przepustek, bez zapytań do bazy.
     """
     if not qr_code or not QRService.validate_qr_code(qr_code):
         return {"valid": False, "message": "Kod QR niezgodny z bazą"}
 
-    badge = db.query(Badge).filter(Badge.qr_code == qr_code).first()
-    if not badge:
+    badge, error = await resolve_badge(qr_code)
+    if error:
         return {"valid": False, "message": "Kod QR niezgodny z bazą"}
 
-    if badge.valid_until and badge.valid_until < date.today():
-        return {"valid": False, "message": "Kod QR niezgodny z bazą"}
+    return {"valid": True, "message": "Kod QR jest prawidłowy"}
 
-    user = db.query(User).filter(User.id == badge.user_id).first()
-    if not user or not user.is_active:
-        return {"valid": False, "message": "Kod QR niezgodny z bazą"}
 
-    return {"valid": True, "message": "Kod QR jest prawidłowy"}
+def save_upload(path: str, data: bytes):
+    with open(path, "wb") as buffer:
+        buffer.write(data)
+
+
+async def audit_identity(log_id: int, probe_encoding, claimed_face_id: str):
+    """
+    Sprawdzenie 1:N po odpowiedzi dla bramki: jeśli twarz najlepiej pasuje
+    do innej osoby niż właściciel przepustki, wpis w logu oznaczamy jako SUSPICIOUS.
+    Korzysta z kodowania klatki głównej policzonego już przy weryfikacji.
+    """
+    face_result = await recognition_pool.recognize_encoding(probe_encoding, threshold=0.5)
+    if not face_result:
+        return
+
+    recognized_face_id, match_score = face_result
+    if recognized_face_id == claimed_face_id:
+        return
+
+    async with AsyncSessionLocal() as db:
+        log = await db.get(AccessLog, log_id)
+        if log:
+            log.result = "SUSPICIOUS"
+            log.match_score = match_score
+            await db.commit()
+
+
+def schedule_identity_audit(
+    background_tasks: BackgroundTasks, log_id: int, probe_encoding, claimed_face_id: str
+):
+    # Bez kodowania (brak twarzy, podejrzenie ekranu) nie ma czego porównywać
+    if IDENTITY_AUDIT_ENABLED and probe_encoding is not None:
+        background_tasks.add_task(audit_identity, log_id, probe_encoding, claimed_face_id)
 
 
 @app.post("/api/verify", response_model=VerificationResponse)
 async def verify_access(
+    background_tasks: BackgroundTasks,
     qr_code: str = Form(...),
     image: Optional[UploadFile] = File(None),
     images: List[UploadFile] = File(default=[]),
-    db: Session = Depends(get_db)
     ):
     try:
         timestamp = datetime.now()
         timestamp_str = timestamp.strftime("%Y%m%d_%H%M%S")
         image_paths: List[str] = []
+        image_data: List[bytes] = []
 
+        # Zdjęcia dekodujemy raz, z bajtów uploadu; zapis na dysk (materiał
+        # dowodowy do logu) odbywa się w tle, po wysłaniu odpowiedzi.
         if images:
-            for idx, up in enumerate(images[:3]):
+            for idx, up in enumerate(images[:VERIFY_MAX_FRAMES]):
                 fn = f"{timestamp_str}_{qr_code}_{idx}.jpg"
                 p = os.path.join(UPLOAD_DIR, fn)
-                with open(p, "wb") as buffer:
-                    shutil.copyfileobj(up.file, buffer)
+                data = await up.read()
+                background_tasks.add_task(save_upload, p, data)
                 image_paths.append(p)
+                image_data.append(data)
         elif image is not None:
             image_filename = f"{timestamp_str}_{qr_code}.jpg"
             image_path = os.path.join(UPLOAD_DIR, image_filename)
-
-            with open(image_path, "wb") as buffer:
-                shutil.copyfileobj(image.file, buffer)
+            data = await image.read()
+            background_tasks.add_task(save_upload, image_path, data)
             image_paths.append(image_path)
+            image_data.append(data)
         else:
             raise HTTPException(status_code=400, detail="Brak zdjęcia do weryfikacji")
 
         primary_image_path = image_paths[0]
 
-        liveness_ok = False
-        if len(image_paths) >= 3:
-            # Detekcja mrugnięcia – traktujemy ją teraz jako dodatkową informację,
-            # ale NIE blokujemy całej weryfikacji, gdy mrugnięcie nie zostanie wykryte.
-            liveness_ok = face_service.detect_blink_liveness(image_paths[:6])
+        # Przepustkę i użytkownika ustalamy przed analizą obrazu, żeby cały
+        # pipeline (liveness, spoofing, dopasowanie 1:1) poszedł jednym zadaniem
+        # do puli procesów. Kolejność decyzji poniżej pozostaje bez zmian.
+        badge, error = await resolve_badge(qr_code)
+        claimed_face_id = badge.face_id if not error else None
 
-        if (not liveness_ok) and face_service.detect_screen_spoof(primary_image_path):
-            log = AccessLog(
-                timestamp=timestamp,
-                result="SUSPICIOUS",
-                match_score=None,
-                badge_id=None,
-                user_id=None,
-                image_path=primary_image_path,
-            )
-            db.add(log)
-            db.commit()
+        analysis = await recognition_pool.analyze_verification(
+            image_data, claimed_face_id, threshold=0.5
+        )
+
+        if analysis["screen_spoof"]:
+            log_id = await log_access(timestamp, "SUSPICIOUS", None, None, None, primary_image_path)
         
             return VerificationResponse(
                 success=False,
                 message="Podejrzenie uzycia zdjecia lub ekranu (telefon, monitor)",
                 result="SUSPICIOUS",
-                log_id=log.id,
+                log_id=log_id,
             )
 
         # W tym miejscu upewniamy się, że kod QR istnieje w naszej bazie (tabela Badge)
-        badge = db.query(Badge).filter(Badge.qr_code == qr_code).first()
         if not badge:
-            log = AccessLog(
-                timestamp=timestamp,
-                result="REJECT",
-                match_score=None,
-                badge_id=None,
-                user_id=None,
-                image_path=primary_image_path,
-            )
-            db.add(log)
-            db.commit()
+            log_id = await log_access(timestamp, "REJECT", None, None, None, primary_image_path)
 
             return VerificationResponse(
                 success=False,
                 message="Nieprawidłowy kod QR",
                 result="REJECT",
-                log_id=log.id,
+                log_id=log_id,
             )
         
-        if badge.valid_until and badge.valid_until < date.today():
-            log = AccessLog(
-                timestamp=timestamp,
-                result="REJECT",
-                match_score=None,
-                badge_id=badge.id,
-                user_id=badge.user_id,
-                image_path=primary_image_path,
+        if badge.expired():
+            log_id = await log_access(
+                timestamp, "REJECT", None, badge.badge_id, badge.user_id, primary_image_path
             )
-            db.add(log)
-            db.commit()
 
             return VerificationResponse(
                 success=False,
                 message="Przepustka wygasła",
                 result="REJECT",
-                log_id=log.id,
+                log_id=log_id,
             )
         
-        user = db.query(User).filter(User.id == badge.user_id).first()
-        if not user or not user.is_active:
-            log = AccessLog(
-                timestamp=timestamp,
-                result="REJECT",
-                match_score=None,
-                badge_id=badge.id,
-                user_id=user.id if user else None,
-                image_path=primary_image_path,
+        if not badge.is_active:
+            log_id = await log_access(
+                timestamp, "REJECT", None, badge.badge_id,
+                badge.user_id if badge.user_exists else None, primary_image_path,
             )
-            db.add(log)
-            db.commit()
 
             return VerificationResponse(
                 success=False,
                 message="Użytkownik nieaktywny",
                 result="REJECT",
-                log_id=log.id,
+                log_id=log_id,
             )
         
-        face_result = face_service.recognize_face(primary_image_path, threshold=0.5)
+        match_score = analysis["match_score"]
         
-        if not face_result:
-            log = AccessLog(
-                timestamp=timestamp,
-                result="REJECT",
-                match_score=None,
-                badge_id=badge.id,
-                user_id=user.id,
-                image_path=primary_image_path
+        if match_score is None:
+            log_id = await log_access(
+                timestamp, "REJECT", None, badge.badge_id, badge.user_id, primary_image_path,
+                **fusion_columns(analysis),
             )
-            db.add(log)
-            db.commit()
-            
-            return VerificationResponse(
-                success=False,
-                message="Nie rozpoznano twarzy",
-                result="REJECT",
-                log_id=log.id
-            )
-        
-        recognized_face_id, match_score = face_result
-        
-        if recognized_face_id != user.face_id:
-            log = AccessLog(
-                timestamp=timestamp,
-                result="SUSPICIOUS",
-                match_score=match_score,
-                badge_id=badge.id,
-                user_id=user.id,
-                image_path=primary_image_path
+            schedule_identity_audit(
+                background_tasks, log_id, analysis["probe_encoding"], badge.face_id
             )
-            db.add(log)
-            db.commit()
             
+            quality_reason = analysis["quality_reason"]
             return VerificationResponse(
                 success=False,
-                message="Niezgodność twarzy z kartą - podejrzana sytuacja",
-                result="SUSPICIOUS",
-                match_score=match_score,
-                user_id=user.id,
-                log_id=log.id
+                message=QUALITY_MESSAGES.get(quality_reason, "Nie rozpoznano twarzy"),
+                result="REJECT",
+                log_id=log_id,
+                reason=quality_reason,
             )
         
         if match_score >= 0.5:
-            log = AccessLog(
-                timestamp=timestamp,
-                result="ACCEPT",
-                match_score=match_score,
-                badge_id=badge.id,
-                user_id=user.id,
-                image_path=primary_image_path
+            log_id = await log_access(
+                timestamp, "ACCEPT", match_score, badge.badge_id, badge.user_id, primary_image_path,
+                **fusion_columns(analysis),
+            )
+            schedule_identity_audit(
+                background_tasks, log_id, analysis["probe_encoding"], badge.face_id
             )
-            db.add(log)
-            db.commit()
             
             return VerificationResponse(
                 success=True,
                 message="Dostęp przyznany",
                 result="ACCEPT",
                 match_score=match_score,
-                user_id=user.id,
-                log_id=log.id,
-                first_name=user.first_name,
-                last_name=user.last_name
+                user_id=badge.user_id,
+                log_id=log_id,
+                first_name=badge.first_name,
+                last_name=badge.last_name
             )
         else:
-            log = AccessLog(
-                timestamp=timestamp,
-                result="REJECT",
-                match_score=match_score,
-                badge_id=badge.id,
-                user_id=user.id,
-                image_path=primary_image_path
+            log_id = await log_access(
+                timestamp, "REJECT", match_score, badge.badge_id, badge.user_id, primary_image_path,
+                **fusion_columns(analysis),
+            )
+            schedule_identity_audit(
+                background_tasks, log_id, analysis["probe_encoding"], badge.face_id
             )
-            db.add(log)
-            db.commit()
             
             return VerificationResponse(
                 success=False,
                 message="Niskie dopasowanie twarzy",
                 result="REJECT",
                 match_score=match_score,
-                log_id=log.id
+                log_id=log_id
             )
             
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Błąd weryfikacji: {str(e)}")
 
 
+def fusion_columns(analysis: dict) -> dict:
+    """Kolumny AccessLog z wynikami weryfikacji wieloklatkowej i wersją galerii."""
+    return {
+        "fused_score": analysis["fused_score"],
+        "frame_scores": json.dumps(analysis["frame_scores"]),
+        "gallery_version": analysis["gallery_version"],
+    }
+
+
+async def load_badge(qr_code: str) -> Optional[ResolvedBadge]:
+    """Odczyt przepustki i właściciela z bazy (chybienie cache przepustek)."""
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(badge_with_user(qr_code))).first()
+        if row is None:
+            return None
+        return ResolvedBadge(*row)
+
+
+async def resolve_badge(qr_code: str):
+    """Przepustka z właścicielem (ResolvedBadge) i powód odrzucenia albo None."""
+    badge = await badge_cache.resolve(qr_code, load_badge)
+    if badge is None:
+        return None, "Nieprawidłowy kod QR"
+    return badge, badge.error()
+
+
+async def log_access(
+    timestamp: datetime,
+    result: str,
+    match_score: Optional[float],
+    badge_id: Optional[int],
+    user_id: Optional[int],
+    image_path: Optional[str],
+    **columns,
+) -> int:
+    """Wpis do logu dostępu przez zapis grupowy; zwraca id zatwierdzonego wpisu."""
+    return await access_log_writer.write(
+        timestamp=timestamp,
+        result=result,
+        match_score=match_score,
+        badge_id=badge_id,
+        user_id=user_id,
+        image_path=image_path,
+        **columns,
+    )
+
+
+def stream_verification_response(
+    decision: dict, log_id: int, badge: ResolvedBadge
+) -> VerificationResponse:
+    result = decision["result"]
+    match_score = decision["match_score"]
+    if result == "SUSPICIOUS":
+        return VerificationResponse(
+            success=False,
+            message="Podejrzenie uzycia zdjecia lub ekranu (telefon, monitor)",
+            result="SUSPICIOUS",
+            log_id=log_id,
+        )
+    if result == "ACCEPT":
+        return VerificationResponse(
+            success=True,
+            message="Dostęp przyznany",
+            result="ACCEPT",
+            match_score=match_score,
+            user_id=badge.user_id,
+            log_id=log_id,
+            first_name=badge.first_name,
+            last_name=badge.last_name,
+        )
+    if match_score is None:
+        quality_reason = decision["quality_reason"]
+        return VerificationResponse(
+            success=False,
+            message=QUALITY_MESSAGES.get(quality_reason, "Nie rozpoznano twarzy"),
+            result="REJECT",
+            log_id=log_id,
+            reason=quality_reason,
+        )
+    return VerificationResponse(
+        success=False,
+        message="Niskie dopasowanie twarzy",
+        result="REJECT",
+        match_score=match_score,
+        log_id=log_id,
+    )
+
+
+def parse_stream_message(message: dict) -> Optional[dict]:
+    """Obiekt JSON z wiadomości tekstowej /ws/verify albo None, gdy jej nie da się użyć."""
+    if message.get("text") is None:
+        return None
+    try:
+        start = json.loads(message["text"])
+    except ValueError:
+        return None
+    return start if isinstance(start, dict) else None
+
+
+async def stream_error(
+    websocket: WebSocket,
+    error: Exception,
+    timestamp: Optional[datetime],
+    badge: Optional[ResolvedBadge],
+    log_id: Optional[int],
+):
+    """
+    Zakończenie sesji /ws/verify po błędzie serwera: wpis REJECT w logu (jeśli
+    sesja ruszyła, a decyzja nie została jeszcze zapisana), wynik z błędem
+    i zamknięcie kodem 1011. Kolejny błąd (np. baza, zerwane połączenie) tylko
+    wypisujemy – handler musi jeszcze uruchomić zadania w tle.
+    """
+    if timestamp is not None and log_id is None:
+        try:
+            log_id = await log_access(
+                timestamp, "REJECT", None,
+                badge.badge_id if badge else None,
+                badge.user_id if badge and badge.user_exists else None, None,
+            )
+        except Exception as e:
+            print(f"Błąd zapisu logu dostępu: {e}")
+    response = VerificationResponse(
+        success=False, message=f"Błąd weryfikacji: {error}", result="REJECT", log_id=log_id
+    )
+    try:
+        await websocket.send_json({"type": "result", **jsonable_encoder(response)})
+        await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
+    except Exception as e:
+        print(f"Błąd zamykania połączenia: {e}")
+
+
+@app.websocket("/ws/verify")
+async def verify_access_stream(websocket: WebSocket):
+    """
+    Weryfikacja strumieniowa dla kiosku – jedna sesja na skan przepustki:
+    1. klient wysyła {"qr_code": "..."},
+    2. serwer odpowiada {"type": "ready"} (albo od razu wynikiem, gdy przepustka
+       jest nieważna),
+    3. klient wysyła kolejne klatki JPEG (wiadomości binarne); po klatce, która
+       nie rozstrzyga, serwer odsyła {"type": "progress", "frames", "reason", "message"},
+    4. decyzja: {"type": "result", ...pola VerificationResponse}, po czym
+       serwer zamyka połączenie. Wiadomość tekstowa {"type": "stop"} kończy
+       sesję z dotychczas zebranymi dowodami; na inne wiadomości tekstowe
+       serwer odpowiada {"type": "error", "message"}, a sesja trwa dalej.
+    Czas sesji biegnie także wtedy, gdy klient nic nie wysyła – po nim zapada
+    decyzja z zebranych dowodów. Nieprawidłowa pierwsza wiadomość (nie obiekt
+    JSON) kończy się {"type": "error", "message"} i zamknięciem połączenia.
+    Błąd serwera w trakcie sesji jest zapisywany w logu dostępu jako REJECT
+    i odsyłany jako wynik, po czym połączenie jest zamykane kodem 1011.
+    """
+    await websocket.accept()
+    background_tasks = BackgroundTasks()
+    timestamp, badge, log_id = None, None, None
+    try:
+        try:
+            message = await asyncio.wait_for(
+                websocket.receive(), STREAM_SESSION_OPTIONS["timeout"]
+            )
+        except asyncio.TimeoutError:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return
+        if message["type"] == "websocket.disconnect":
+            return
+        start = parse_stream_message(message)
+        if start is None:
+            await websocket.send_json({
+                "type": "error",
+                "message": 'Oczekiwano wiadomości tekstowej {"qr_code": "..."}',
+            })
+            await websocket.close(code=status.WS_1003_UNSUPPORTED_DATA)
+            return
+        qr_code = str(start.get("qr_code", "")).strip()
+        timestamp = datetime.now()
+
+        # Przepustka z cache (albo krótki odczyt z bazy) – bez sesji bazy na czas kiosku
+        badge, error = await resolve_badge(qr_code)
+        if error:
+            log_id = await log_access(
+                timestamp, "REJECT", None,
+                badge.badge_id if badge else None,
+                badge.user_id if badge and badge.user_exists else None, None,
+            )
+            response = VerificationResponse(
+                success=False, message=error, result="REJECT", log_id=log_id
+            )
+            await websocket.send_json({"type": "result", **jsonable_encoder(response)})
+            await websocket.close()
+            return
+
+        session = VerificationSession(recognition_pool, badge.face_id, **STREAM_SESSION_OPTIONS)
+        await websocket.send_json({"type": "ready"})
+
+        decision = None
+        connected = True
+        while decision is None:
+            try:
+                message = await asyncio.wait_for(websocket.receive(), session.remaining)
+            except asyncio.TimeoutError:
+                # Klient milczy – sesja kończy się po czasie z zebranymi dowodami
+                decision = session.finish()
+                break
+            if message["type"] == "websocket.disconnect":
+                connected = False
+                if session.frames == 0:
+                    return
+                decision = session.finish()
+            elif message.get("bytes") is not None:
+                decision = await session.add_frame(message["bytes"])
+                if decision is None:
+                    reason = session.quality_reason
+                    await websocket.send_json({
+                        "type": "progress",
+                        "frames": session.frames,
+                        "reason": reason,
+                        "message": QUALITY_MESSAGES.get(reason),
+                    })
+            elif (parse_stream_message(message) or {}).get("type") == "stop":
+                decision = session.finish()
+            else:
+                await websocket.send_json({
+                    "type": "error",
+                    "message": 'Oczekiwano klatki JPEG albo wiadomości {"type": "stop"}',
+                })
+
+        image_path = None
+        frame = session.best_frame or session.primary_frame
+        if frame is not None:
+            image_path = os.path.join(
+                UPLOAD_DIR, f"{timestamp.strftime('%Y%m%d_%H%M%S_%f')}_{qr_code}_ws.jpg"
+            )
+            background_tasks.add_task(save_upload, image_path, frame)
+
+        if decision["result"] == "SUSPICIOUS":
+            log_id = await log_access(timestamp, "SUSPICIOUS", None, None, None, image_path)
+        else:
+            log_id = await log_access(
+                timestamp, decision["result"], decision["match_score"],
+                badge.badge_id, badge.user_id, image_path,
+                **fusion_columns(decision),
+            )
+            schedule_identity_audit(
+                background_tasks, log_id, decision["probe_encoding"], badge.face_id
+            )
+
+        if connected:
+            response = stream_verification_response(decision, log_id, badge)
+            await websocket.send_json({
+                "type": "result",
+                "frames": decision["frames"],
+                **jsonable_encoder(response),
+            })
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"Błąd weryfikacji strumieniowej: {e}")
+        await stream_error(websocket, e, timestamp, badge, log_id)
+    # Zapis klatki i audyt 1:N po wysłaniu decyzji, jak w /api/verify
+    await background_tasks()
+
+
 @app.post("/api/users", response_model=UserResponse)
 async def create_user(user: UserCreate, db: Session = Depends(get_db)):
     if not user.face_id or user.face_id.strip() == "":
@@ -358,6 +719,8 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    # Przepustki mogły wskazywać na nieistniejącego jeszcze użytkownika
+    badge_cache.invalidate_user(db_user.id)
     return db_user
 
 
@@ -378,6 +741,7 @@ async def get_user(user_id: int, db: Session = Depends(get_db)):
 @app.post("/api/users/{user_id}/register-face")
 async def register_user_face(
     user_id: int,
+    background_tasks: BackgroundTasks,
     image: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
@@ -388,10 +752,10 @@ async def register_user_face(
     image_filename = f"register_{user_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
     image_path = os.path.join(UPLOAD_DIR, image_filename)
     
-    with open(image_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+    data = await image.read()
+    background_tasks.add_task(save_upload, image_path, data)
     
-    success = face_service.register_face(image_path, user.face_id)
+    success = await recognition_pool.register_face(data, user.face_id)
     
     if success:
         return {"message": "Twarz zarejestrowana pomyślnie", "success": True}
@@ -409,6 +773,8 @@ async def create_badge(badge: BadgeCreate, db: Session = Depends(get_db)):
     db.add(db_badge)
     db.commit()
     db.refresh(db_badge)
+    # Kod mógł być zapamiętany jako nieznany
+    badge_cache.invalidate_qr(db_badge.qr_code)
     return db_badge
 
 
@@ -448,31 +814,90 @@ async def check_user_qr(user_id: int, qr_code: str, db: Session = Depends(get_db
     return {"valid": True, "message": "Kod QR jest prawidłowy"}
 
 
-@app.get("/api/logs", response_model=List[AccessLogResponse])
+@app.get(
+    "/api/logs",
+    response_model=List[AccessLogResponse],
+    responses={200: {"headers": {"X-Next-Cursor": {
+        "description": "Kursor następnej strony (parametr cursor); brak na ostatniej stronie",
+        "schema": {"type": "string"},
+    }}}},
+)
 async def get_logs(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    limit: int = 100,
-    db: Session = Depends(get_db)
+    limit: Optional[int] = Query(None, ge=1),
+    user_id: Optional[int] = None,
+    result: Optional[str] = None,
+    cursor: Optional[str] = None,
+    output: str = Query("json", alias="format"),
 ):
-    query = db.query(AccessLog)
-    
-    if start_date:
-        start = datetime.fromisoformat(start_date)
-        query = query.filter(AccessLog.timestamp >= start)
+    """
+    Wpisy logu od najnowszych. Strona ma `limit` wpisów (domyślnie LOG_PAGE_SIZE,
+    najwyżej LOG_PAGE_MAX; niedodatni limit to błąd 422), a nagłówek
+    X-Next-Cursor zawiera kursor następnej strony (parametr `cursor`); brak nagłówka
+    oznacza ostatnią stronę. Kursor jest w nagłówku, a nie w treści, żeby
+    odpowiedź pozostała listą wpisów jak przed stronicowaniem (panel, klienci API).
+    `format=ndjson` strumieniuje cały zakres (albo `limit` wpisów) jako NDJSON –
+    eksport dowolnie długiego okresu w stałej pamięci; sesję bazy otwiera wtedy
+    dopiero strumień, a strona JSON – tylko na czas zapytania.
+    """
+    try:
+        query = logs_query(
+            start=datetime.fromisoformat(start_date) if start_date else None,
+            end=datetime.fromisoformat(end_date) if end_date else None,
+            user_id=user_id,
+            result=result,
+            cursor=cursor,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    if end_date:
-        end = datetime.fromisoformat(end_date)
-        query = query.filter(AccessLog.timestamp <= end)
+    if output == "ndjson":
+        if limit is not None:
+            query = query.limit(limit)
+        return StreamingResponse(
+            stream_ndjson(AsyncSessionLocal, query, batch_size=LOG_EXPORT_BATCH),
+            media_type="application/x-ndjson",
+        )
     
-    logs = query.order_by(AccessLog.timestamp.desc()).limit(limit).all()
-    return logs
+    if limit is None:
+        limit = LOG_PAGE_SIZE
+    elif limit > LOG_PAGE_MAX:
+        raise HTTPException(
+            status_code=422, detail=f"limit strony nie może przekraczać {LOG_PAGE_MAX}"
+        )
+    async with AsyncSessionLocal() as db:
+        rows = (await db.execute(query.limit(limit))).mappings().all()
+    headers = {}
+    page_cursor = next_cursor(rows, limit)
+    if page_cursor:
+        headers["X-Next-Cursor"] = page_cursor
+    # Wiersze mają już kształt AccessLogResponse – bez walidacji każdego wpisu
+    return ORJSONResponse([dict(row) for row in rows], headers=headers)
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Liczniki do monitoringu (m.in. skuteczność cache analizy klatek)."""
+    metrics = {
+        "quality_gate": recognition_pool.quality_stats.stats(),
+        "gallery_pruning": recognition_pool.match_stats.stats(),
+        "score_fusion": recognition_pool.fusion_stats.stats(),
+        "face_prefilter": recognition_pool.prefilter_stats.stats(),
+        "access_log_writer": access_log_writer.stats(),
+        "badge_cache": badge_cache.stats(),
+    }
+    if recognition_pool.cache is not None:
+        metrics["analysis_cache"] = recognition_pool.cache.stats()
+    return metrics
 
 
 @app.get("/api/reports/generate")
 async def generate_report(
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
+    user_id: Optional[int] = None,
+    result: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
     start = datetime.now() - timedelta(days=30)
@@ -483,9 +908,14 @@ async def generate_report(
     if end_date:
         end = datetime.fromisoformat(end_date)
     
-    logs = db.query(AccessLog).filter(
+    query = db.query(AccessLog).filter(
         and_(AccessLog.timestamp >= start, AccessLog.timestamp <= end)
-    ).all()
+    )
+    if user_id is not None:
+        query = query.filter(AccessLog.user_id == user_id)
+    if result:
+        query = query.filter(AccessLog.result == result)
+    logs = query.all()
     
     logs_data = []
     for log in logs:
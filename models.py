@@ -49,6 +49,9 @@ class AccessLogResponse(BaseModel):
     badge_id: Optional[int]
     user_id: Optional[int]
     image_path: Optional[str]
+    fused_score: Optional[float] = None
+    frame_scores: Optional[str] = None
+    gallery_version: Optional[str] = None
 
     class Config:
         from_attributes = True
@@ -63,6 +66,8 @@ class VerificationResponse(BaseModel):
     log_id: Optional[int] = None
     first_name: Optional[str] = None
     last_name: Optional[str] = None
+    # Kod odrzucenia klatki przez filtr jakości (np. "blurry", "too_dark")
+    reason: Optional[str] = None
 
 
 
@@ -0,0 +1,123 @@
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# Kody odrzucenia (maszynowe – frontend dobiera na ich podstawie podpowiedź)
+TOO_DARK = "too_dark"
+TOO_BRIGHT = "too_bright"
+BLURRY = "blurry"
+NO_FACE = "no_face"
+FACE_TOO_SMALL = "face_too_small"
+
+# Kolejność bramek: od najtańszej; pierwsze odrzucenie kończy ocenę klatki
+REASONS = (TOO_DARK, TOO_BRIGHT, BLURRY, NO_FACE, FACE_TOO_SMALL)
+
+
+class QualityGate:
+    """
+    Tani filtr jakości klatki uruchamiany przed normalizacją CLAHE
+    i kodowaniem twarzy (model "large"). Klatka zbyt ciemna/jasna, nieostra
+    albo z za małą twarzą i tak nie da użytecznego kodowania.
+
+    Ekspozycja i ostrość są liczone na pomniejszonej klatce w skali szarości,
+    rozmiar twarzy – z ramki z detektora (pełna rozdzielczość).
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_brightness: float = 40.0,
+        max_brightness: float = 220.0,
+        min_sharpness: float = 15.0,
+        min_face_size: int = 60,
+        max_side: int = 640,
+    ):
+        self.enabled = enabled
+        # Średnia jasność (0–255) klatki
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        # Wariancja laplasjanu – miara ostrości (rozmyte klatki mają pojedyncze jednostki)
+        self.min_sharpness = min_sharpness
+        # Krótszy bok ramki twarzy w pikselach
+        self.min_face_size = min_face_size
+        self.max_side = max_side
+
+    def _small_gray(self, gray: np.ndarray) -> np.ndarray:
+        h, w = gray.shape[:2]
+        scale = float(self.max_side) / max(h, w)
+        if scale < 1.0:
+            gray = cv2.resize(gray, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        return gray
+
+    def check_image(self, gray: np.ndarray) -> Optional[str]:
+        """Ekspozycja i ostrość; zwraca kod odrzucenia albo None."""
+        if not self.enabled:
+            return None
+        return self.assess_image(gray)[0]
+
+    def assess_image(self, gray: np.ndarray) -> Tuple[Optional[str], Optional[float]]:
+        """
+        Jak check_image, ale zwraca też ostrość (wariancję laplasjanu) – waga
+        klatki przy łączeniu wyników kilku klatek. Ostrość jest None, gdy
+        klatkę odrzuciła już ekspozycja.
+        """
+        gray = self._small_gray(gray)
+        brightness = float(cv2.mean(gray)[0])
+        if self.enabled and brightness < self.min_brightness:
+            return TOO_DARK, None
+        if self.enabled and brightness > self.max_brightness:
+            return TOO_BRIGHT, None
+
+        _, std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_32F))
+        sharpness = float(std[0, 0]) ** 2
+        if self.enabled and sharpness < self.min_sharpness:
+            return BLURRY, sharpness
+        return None, sharpness
+
+    def check_face(self, face_locations: list) -> Optional[str]:
+        """Ramka twarzy (pierwsza wykryta); zwraca kod odrzucenia albo None."""
+        if len(face_locations) == 0:
+            return NO_FACE
+        if not self.enabled:
+            return None
+
+        top, right, bottom, left = face_locations[0]
+        if min(bottom - top, right - left) < self.min_face_size:
+            return FACE_TOO_SMALL
+        return None
+
+
+class QualityStats:
+    """
+    Liczniki bramek jakości dla analizowanych klatek: ile klatek dotarło
+    do każdej bramki, ile odrzuciła i ile pracy (kodowań, detekcji) to oszczędziło.
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.rejected = {reason: 0 for reason in REASONS}
+
+    def record(self, reason: Optional[str]):
+        self.frames += 1
+        if reason is not None:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    def stats(self) -> dict:
+        # Dla każdej bramki: ile klatek do niej dotarło i ile odrzuciła
+        gates = {}
+        reached = self.frames
+        for reason in REASONS:
+            gates[reason] = {"checked": reached, "rejected": self.rejected[reason]}
+            reached -= self.rejected[reason]
+        rejected = sum(self.rejected.values())
+        return {
+            "frames": self.frames,
+            "passed": self.frames - rejected,
+            # Klatki bez twarzy nie były kodowane także przed wprowadzeniem bramek
+            "encodings_saved": rejected - self.rejected[NO_FACE],
+            # Odrzucone przed CLAHE i detekcją twarzy (HOG)
+            "detections_saved": sum(self.rejected[r] for r in (TOO_DARK, TOO_BRIGHT, BLURRY)),
+            "gates": gates,
+        }
@@ -0,0 +1,266 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from analysis_cache import AnalysisCache
+from face_recognition_service import FaceRecognitionService, prepare_storage
+from face_prefilter import PrefilterStats
+from gallery import PruningStats
+from quality_gate import QualityStats
+import score_fusion
+from score_fusion import FusionStats
+
+
+# Stan procesu roboczego: każdy proces otwiera galerię raz (w initializerze)
+# i dociąga nowe wpisy z dziennika magazynu, gdy zmieni się wersja galerii.
+_worker_service: Optional[FaceRecognitionService] = None
+_worker_gallery_version = 0
+
+
+def _init_worker(service_options: dict):
+    global _worker_service, _worker_gallery_version
+    _worker_service = FaceRecognitionService(**service_options)
+    _worker_gallery_version = 0
+
+
+def _run(service: FaceRecognitionService, method: str, args: tuple):
+    # Liczniki (dopasowania, filtr wstępny) wracają razem z wynikiem
+    # i są sumowane w procesie głównym
+    result = getattr(service, method)(*args)
+    return result, service.drain_counters()
+
+
+def _worker_call(gallery_version: int, method: str, args: tuple):
+    global _worker_gallery_version
+    if gallery_version != _worker_gallery_version:
+        _worker_service.refresh_encodings()
+        _worker_gallery_version = gallery_version
+    return _run(_worker_service, method, args)
+
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+
+class RecognitionPool:
+    """
+    Warstwa wykonawcza dla FaceRecognitionService: obliczenia dlib/OpenCV
+    trafiają do puli procesów, a handlery FastAPI tylko czekają (await)
+    na wynik, więc pętla zdarzeń pozostaje responsywna.
+
+    Przy workers=0 pipeline działa w tym samym procesie, w osobnym wątku.
+    Opcjonalny `cache` (AnalysisCache) trzyma wyniki analizy klatek w procesie
+    głównym, więc powtórzona klatka nie trafia już do puli.
+    `fusion` ustawia łączenie wyników klatek weryfikacji (method, early_stop,
+    margin, min_frames – patrz score_fusion). Przy `tracking` klatki wysyłane
+    po przeanalizowaniu wcześniejszych dostają ramkę twarzy z ostatniej z nich
+    i szukają twarzy tylko w jej otoczeniu.
+    Pozostałe argumenty trafiają do konstruktora FaceRecognitionService.
+    """
+
+    def __init__(
+        self,
+        workers: int = 0,
+        cache: Optional[AnalysisCache] = None,
+        fusion: Optional[dict] = None,
+        tracking: bool = True,
+        **service_options,
+    ):
+        self.workers = workers
+        self.cache = cache
+        self.tracking = tracking
+        self.fusion = {
+            "method": score_fusion.QUALITY_WEIGHTED,
+            "early_stop": True,
+            "margin": 0.1,
+            "min_frames": 2,
+            **(fusion or {}),
+        }
+        if self.fusion["method"] not in score_fusion.METHODS:
+            raise ValueError(f"Nieznany sposób łączenia wyników: {self.fusion['method']}")
+        self.quality_stats = QualityStats()
+        self.match_stats = PruningStats()
+        self.prefilter_stats = PrefilterStats()
+        self.fusion_stats = FusionStats()
+        self.service_options = service_options
+        self.gallery_version = 0
+        self._local_service: Optional[FaceRecognitionService] = None
+
+        if workers > 0:
+            # Zapis magazynu raz, przed fork – initializer każdego procesu tylko czyta
+            prepare_storage(**service_options)
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_worker,
+                initargs=(service_options,),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+    @property
+    def local_service(self) -> FaceRecognitionService:
+        if self._local_service is None:
+            self._local_service = FaceRecognitionService(**self.service_options)
+        return self._local_service
+
+    def start(self):
+        """Uruchamia procesy od razu, żeby galeria była wczytana przed pierwszym żądaniem."""
+        if self.workers > 0:
+            futures = [self._executor.submit(_worker_ready) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+        else:
+            self.local_service
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    async def _call(self, method: str, *args):
+        loop = asyncio.get_running_loop()
+        if self.workers > 0:
+            result, counters = await loop.run_in_executor(
+                self._executor, _worker_call, self.gallery_version, method, args
+            )
+        else:
+            result, counters = await loop.run_in_executor(
+                self._executor, _run, self.local_service, method, args
+            )
+        self.match_stats.merge(counters["match"])
+        self.prefilter_stats.merge(counters["prefilter"])
+        return result
+
+    async def analyze_verification(
+        self,
+        images: List[bytes],
+        face_id: Optional[str],
+        threshold: float = 0.6,
+        accept_score: float = 0.5,
+    ) -> dict:
+        # Klatki są analizowane równolegle w osobnych procesach (każda także pod
+        # kątem ekranu/zdjęcia – wynik 1:1 wnoszą tylko klatki z czystym werdyktem),
+        # a decyzję podejmuje jedno krótkie zadanie. Liczbę klatek ogranicza
+        # wywołujący (VERIFY_MAX_FRAMES w main.py).
+        # Wyniki klatek wracają tutaj, więc liczniki jakości i cache są w jednym miejscu.
+        # Gdy wyniki dotychczasowych klatek rozstrzygają weryfikację
+        # (score_fusion.confident_decision), pozostałe klatki są pomijane – dlatego
+        # w puli jest naraz najwyżej tyle klatek, ile procesów, a kolejna trafia
+        # tam dopiero po ocenie poprzednich.
+        frames = list(images)
+        method = self.fusion["method"]
+        early_stop = self.fusion["early_stop"] and face_id is not None
+        window = max(1, self.workers) if early_stop else len(frames)
+        queued = list(enumerate(frames))
+        running = set()
+        analyses: List[Optional[dict]] = [None] * len(frames)
+        scores: List[Optional[float]] = [None] * len(frames)
+        done = 0
+        try:
+            while queued or running:
+                while queued and len(running) < window:
+                    i, image = queued.pop(0)
+                    running.add(asyncio.ensure_future(self._indexed(
+                        i, self.analyze_frame(image, True, self._track_from(analyses))
+                    )))
+                finished, running = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in finished:
+                    i, analyses[i] = task.result()
+                    done += 1
+                if early_stop and done < len(frames) and await self._confident(
+                    analyses, scores, face_id, accept_score
+                ):
+                    break
+        finally:
+            for task in running:
+                task.cancel()
+
+        # Anulowanie nie zatrzymuje klatki, którą proces już analizuje – pominięte
+        # są tylko klatki, które nie trafiły do puli
+        self.fusion_stats.record(len(frames), len(frames) - len(queued))
+        # Wyniki 1:1 policzone przy wczesnym zakończeniu nie są liczone drugi raz
+        return await self._call(
+            "finish_verification", analyses, face_id, threshold, None, method, scores
+        )
+
+    @staticmethod
+    async def _indexed(i: int, awaitable):
+        return i, await awaitable
+
+    def _track_from(self, analyses: list) -> Optional[tuple]:
+        # Ramka twarzy z ostatniej przeanalizowanej klatki serii
+        if not self.tracking:
+            return None
+        for analysis in reversed(analyses):
+            if analysis is not None and analysis["location"] is not None:
+                return analysis["location"]
+        return None
+
+    async def _confident(
+        self, analyses: list, scores: list, face_id: str, accept_score: float
+    ) -> bool:
+        # Klatka 0 z ekranem/zdjęciem wymaga całej serii (mrugnięcie),
+        # więc wcześniej kończymy tylko po jej czystym werdykcie
+        primary = analyses[0]
+        if primary is None or primary["screen_spoof"]:
+            return False
+        for i, analysis in enumerate(analyses):
+            if scores[i] is None and score_fusion.matchable(analysis):
+                scores[i] = await self._call("frame_score", analysis["encoding"], face_id)
+        decision = score_fusion.confident_decision(
+            scores,
+            [score_fusion.frame_weight(analysis) for analysis in analyses],
+            self.fusion["method"],
+            accept_score,
+            self.fusion["margin"],
+            self.fusion["min_frames"],
+        )
+        return decision is not None
+
+    async def analyze_frame(
+        self, image: bytes, check_spoof: bool = False, track_from: Optional[tuple] = None
+    ) -> Optional[dict]:
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(image, track_from)
+            analysis = self.cache.get(key, check_spoof)
+            if analysis is not None:
+                return analysis
+
+        analysis = await self._call("analyze_frame", image, check_spoof, track_from)
+        if analysis is not None:
+            self.quality_stats.record(analysis["quality"])
+            if key is not None:
+                self.cache.put(key, analysis)
+        return analysis
+
+    async def verify_encoding(
+        self, encoding, face_id: str, threshold: float = 0.6
+    ) -> Optional[float]:
+        return await self._call("verify_encoding", encoding, face_id, threshold)
+
+    async def score_encoding(self, encoding, face_id: str, threshold: float = 0.6) -> dict:
+        return await self._call("score_encoding", encoding, face_id, threshold)
+
+    async def blink_liveness(self, analyses: list) -> bool:
+        return await self._call("blink_liveness", analyses)
+
+    async def recognize_face(
+        self, image: bytes, threshold: float = 0.6
+    ) -> Optional[Tuple[str, float]]:
+        return await self._call("recognize_face", image, threshold)
+
+    async def recognize_encoding(
+        self, encoding, threshold: float = 0.6
+    ) -> Optional[Tuple[str, float]]:
+        return await self._call("recognize_encoding", encoding, threshold)
+
+    async def register_face(self, image: bytes, face_id: str) -> bool:
+        success = await self._call("register_face", image, face_id)
+        if success:
+            # Pozostałe procesy przeładują galerię przy najbliższym zadaniu
+            self.gallery_version += 1
+        return success
@@ -0,0 +1,126 @@
+from typing import List, Optional
+
+
+# Sposoby łączenia wyników 1:1 kolejnych klatek jednej weryfikacji
+BEST = "best"
+MEAN = "mean"
+QUALITY_WEIGHTED = "quality_weighted"
+METHODS = (BEST, MEAN, QUALITY_WEIGHTED)
+
+# Ostrość (wariancja laplasjanu) i krótszy bok twarzy w pikselach, od których
+# klatka dostaje pełną wagę w trybie quality_weighted
+SHARPNESS_REFERENCE = 100.0
+FACE_SIZE_REFERENCE = 150.0
+MIN_WEIGHT = 0.05
+
+
+def matchable(analysis: Optional[dict]) -> bool:
+    """
+    Czy klatka może wnieść wynik 1:1: ma kodowanie i przeszła detekcję
+    ekranu/zdjęcia z czystym werdyktem (None = niesprawdzona, też odpada).
+    """
+    return (
+        analysis is not None
+        and analysis.get("encoding") is not None
+        and analysis.get("screen_spoof") is False
+    )
+
+
+def frame_weight(analysis: Optional[dict]) -> float:
+    """Waga klatki z analyze_frame: ostrość i rozmiar twarzy (0 dla klatki bez kodowania)."""
+    if analysis is None or analysis.get("encoding") is None:
+        return 0.0
+    weight = 1.0
+    sharpness = analysis.get("sharpness")
+    if sharpness is not None:
+        weight *= min(1.0, sharpness / SHARPNESS_REFERENCE)
+    location = analysis.get("location")
+    if location is not None:
+        top, right, bottom, left = location
+        weight *= min(1.0, min(bottom - top, right - left) / FACE_SIZE_REFERENCE)
+    return max(MIN_WEIGHT, weight)
+
+
+def fuse_scores(
+    scores: List[Optional[float]],
+    weights: Optional[List[float]] = None,
+    method: str = QUALITY_WEIGHTED,
+) -> Optional[float]:
+    """
+    Łączy wyniki klatek (None = klatka bez wyniku, pomijana): najlepszy,
+    średnia albo średnia ważona jakością klatki. None, gdy żadna klatka nie ma wyniku.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Nieznany sposób łączenia wyników: {method}")
+    scored = [i for i, score in enumerate(scores) if score is not None]
+    if not scored:
+        return None
+    if method == BEST:
+        return max(scores[i] for i in scored)
+    if method == MEAN or weights is None:
+        return sum(scores[i] for i in scored) / len(scored)
+
+    total = sum(weights[i] for i in scored)
+    if total <= 0:
+        return sum(scores[i] for i in scored) / len(scored)
+    return sum(scores[i] * weights[i] for i in scored) / total
+
+
+def confident_decision(
+    scores: List[Optional[float]],
+    weights: Optional[List[float]],
+    method: str,
+    accept_score: float,
+    margin: float = 0.1,
+    min_frames: int = 2,
+) -> Optional[bool]:
+    """
+    Czy wynik dotychczasowych klatek rozstrzyga weryfikację: True (akceptacja),
+    False (odrzucenie) albo None (potrzeba kolejnych klatek). Przy "best"
+    akceptacja jest pewna od pierwszej klatki >= accept_score – kolejne nie
+    mogą obniżyć maksimum. W pozostałych przypadkach wymagamy `min_frames`
+    klatek z wynikiem i odstępu `margin` od progu.
+    """
+    fused = fuse_scores(scores, weights, method)
+    if fused is None:
+        return None
+    if method == BEST and fused >= accept_score:
+        return True
+
+    scored = sum(1 for score in scores if score is not None)
+    if scored < min_frames:
+        return None
+    if fused >= accept_score + margin:
+        return True
+    if fused <= accept_score - margin:
+        return False
+    return None
+
+
+class FusionStats:
+    """
+    Liczniki weryfikacji wieloklatkowych: ile zakończyło się przed
+    przeanalizowaniem wszystkich klatek i ile analiz klatek to oszczędziło.
+    """
+
+    def __init__(self):
+        self.verifications = 0
+        self.frames_submitted = 0
+        self.frames_analyzed = 0
+        self.early_stops = 0
+
+    def record(self, submitted: int, analyzed: int):
+        self.verifications += 1
+        self.frames_submitted += submitted
+        self.frames_analyzed += analyzed
+        if analyzed < submitted:
+            self.early_stops += 1
+
+    def stats(self) -> dict:
+        return {
+            "verifications": self.verifications,
+            "early_stops": self.early_stops,
+            "frames_submitted": self.frames_submitted,
+            "frames_analyzed": self.frames_analyzed,
+            "frames_skipped": self.frames_submitted - self.frames_analyzed,
+        }
@@ -0,0 +1,187 @@
+from typing import Callable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+# Widmo moiré liczymy na ROI przeskalowanym do MOIRE_SIZE x MOIRE_SIZE,
+# z wyzerowanym kwadratem niskich częstotliwości o promieniu MOIRE_RADIUS.
+MOIRE_SIZE = 256
+MOIRE_RADIUS = 18
+
+# Próg decyzji: suma punktów >= 5 przy wykrytej twarzy, >= 4 bez twarzy
+FACE_THRESHOLD = 5
+NO_FACE_THRESHOLD = 4
+
+
+def _moire_weights() -> np.ndarray:
+    """
+    Wagi elementów widma rfft2 odtwarzające statystyki pełnego widma fft2
+    po fftshift i wyzerowaniu środka. Kolumna j (0 < j < n/2) rfft zastępuje
+    dwa elementy pełnego widma: (k, j) oraz sprzężony (-k, -j); każdy z nich
+    liczy się osobno, bo wyzerowany kwadrat [-r, r) nie jest symetryczny.
+    """
+    n, r = MOIRE_SIZE, MOIRE_RADIUS
+    freqs = np.fft.fftfreq(n, d=1.0 / n).astype(np.int64)
+    low = (freqs >= -r) & (freqs < r)
+
+    # Element jest wyzerowany, gdy obie częstotliwości leżą w paśmie [-r, r)
+    kept = ~(low[:, None] & low[None, : n // 2 + 1])
+    mirror = (-np.arange(n)) % n
+    mirror_kept = ~(low[mirror][:, None] & low[mirror[: n // 2 + 1]][None, :])
+
+    weights = kept.astype(np.float32)
+    weights[:, 1 : n // 2] += mirror_kept[:, 1 : n // 2]
+    return weights
+
+
+_MOIRE_WEIGHTS = _moire_weights()
+_MOIRE_COUNT = float(MOIRE_SIZE * MOIRE_SIZE)
+
+
+def downscale(gray: np.ndarray, max_side: int = 600) -> np.ndarray:
+    h, w = gray.shape[:2]
+    scale = float(max_side) / max(h, w)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (int(w * scale), int(h * scale)))
+    return gray
+
+
+def find_screen_quad(gray: np.ndarray) -> Tuple[Optional[tuple], float, np.ndarray]:
+    """Największy czworokąt (kandydat na ekran/zdjęcie): (x, y, w, h), pole, mapa krawędzi."""
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    edges = cv2.Canny(blur, 50, 150)
+
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    img_area = gray.shape[0] * gray.shape[1]
+    best_rect = None
+    best_area = 0.0
+
+    for cnt in contours:
+        area = cv2.contourArea(cnt)
+        if area < 0.15 * img_area:
+            continue
+
+        peri = cv2.arcLength(cnt, True)
+        approx = cv2.approxPolyDP(cnt, 0.02 * peri, True)
+
+        if len(approx) == 4:
+            x, y, w_box, h_box = cv2.boundingRect(approx)
+            aspect = w_box / float(h_box)
+
+            if 0.4 < aspect < 2.5:
+                if area > best_area:
+                    best_area = area
+                    best_rect = (x, y, w_box, h_box)
+
+    return best_rect, best_area, edges
+
+
+def size_score(area_ratio: float) -> int:
+    if area_ratio > 0.40:
+        return 2
+    if area_ratio > 0.25:
+        return 1
+    return 0
+
+
+def uniform_score(roi: np.ndarray) -> int:
+    mean, std = cv2.meanStdDev(roi)
+    mean_intensity = float(mean[0, 0])
+    std_intensity = float(std[0, 0])
+    if mean_intensity > 185 and std_intensity < 30:
+        return 2
+    if mean_intensity > 160 and std_intensity < 35:
+        return 1
+    return 0
+
+
+def border_score(roi_edges: np.ndarray) -> int:
+    h_box, w_box = roi_edges.shape[:2]
+    border = max(2, int(min(w_box, h_box) * 0.06))
+    top = roi_edges[:border, :]
+    bottom = roi_edges[-border:, :]
+    left = roi_edges[:, :border]
+    right = roi_edges[:, -border:]
+    border_edges = (
+        cv2.countNonZero(top)
+        + cv2.countNonZero(bottom)
+        + cv2.countNonZero(left)
+        + cv2.countNonZero(right)
+    )
+    border_area = top.size + bottom.size + left.size + right.size
+    border_edge_density = border_edges / float(max(1, border_area))
+    if border_edge_density > 0.10:
+        return 2
+    if border_edge_density > 0.06:
+        return 1
+    return 0
+
+
+def moire_score(roi: np.ndarray) -> int:
+    """
+    Piki w widmie (moiré z siatki pikseli ekranu). Rzeczywista FFT float32
+    z maską wag daje te same średnią, odchylenie i liczbę pików ponad
+    mean + 6·std co pełna fft2 + fftshift, przy mniej niż połowie obliczeń.
+    """
+    try:
+        roi_small = cv2.resize(roi, (MOIRE_SIZE, MOIRE_SIZE)).astype(np.float32)
+        roi_small -= np.float32(roi_small.mean(dtype=np.float64))
+        mag = np.abs(np.fft.rfft2(roi_small))
+
+        weighted = _MOIRE_WEIGHTS * mag
+        m_mean = float(weighted.sum(dtype=np.float64)) / _MOIRE_COUNT
+        m_sq = float(np.einsum("ij,ij->", weighted, mag, dtype=np.float64)) / _MOIRE_COUNT
+        m_std = float(np.sqrt(max(0.0, m_sq - m_mean * m_mean)))
+
+        # Liczba pików wśród 10 największych = min(10, liczba elementów ponad progiem)
+        above = mag > m_mean + 6.0 * m_std
+        peaks = min(10, int(_MOIRE_WEIGHTS[above].sum()))
+    except Exception:
+        return 0
+
+    if peaks >= 5:
+        return 2
+    if peaks >= 2:
+        return 1
+    return 0
+
+
+def detect_screen_spoof(gray: np.ndarray, has_face: Callable[[], bool]) -> bool:
+    """
+    Czy klatka pokazuje ekran/zdjęcie zamiast twarzy. Ocena jest etapowa:
+    bez dużego czworokąta od razu False, kolejne oceny (od najtańszej, FFT
+    na końcu) przerywamy, gdy suma nie może już zmienić werdyktu. Detekcję
+    twarzy (`has_face`, zwykle HOG) wołamy tylko przy sumie równej 4 –
+    jedynym wyniku, dla którego obecność twarzy ma znaczenie.
+    """
+    gray = downscale(gray)
+    best_rect, best_area, edges = find_screen_quad(gray)
+    if best_rect is None:
+        return False
+
+    x, y, w_box, h_box = best_rect
+    roi = gray[y : y + h_box, x : x + w_box]
+    if roi.size == 0:
+        return False
+
+    img_area = gray.shape[0] * gray.shape[1]
+    stages = [
+        lambda: size_score(best_area / float(img_area)),
+        lambda: uniform_score(roi),
+        lambda: border_score(edges[y : y + h_box, x : x + w_box]),
+        lambda: moire_score(roi),
+    ]
+
+    total = 0
+    remaining = 2 * len(stages)
+    for stage in stages:
+        total += stage()
+        remaining -= 2
+        if total >= FACE_THRESHOLD:
+            return True
+        if total + remaining < NO_FACE_THRESHOLD:
+            return False
+
+    return total >= (FACE_THRESHOLD if has_face() else NO_FACE_THRESHOLD)
@@ -9,6 +9,17 @@ let verificationCompleted = false;
 let verificationInProgress = false;
 let capturedImages = [];
 let captureSessionActive = false;
+let qualityRetries = 0;
+let verifySocket = null;
+
+// Kody odrzucenia klatki przez filtr jakości – przy nich ponawiamy zdjęcie
+// zamiast kończyć weryfikację (pole `reason` odpowiedzi /api/verify).
+const QUALITY_RETRY_REASONS = ['too_dark', 'too_bright', 'blurry', 'no_face', 'face_too_small'];
+const MAX_QUALITY_RETRIES = 3;
+
+// Sesja strumieniowa /ws/verify: odstęp między klatkami (mrugnięcie musi
+// trafić między nie); bez WebSocket kiosk wraca do wysyłania serii przez POST.
+const STREAM_FRAME_GAP_MS = 150;
 
 async function startQRScan() {
     try {
@@ -188,14 +199,82 @@ async function startFaceVerification() {
         
         updateStatus('Kamera gotowa. Wykrywanie twarzy...', 'info');
         
-        faceCaptureInterval = setInterval(captureAndVerifyFace, 800);
+        if ('WebSocket' in window) {
+            startStreamVerification();
+        } else {
+            faceCaptureInterval = setInterval(captureAndVerifyFace, 800);
+        }
     } catch (error) {
         console.error('Błąd dostępu do kamery:', error);
         updateStatus('Błąd: Nie można uzyskać dostępu do kamery', 'error');
     }
 }
 
+function startStreamVerification() {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const socket = new WebSocket(`${protocol}//${window.location.host}/ws/verify`);
+    verifySocket = socket;
+    let resultReceived = false;
+
+    const sendFrame = async () => {
+        if (verifySocket !== socket || socket.readyState !== WebSocket.OPEN) return;
+        const blob = await grabVideoFrame();
+        if (!blob) {
+            setTimeout(sendFrame, STREAM_FRAME_GAP_MS);
+            return;
+        }
+        if (socket.readyState === WebSocket.OPEN) socket.send(blob);
+    };
+
+    socket.onopen = () => {
+        socket.send(JSON.stringify({ qr_code: validatedQrCode }));
+    };
+
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'ready') {
+            updateStatus('Ustaw twarz na środku i mrugnij...', 'info');
+            sendFrame();
+        } else if (data.type === 'progress') {
+            if (data.message) updateStatus(data.message, 'warning');
+            // Kolejna klatka dopiero po odpowiedzi – serwer nie kolejkuje zaległych
+            setTimeout(sendFrame, STREAM_FRAME_GAP_MS);
+        } else if (data.type === 'result') {
+            resultReceived = true;
+            verificationCompleted = true;
+            showVerificationResult(data);
+        }
+    };
+
+    socket.onclose = () => {
+        if (verifySocket === socket) verifySocket = null;
+        if (!resultReceived && !verificationCompleted && faceStream) {
+            // Brak sesji strumieniowej (np. proxy bez WebSocket) – tryb serii przez POST
+            faceCaptureInterval = setInterval(captureAndVerifyFace, 800);
+        }
+    };
+}
+
+async function grabVideoFrame() {
+    const video = document.getElementById('video');
+    const canvas = document.getElementById('canvas');
+    if (!video || !canvas || !video.videoWidth || video.readyState !== video.HAVE_ENOUGH_DATA) {
+        return null;
+    }
+    canvas.width = video.videoWidth;
+    canvas.height = video.videoHeight;
+    canvas.getContext('2d').drawImage(video, 0, 0);
+    return new Promise((resolve) => {
+        canvas.toBlob((blob) => resolve(blob && blob.size > 0 ? blob : null), 'image/jpeg', 0.95);
+    });
+}
+
 function stopFaceVerification() {
+    if (verifySocket) {
+        const socket = verifySocket;
+        verifySocket = null;
+        socket.close();
+    }
     if (faceStream) {
         faceStream.getTracks().forEach(track => track.stop());
         faceStream = null;
@@ -329,6 +408,22 @@ async function verifyAccess() {
         
         const data = await response.json();
         
+        if (
+            !data.success &&
+            QUALITY_RETRY_REASONS.includes(data.reason) &&
+            qualityRetries < MAX_QUALITY_RETRIES
+        ) {
+            // Klatka nie nadawała się do rozpoznania – podpowiedź i kolejna próba
+            qualityRetries += 1;
+            capturedImage = null;
+            capturedImages = [];
+            verificationInProgress = false;
+            resultEl.textContent = '';
+            resultEl.className = 'result-message';
+            updateStatus(`${data.message} (próba ${qualityRetries + 1}/${MAX_QUALITY_RETRIES + 1})`, 'warning');
+            return;
+        }
+        
         if (faceCaptureInterval) {
             clearInterval(faceCaptureInterval);
             faceCaptureInterval = null;
@@ -336,29 +431,7 @@ async function verifyAccess() {
         
         verificationCompleted = true;
         verificationInProgress = false;
-        
-        if (data.success) {
-            const userName = data.first_name && data.last_name 
-                ? `${data.first_name} ${data.last_name}` 
-                : 'Użytkowniku';
-            resultEl.textContent = `WITAJ ${userName.toUpperCase()}! ${data.message}`;
-            resultEl.className = 'result-message success';
-            updateStatus('Dostęp przyznany!', 'success');
-        } else {
-            if (data.result === 'SUSPICIOUS') {
-                resultEl.textContent = `⚠ ${data.message}`;
-                resultEl.className = 'result-message warning';
-                updateStatus('Podejrzana sytuacja wykryta!', 'warning');
-            } else {
-                resultEl.textContent = `✗ ${data.message}`;
-                resultEl.className = 'result-message error';
-                updateStatus('Dostęp odrzucony', 'error');
-            }
-        }
-        
-        setTimeout(() => {
-            resetVerification();
-        }, 5000);
+        showVerificationResult(data);
         
     } catch (error) {
         console.error('Błąd weryfikacji:', error);
@@ -370,6 +443,33 @@ async function verifyAccess() {
     }
 }
 
+function showVerificationResult(data) {
+    const resultEl = document.getElementById('result');
+    
+    if (data.success) {
+        const userName = data.first_name && data.last_name 
+            ? `${data.first_name} ${data.last_name}` 
+            : 'Użytkowniku';
+        resultEl.textContent = `WITAJ ${userName.toUpperCase()}! ${data.message}`;
+        resultEl.className = 'result-message success';
+        updateStatus('Dostęp przyznany!', 'success');
+    } else {
+        if (data.result === 'SUSPICIOUS') {
+            resultEl.textContent = `⚠ ${data.message}`;
+            resultEl.className = 'result-message warning';
+            updateStatus('Podejrzana sytuacja wykryta!', 'warning');
+        } else {
+            resultEl.textContent = `✗ ${data.message}`;
+            resultEl.className = 'result-message error';
+            updateStatus('Dostęp odrzucony', 'error');
+        }
+    }
+    
+    setTimeout(() => {
+        resetVerification();
+    }, 5000);
+}
+
 function resetVerification() {
     capturedImage = null;
     capturedImages = [];
@@ -377,6 +477,7 @@ function resetVerification() {
     lastQrCode = null;
     verificationCompleted = false;
     verificationInProgress = false;
+    qualityRetries = 0;
     document.getElementById('qr-code').value = '';
     document.getElementById('result').textContent = '';
     document.getElementById('result').className = 'result-message';
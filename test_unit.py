@@ -2,10 +2,32 @@ import pytest
 import os
 import tempfile
 import shutil
+import time
+import numpy as np
 from datetime import datetime, timedelta, date
 from qr_service import QRService
 from report_service import ReportService
 from database import User, Badge, AccessLog
+from models import AccessLogResponse
+from face_recognition_service import FaceRecognitionService
+from frame import Frame
+from recognition_pool import RecognitionPool
+from verification_session import VerificationSession
+from analysis_cache import AnalysisCache
+from badge_cache import BadgeCache, ResolvedBadge
+from access_log_writer import AccessLogWriter
+import screen_spoof
+from quality_gate import QualityGate, QualityStats
+from face_prefilter import FacePrefilter
+from encoding_store import (
+    EncodingStore, JOURNAL_HEADER, JOURNAL_MAGIC, OP_APPEND, RECORD_HEADER,
+)
+from face_index import ExactIndex, IVFIndex, QuantizedIndex
+from gallery_maintenance import select_representatives, maintain_store
+from score_fusion import fuse_scores, confident_decision, frame_weight
+import pickle
+import asyncio
+import cv2
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -127,6 +149,1460 @@ class TestReportService:
         assert report_path.endswith('.pdf')
 
 
+class TestFrame:
+    
+    def test_from_bytes_decodes_once(self):
+        bgr = np.zeros((40, 60, 3), dtype=np.uint8)
+        bgr[:, :, 2] = 255
+        ok, buf = cv2.imencode(".png", bgr)
+        
+        frame = Frame.from_bytes(buf.tobytes())
+        
+        assert frame is not None
+        assert frame.bgr.shape == (40, 60, 3)
+        assert frame.gray.shape == (40, 60)
+        assert frame.rgb[0, 0, 0] == 255
+        assert frame.normalized_rgb is frame.normalized_rgb
+    
+    def test_from_bytes_invalid(self):
+        assert Frame.from_bytes(b"") is None
+        assert Frame.from_bytes(b"not an image") is None
+
+
+class TestQualityGate:
+    
+    def setup_method(self):
+        self.gate = QualityGate()
+        rng = np.random.default_rng(0)
+        self.textured = rng.integers(60, 200, (480, 640)).astype(np.uint8)
+    
+    def test_exposure_and_sharpness(self):
+        assert self.gate.check_image(self.textured) is None
+        assert self.gate.check_image(self.textured // 8) == "too_dark"
+        assert self.gate.check_image(np.full((480, 640), 250, dtype=np.uint8)) == "too_bright"
+        
+        blurred = cv2.GaussianBlur(self.textured, (0, 0), 6)
+        assert self.gate.check_image(blurred) == "blurry"
+        
+        assert QualityGate(enabled=False).check_image(blurred) is None
+    
+    def test_face_box_size(self):
+        assert self.gate.check_face([]) == "no_face"
+        assert self.gate.check_face([(100, 140, 140, 100)]) == "face_too_small"
+        assert self.gate.check_face([(100, 200, 200, 100)]) is None
+    
+    def test_stats_per_gate(self):
+        stats = QualityStats()
+        for reason in [None, None, "blurry", "no_face", "too_dark"]:
+            stats.record(reason)
+        
+        summary = stats.stats()
+        assert summary["frames"] == 5
+        assert summary["passed"] == 2
+        assert summary["encodings_saved"] == 2
+        assert summary["detections_saved"] == 2
+        assert summary["gates"]["too_dark"] == {"checked": 5, "rejected": 1}
+        assert summary["gates"]["blurry"] == {"checked": 4, "rejected": 1}
+        assert summary["gates"]["no_face"] == {"checked": 3, "rejected": 1}
+        assert summary["gates"]["face_too_small"] == {"checked": 2, "rejected": 0}
+
+
+class TestFacePrefilter:
+    
+    def test_screen_counts_rejections_and_audits(self):
+        prefilter = FacePrefilter(audit_rate=0.5, seed=0)
+        prefilter.cascade = FakeCascade([])
+        gray = np.zeros((480, 640), dtype=np.uint8)
+        
+        verdicts = [prefilter.screen(gray) for _ in range(200)]
+        prefilter.cascade = FakeCascade([(1, 1, 20, 20)])
+        assert prefilter.screen(gray) is True
+        for verdict in verdicts:
+            if verdict is None:
+                prefilter.record_audit(found_face=False)
+        prefilter.record_audit(found_face=True)
+        
+        stats = prefilter.stats.stats()
+        assert stats["frames"] == 201
+        assert stats["rejected"] == 200
+        assert stats["passed"] == 1
+        assert 60 < stats["audited"] < 140
+        assert stats["miss_rate"] == pytest.approx(1 / stats["audited"])
+    
+    def test_min_size_is_in_full_resolution_pixels(self):
+        prefilter = FacePrefilter(min_size=60)
+        prefilter.cascade = FakeCascade([])
+        
+        prefilter.plausible_face(np.zeros((1080, 1920), dtype=np.uint8))
+        prefilter.plausible_face(np.zeros((480, 640), dtype=np.uint8))
+        prefilter.min_size = 160
+        prefilter.plausible_face(np.zeros((1080, 1920), dtype=np.uint8))
+        prefilter.min_size = 320
+        prefilter.plausible_face(np.zeros((1080, 1920), dtype=np.uint8))
+        
+        # Twarz 60 px nie może spaść poniżej okna kaskady (24 px): skala 0,4, nie 0,125
+        assert prefilter.cascade.inputs == [
+            ((432, 768), (24, 24)),
+            ((192, 256), (24, 24)),
+            ((162, 288), (24, 24)),
+            ((135, 240), (40, 40)),
+        ]
+    
+    def test_missing_cascade_passes_every_frame(self):
+        prefilter = FacePrefilter(cascade_path="/nonexistent/cascade.xml")
+        
+        assert prefilter.enabled is False
+        assert prefilter.screen(np.zeros((10, 10), dtype=np.uint8)) is True
+        assert prefilter.stats.stats()["frames"] == 0
+
+
+class TestScreenSpoof:
+    
+    def legacy_moire_peaks(self, roi):
+        roi_small = cv2.resize(roi, (256, 256)).astype(np.float32)
+        roi_small -= float(np.mean(roi_small))
+        mag = np.abs(np.fft.fftshift(np.fft.fft2(roi_small)))
+        mag[110:146, 110:146] = 0
+        threshold = float(np.mean(mag)) + 6.0 * float(np.std(mag))
+        return int(np.sum(np.partition(mag.reshape(-1), -10)[-10:] > threshold))
+    
+    def test_moire_score_matches_full_spectrum(self):
+        rng = np.random.default_rng(0)
+        for _ in range(20):
+            h, w = rng.integers(40, 300, 2)
+            yy, xx = np.mgrid[0:h, 0:w]
+            grating = rng.uniform(0, 40) * np.sin(rng.uniform(0, 3) * xx + rng.uniform(0, 3) * yy)
+            roi = np.clip(rng.normal(150, 20, (h, w)) + grating, 0, 255).astype(np.uint8)
+            
+            peaks = self.legacy_moire_peaks(roi)
+            expected = 2 if peaks >= 5 else 1 if peaks >= 2 else 0
+            assert screen_spoof.moire_score(roi) == expected
+    
+    def test_face_detection_skipped_when_verdict_is_decided(self):
+        calls = []
+        
+        def has_face():
+            calls.append(1)
+            return True
+        
+        # Brak czworokąta – werdykt bez liczenia ocen i bez detekcji twarzy
+        flat = np.full((240, 320), 90, dtype=np.uint8)
+        assert screen_spoof.detect_screen_spoof(flat, has_face) is False
+        
+        assert calls == []
+        
+        # Duży, jasny i jednolity ekran: suma ocen 4, więc o werdykcie
+        # decyduje dopiero obecność twarzy
+        screen = np.full((240, 320), 30, dtype=np.uint8)
+        cv2.rectangle(screen, (20, 20), (300, 220), 220, -1)
+        assert screen_spoof.detect_screen_spoof(screen, has_face) is False
+        assert screen_spoof.detect_screen_spoof(screen, lambda: False) is True
+        assert calls == [1]
+
+
+class FakeCascade:
+    """Kaskada z gotowym wynikiem detectMultiScale (testy filtra wstępnego)."""
+    
+    def __init__(self, faces):
+        self.faces = faces
+        self.calls = 0
+        self.inputs = []
+    
+    def getOriginalWindowSize(self):
+        return (24, 24)
+    
+    def detectMultiScale(self, gray, **kwargs):
+        self.calls += 1
+        self.inputs.append((gray.shape, kwargs["minSize"]))
+        return self.faces
+
+
+class TestFaceRecognitionService:
+    
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+        # Testy detekcji podmieniają HOG – filtr wstępny włączają osobno
+        self.face_service = FaceRecognitionService(
+            encodings_dir=self.temp_dir, prefilter_options={"enabled": False}
+        )
+        self.rng = np.random.default_rng(0)
+    
+    def teardown_method(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+    
+    def test_gallery_matches_nearest_face_id(self):
+        alice = self.rng.normal(0, 0.1, 128)
+        bob = self.rng.normal(0, 0.1, 128)
+        self.face_service.save_encoding("ALICE", alice)
+        self.face_service.save_encoding("BOB", bob)
+        self.face_service.save_encoding("ALICE", alice + 0.01)
+        
+        face_id, distance = self.face_service._match_gallery(bob + 0.001)
+        
+        assert face_id == "BOB"
+        assert distance < 0.05
+        assert self.face_service.gallery.size == 3
+    
+    def test_verification_compares_only_claimed_face_id(self):
+        alice = self.rng.normal(0, 0.1, 128)
+        bob = alice + 0.02
+        self.face_service.save_encoding("ALICE", alice)
+        self.face_service.save_encoding("BOB", bob)
+        probe = bob + 0.001
+        
+        # Decyzja 1:1 liczy odległość tylko do wektorów z przepustki
+        score = self.face_service.verify_encoding(probe, "ALICE", threshold=0.6)
+        assert score == pytest.approx(1.0 - np.linalg.norm(probe - alice), abs=1e-5)
+        assert self.face_service.verify_encoding(probe, "CAROL", threshold=0.6) is None
+        assert self.face_service.verify_encoding(probe + 1.0, "ALICE", threshold=0.6) is None
+        # Audyt 1:N w tle wskazuje, że twarz należy do kogoś innego
+        face_id, match_score = self.face_service.recognize_encoding(probe, threshold=0.5)
+        assert face_id == "BOB"
+        assert match_score > score
+    
+    def test_verify_face_matches_frame_against_claimed_face_id(self, monkeypatch):
+        alice = self.rng.normal(0, 0.1, 128)
+        self.face_service.save_encoding("ALICE", alice)
+        self.face_service.save_encoding("BOB", alice + 0.02)
+        probe = alice + 0.001
+        analyzed = []
+        
+        def fake_analyze_frame(image, check_spoof=False, track_from=None):
+            analyzed.append(check_spoof)
+            return {"encoding": probe, "screen_spoof": image == b"screen"}
+        
+        monkeypatch.setattr(self.face_service, "analyze_frame", fake_analyze_frame)
+        
+        score = self.face_service.verify_face(b"frame", "ALICE")
+        assert score == pytest.approx(1.0 - np.linalg.norm(probe - alice), abs=1e-5)
+        assert self.face_service.verify_face(b"screen", "ALICE") is None
+        assert analyzed == [True, True]
+        # Bez kodowań face_id klatka nie jest nawet analizowana
+        assert self.face_service.verify_face(b"frame", "CAROL") is None
+        assert analyzed == [True, True]
+    
+    def test_gallery_rebuilt_from_disk(self):
+        alice = self.rng.normal(0, 0.1, 128)
+        self.face_service.save_encoding("ALICE", alice)
+        self.face_service.save_encoding("ALICE", alice + 0.02)
+        
+        reloaded = FaceRecognitionService(encodings_dir=self.temp_dir)
+        
+        assert reloaded.gallery.size == 2
+        face_id, distance = reloaded._match_gallery(alice)
+        assert face_id == "ALICE"
+        assert distance < 1e-5
+    
+    def test_gallery_opens_compacted_store_with_mmap(self):
+        alice = self.rng.normal(0, 0.1, 128)
+        self.face_service.save_encoding("ALICE", alice)
+        self.face_service.store.compact()
+        
+        reloaded = FaceRecognitionService(encodings_dir=self.temp_dir)
+        reloaded.save_encoding("BOB", alice + 0.5)
+        
+        assert isinstance(reloaded.gallery.index._base, np.memmap)
+        assert reloaded.gallery.size == 2
+        assert reloaded.get_encodings("ALICE").shape == (1, 128)
+        assert reloaded._match_gallery(alice + 0.49)[0] == "BOB"
+    
+    def test_refresh_picks_up_other_process_writes(self):
+        other = FaceRecognitionService(encodings_dir=self.temp_dir)
+        other.save_encoding("ALICE", self.rng.normal(0, 0.1, 128))
+        
+        assert self.face_service.gallery.size == 0
+        self.face_service.refresh_encodings()
+        assert self.face_service.gallery.size == 1
+        assert "ALICE" in self.face_service.known_face_ids
+    
+    def test_gallery_snapshots_are_immutable(self):
+        alice = self.rng.normal(0, 0.1, 128)
+        self.face_service.save_encoding("ALICE", alice)
+        before = self.face_service.gallery
+        
+        self.face_service.save_encoding("BOB", alice + 0.001)
+        after = self.face_service.gallery
+        
+        assert before.version == "0.1"
+        assert after.version == "0.2"
+        assert before.match(alice + 0.001)[0] == "ALICE"
+        assert after.match(alice + 0.001)[0] == "BOB"
+        assert before.get_encodings("BOB").shape == (0, 128)
+        assert before.face_ids == ["ALICE"]
+        assert "BOB" not in before._owner_index
+        assert after.face_ids == ["ALICE", "BOB"]
+    
+    def test_concurrent_enrollment_and_matching(self):
+        import threading
+        probe = self.rng.normal(0, 0.1, 128)
+        self.face_service.save_encoding("SEED", probe)
+        errors = []
+        
+        def enroll():
+            for i in range(200):
+                self.face_service.save_encoding(f"USER_{i % 20}", probe + 0.01 * (i + 1))
+        
+        def match():
+            try:
+                for _ in range(400):
+                    gallery = self.face_service.gallery
+                    face_id, _ = gallery.match(probe)
+                    assert face_id in gallery.rows_by_face_id
+            except Exception as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=enroll)] + [
+            threading.Thread(target=match) for _ in range(3)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        assert errors == []
+        assert self.face_service.gallery.size == 201
+    
+    def test_blink_liveness_from_frame_analyses(self):
+        encoding = self.rng.normal(0, 0.1, 128)
+        analyses = [
+            {"encoding": encoding + 0.001 * i, "ear": ear}
+            for i, ear in enumerate([0.30, 0.15, 0.29])
+        ]
+        assert self.face_service.blink_liveness(analyses) is True
+        
+        # Brak zamkniętej powieki
+        open_eyes = [dict(a, ear=0.3) for a in analyses]
+        assert self.face_service.blink_liveness(open_eyes) is False
+        # Klatka bez twarzy
+        assert self.face_service.blink_liveness(analyses[:2] + [None]) is False
+        # Inna osoba na jednej z klatek
+        other = dict(analyses[2], encoding=encoding + 1.0)
+        assert self.face_service.blink_liveness(analyses[:2] + [other]) is False
+    
+    def test_detection_scale_maps_locations_back(self, monkeypatch):
+        import face_recognition_service
+        seen_shapes = []
+        
+        def fake_face_locations(image, *args):
+            seen_shapes.append(image.shape[:2])
+            return [(10, 60, 50, 20)]
+        
+        monkeypatch.setattr(
+            face_recognition_service.face_recognition, "face_locations", fake_face_locations
+        )
+        self.face_service.detection_scale = 0.5
+        frame = Frame(np.zeros((200, 300, 3), dtype=np.uint8))
+        
+        locations = self.face_service._face_locations(frame)
+        self.face_service._face_locations(frame)
+        
+        assert seen_shapes == [(100, 150)]
+        assert locations == [(20, 120, 100, 40)]
+        
+        # Limit dłuższego boku działa razem ze skalą – wygrywa mniejsza
+        self.face_service.detection_max_side = 60
+        frame = Frame(np.zeros((200, 300, 3), dtype=np.uint8))
+        assert self.face_service._face_locations(frame) == [(50, 300, 200, 100)]
+        assert seen_shapes[-1] == (40, 60)
+    
+    def test_prefiltered_verify_result_is_not_reused_for_enroll(self, monkeypatch):
+        import face_recognition_service
+        monkeypatch.setattr(
+            face_recognition_service.face_recognition, "face_locations",
+            lambda image, *args: [(10, 60, 60, 10)],
+        )
+        monkeypatch.setattr(self.face_service.prefilter, "screen", lambda gray: False)
+        frame = Frame(np.zeros((200, 200, 3), dtype=np.uint8))
+        
+        assert self.face_service._face_locations(frame) == []
+        assert self.face_service._face_locations(frame, "enroll") == [(10, 60, 60, 10)]
+    
+    def test_screen_spoof_face_check_ignores_prefilter_rejection(self, monkeypatch):
+        import face_recognition_service
+        calls = []
+        monkeypatch.setattr(
+            face_recognition_service.face_recognition, "face_locations",
+            lambda image, *args: calls.append(1) or [(10, 60, 60, 10)],
+        )
+        monkeypatch.setattr(self.face_service.prefilter, "screen", lambda gray: False)
+        seen = []
+        monkeypatch.setattr(
+            face_recognition_service.screen_spoof, "detect_screen_spoof",
+            lambda gray, has_face: seen.append(has_face()) or False,
+        )
+        frame = Frame(np.zeros((200, 200, 3), dtype=np.uint8))
+        
+        assert self.face_service._face_locations(frame) == []
+        self.face_service.detect_screen_spoof(frame)
+        
+        assert seen == [True]
+        # Wynik dlib zastępuje odrzucenie filtra i służy dalej bez ponownej detekcji
+        assert self.face_service._face_locations(frame) == [(10, 60, 60, 10)]
+        assert len(calls) == 1
+    
+    def test_tracking_searches_around_previous_face(self, monkeypatch):
+        import face_recognition_service
+        seen_shapes = []
+        found = [[(10, 60, 60, 10)]]
+        
+        def fake_face_locations(image, *args):
+            seen_shapes.append(image.shape[:2])
+            return found[0]
+        
+        monkeypatch.setattr(
+            face_recognition_service.face_recognition, "face_locations", fake_face_locations
+        )
+        previous = (100, 200, 200, 100)
+        frame = Frame(np.zeros((400, 400, 3), dtype=np.uint8))
+        
+        # Okno: ramka + połowa twarzy z każdej strony, wyrównane do kafli CLAHE (50 px)
+        assert self.face_service._face_locations(frame, previous=previous) == [(60, 110, 110, 60)]
+        assert seen_shapes == [(200, 200)]
+        assert frame.tracked is True
+        # Kodowanie z wycinka – cała klatka nie jest normalizowana
+        img, _, _, _ = self.face_service._encoding_input(frame, (60, 110, 110, 60))
+        assert img.shape[:2] == (150, 150)
+        assert frame._normalized_rgb is None
+        
+        # Brak twarzy w oknie – pełna detekcja całej klatki
+        found[0] = []
+        frame = Frame(np.zeros((400, 400, 3), dtype=np.uint8))
+        assert self.face_service._face_locations(frame, previous=previous) == []
+        assert seen_shapes[1:] == [(200, 200), (400, 400)]
+        assert frame.tracked is False
+    
+    def test_prefilter_skips_hog_and_audits_rejections(self, monkeypatch):
+        import face_recognition_service
+        hog_calls = []
+        
+        def fake_face_locations(image, *args):
+            hog_calls.append(image.shape[:2])
+            return [(10, 60, 60, 10)]
+        
+        monkeypatch.setattr(
+            face_recognition_service.face_recognition, "face_locations", fake_face_locations
+        )
+        prefilter = self.face_service.prefilter
+        prefilter.cascade = FakeCascade([])
+        
+        prefilter.audit_rate = 0.0
+        assert self.face_service._face_locations(Frame(np.zeros((100, 100, 3), np.uint8))) == []
+        assert hog_calls == []
+        # Rejestracja nie korzysta z filtra
+        enroll_frame = Frame(np.zeros((100, 100, 3), np.uint8))
+        assert self.face_service._face_locations(enroll_frame, "enroll") == [(10, 60, 60, 10)]
+        
+        # Audyt: odrzucona klatka i tak trafia do HOG, a znaleziona twarz to pomyłka filtra
+        prefilter.audit_rate = 1.0
+        assert self.face_service._face_locations(Frame(np.zeros((100, 100, 3), np.uint8))) != []
+        prefilter.cascade = FakeCascade([(5, 5, 30, 30)])
+        self.face_service._face_locations(Frame(np.zeros((100, 100, 3), np.uint8)))
+        
+        counters = self.face_service.drain_counters()["prefilter"]
+        assert counters == {"frames": 3, "rejected": 2, "audited": 1, "misses": 1}
+        assert prefilter.stats.stats()["frames"] == 0
+    
+    def test_encoding_input_crops_original_when_detection_is_downscaled(self):
+        frame = Frame(np.zeros((1000, 2000, 3), dtype=np.uint8))
+        location = (400, 1100, 600, 900)
+        
+        img, _, x0, y0 = self.face_service._encoding_input(frame, location)
+        assert img is frame.normalized_rgb
+        assert (x0, y0) == (0, 0)
+        
+        self.face_service.detection_max_side = 500
+        img, box, x0, y0 = self.face_service._encoding_input(frame, location)
+        # Ramka + margines, rozszerzone do siatki kafli CLAHE (250 x 125 px)
+        assert img.shape == (500, 500, 3)
+        assert (x0, y0) == (750, 250)
+        assert box == (150, 350, 350, 150)
+    
+    def test_profiles_override_defaults_per_path(self):
+        service = FaceRecognitionService(
+            encodings_dir=self.temp_dir, profiles={"enroll": {"num_jitters": 5}}
+        )
+        assert service.profiles["enroll"]["num_jitters"] == 5
+        assert service.profiles["enroll"]["landmarks"] == "large"
+        assert service.profiles["verify"]["num_jitters"] == 1
+
+    def test_enrollment_waits_for_store_lock_of_other_process(self):
+        import threading
+        service = FaceRecognitionService(
+            encodings_dir=self.temp_dir, maintenance_options={"dedup_distance": 0.1}
+        )
+        other = EncodingStore(self.temp_dir)
+        alice = self.rng.normal(0, 0.1, 128)
+        results = []
+        
+        with other.lock():
+            thread = threading.Thread(
+                target=lambda: results.append(service.enroll_encoding("ALICE", alice + 0.001))
+            )
+            thread.start()
+            time.sleep(0.2)
+            # Zapis "innego procesu" w trakcie – rejestracja musi go zobaczyć
+            other.append("ALICE", alice)
+        thread.join()
+        
+        assert results == ["duplicate"]
+        assert service.get_encodings("ALICE").shape == (1, 128)
+    
+    def test_enrollment_skips_duplicates_and_caps_per_user(self):
+        service = FaceRecognitionService(
+            encodings_dir=self.temp_dir,
+            maintenance_options={"dedup_distance": 0.1, "max_per_user": 3},
+        )
+        alice = self.rng.normal(0, 0.1, 128)
+        assert service.enroll_encoding("ALICE", alice) == "appended"
+        assert service.enroll_encoding("ALICE", alice + 0.001) == "duplicate"
+        for shift in (0.1, 0.2):
+            assert service.enroll_encoding("ALICE", alice + shift) == "appended"
+        before = service.gallery
+        
+        assert service.enroll_encoding("ALICE", alice + 0.3) == "replaced"
+        
+        assert service.get_encodings("ALICE").shape == (3, 128)
+        assert before.get_encodings("ALICE").shape == (3, 128)
+        # Zastąpione wiersze zostają w indeksie, ale nie są dopasowywane
+        service.enroll_encoding("BOB", alice + 5.0)
+        kept = service.get_encodings("ALICE")
+        for vector in (alice, alice + 0.1, alice + 0.2, alice + 0.3):
+            face_id, distance = service._match_gallery(vector)
+            assert face_id == "ALICE"
+            assert distance == pytest.approx(ExactIndex.distances(kept, vector).min(), abs=1e-5)
+        
+        reloaded = FaceRecognitionService(encodings_dir=self.temp_dir)
+        assert np.allclose(reloaded.get_encodings("ALICE"), kept)
+        assert reloaded.get_encodings("BOB").shape == (1, 128)
+
+    def test_centroid_pruning_matches_exhaustive_search(self):
+        centers = self.rng.normal(0, 0.06, (40, 128))
+        for i, center in enumerate(centers):
+            for _ in range(3):
+                self.face_service.save_encoding(f"U{i}", center + self.rng.normal(0, 0.025, 128))
+        self.face_service.store.compact()
+        service = FaceRecognitionService(encodings_dir=self.temp_dir)
+        # Dopisania po wczytaniu bazy i zastąpienie zbioru aktualizują ograniczenia przyrostowo
+        service.save_encoding("U0", centers[0] + 0.05)
+        service.save_encoding("NEW", centers[1] + 0.02)
+        service.store.replace("U2", [centers[2] + 0.01])
+        service.refresh_encodings()
+        
+        gallery = service.gallery
+        assert gallery.bounds is not None
+        queries = np.concatenate([
+            centers[:20] + self.rng.normal(0, 0.025, (20, 128)),
+            self.rng.normal(0, 0.06, (5, 128)),
+        ]).astype(np.float32)
+        service.match_stats.drain()
+        for query in queries:
+            assert gallery._pruned_search(query) == gallery.index.search(query, gallery._dead)
+        
+        stats = service.match_stats.stats()
+        assert stats["queries"] == 25
+        assert stats["rows_total"] == 25 * gallery.live_rows
+        assert 0 < stats["rows_skipped"] < stats["rows_total"]
+
+
+def _append_records(directory: str, face_id: str, count: int):
+    store = EncodingStore(directory)
+    for i in range(count):
+        store.append(face_id, np.full(128, i, dtype=np.float32))
+
+
+class TestEncodingStore:
+    
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.store = EncodingStore(self.temp_dir)
+        self.rng = np.random.default_rng(0)
+    
+    def teardown_method(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+    
+    def test_journal_append_and_compact(self):
+        first = self.rng.normal(0, 0.1, 128)
+        self.store.append("ALICE", first)
+        self.store.append("BOB", first + 1)
+        
+        entries, offset, _ = self.store.read_journal()
+        assert [face_id for face_id, _ in entries] == ["ALICE", "BOB"]
+        assert self.store.read_journal(offset)[0] == []
+        
+        assert self.store.compact() == 2
+        vectors, owners, face_ids, generation = self.store.load_base()
+        assert generation == 1
+        assert face_ids == ["ALICE", "BOB"]
+        assert owners.tolist() == [0, 1]
+        assert np.allclose(vectors[0], first)
+        assert self.store.read_journal()[0] == []
+    
+    def test_replace_record_drops_previous_vectors(self):
+        first = self.rng.normal(0, 0.1, 128)
+        self.store.append("ALICE", first)
+        self.store.append("BOB", first + 1)
+        self.store.compact()
+        self.store.append("ALICE", first + 2)
+        self.store.replace("ALICE", [first + 3, first + 4])
+        
+        entries, _, _ = self.store.read_journal()
+        assert [face_id for face_id, _ in entries] == ["ALICE", "ALICE", "ALICE", "ALICE"]
+        assert entries[1][1] is None
+        
+        vectors, owners, face_ids = self.store.load()
+        assert face_ids == ["ALICE", "BOB"]
+        assert owners.tolist() == [1, 0, 0]
+        assert np.allclose(vectors[1:], [first + 3, first + 4])
+    
+    def test_torn_journal_record_is_ignored(self):
+        self.store.append("ALICE", self.rng.normal(0, 0.1, 128))
+        with open(self.store.journal_path, "ab") as f:
+            f.write(b"\x01\x05\x00BOB")
+        
+        entries, _, _ = self.store.read_journal()
+        assert len(entries) == 1
+    
+    def test_interrupted_write_base_keeps_previous_base(self, monkeypatch):
+        first = self.rng.normal(0, 0.1, 128)
+        self.store.append("ALICE", first)
+        self.store.compact()
+        self.store.append("BOB", first + 1)
+        
+        replace = os.replace
+        def crash_on_manifest(src, dst):
+            if dst == self.store.face_ids_path:
+                raise OSError("przerwany zapis")
+            replace(src, dst)
+        monkeypatch.setattr(os, "replace", crash_on_manifest)
+        with pytest.raises(OSError):
+            self.store.write_base(np.zeros((3, 128)), np.array([0, 1, 2]), ["A", "B", "C"])
+        monkeypatch.undo()
+        
+        vectors, owners, face_ids = self.store.load()
+        assert self.store.generation() == 1
+        assert face_ids == ["ALICE", "BOB"]
+        assert owners.tolist() == [0, 1]
+        
+        # Kolejne generacje usuwają pliki starsze niż poprzednia
+        self.store.compact()
+        self.store.compact()
+        assert sorted(
+            name for name in os.listdir(self.temp_dir) if name.endswith(".npy")
+        ) == ["encodings.2.npy", "encodings.3.npy", "owners.2.npy", "owners.3.npy"]
+    
+    def test_journal_of_another_generation_is_ignored_and_restarted(self):
+        first = self.rng.normal(0, 0.1, 128)
+        self.store.append("ALICE", first)
+        self.store.compact()
+        # Dziennik sprzed zatwierdzonej bazy (przerwany write_base)
+        with open(self.store.journal_path, "wb") as f:
+            f.write(JOURNAL_HEADER.pack(JOURNAL_MAGIC, 0))
+            f.write(RECORD_HEADER.pack(OP_APPEND, 5) + b"ALICE" + first.astype(np.float32).tobytes())
+        
+        entries, _, generation = self.store.read_journal()
+        assert (entries, generation) == ([], 0)
+        assert self.store.load()[1].tolist() == [0]
+        
+        self.store.append("BOB", first + 1)
+        entries, _, generation = self.store.read_journal()
+        assert [face_id for face_id, _ in entries] == ["BOB"]
+        assert generation == 1
+    
+    def test_concurrent_first_appends_keep_every_record(self):
+        import multiprocessing
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(target=_append_records, args=(self.temp_dir, f"U{i}", 20))
+            for i in range(4)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        
+        entries, _, _ = self.store.read_journal()
+        assert len(entries) == 80
+    
+    def test_migrate_pickles(self):
+        single = self.rng.normal(0, 0.1, 128)
+        with open(os.path.join(self.temp_dir, "ALICE.pkl"), "wb") as f:
+            pickle.dump(single, f)
+        with open(os.path.join(self.temp_dir, "BOB.pkl"), "wb") as f:
+            pickle.dump([single + 1, single + 2], f)
+        
+        assert self.store.migrate_pickles() == 3
+        assert self.store.migrate_pickles() == 0
+        vectors, owners, face_ids = self.store.load()
+        assert face_ids == ["ALICE", "BOB"]
+        assert owners.tolist() == [0, 1, 1]
+        assert vectors.dtype == np.float32
+
+
+class TestGalleryMaintenance:
+    
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.rng = np.random.default_rng(0)
+    
+    def teardown_method(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+    
+    def test_dedup_keeps_oldest_and_cap_keeps_one_per_cluster(self):
+        centers = self.rng.normal(0, 0.3, (3, 128))
+        vectors = np.concatenate([
+            center + self.rng.normal(0, 0.02, (4, 128)) for center in centers
+        ]).astype(np.float32)
+        
+        assert select_representatives(vectors[:4], 0.5, 10).tolist() == [0]
+        
+        kept = select_representatives(vectors, dedup_distance=0.0, max_per_user=3)
+        assert sorted(kept // 4) == [0, 1, 2]
+    
+    def test_batch_job_reports_shrink(self):
+        store = EncodingStore(self.temp_dir)
+        for face_id in ("ALICE", "BOB"):
+            base = self.rng.normal(0, 0.1, 128)
+            for _ in range(6):
+                store.append(face_id, base + self.rng.normal(0, 0.001, 128))
+        store.append("CAROL", self.rng.normal(0, 0.1, 128))
+        
+        report = maintain_store(store, dedup_distance=0.1, max_per_user=10, dry_run=True)
+        assert report["rows_before"] == 13
+        assert report["rows_after"] == 3
+        assert report["users_changed"] == 2
+        assert store.generation() == 0
+        
+        maintain_store(store, dedup_distance=0.1, max_per_user=10)
+        vectors, owners, face_ids = store.load()
+        assert store.generation() == 1
+        assert owners.tolist() == [0, 1, 2]
+
+
+class TestFaceIndex:
+    
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.vectors = rng.normal(0, 0.06, (2000, 128)).astype(np.float32)
+        self.queries = self.vectors[:50] + rng.normal(0, 0.01, (50, 128)).astype(np.float32)
+    
+    def teardown_method(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+    
+    def test_ivf_with_all_lists_probed_matches_exact(self):
+        exact = ExactIndex()
+        exact.build(self.vectors)
+        ivf = IVFIndex(nlist=16, nprobe=16, min_train_size=1)
+        ivf.build(self.vectors)
+        
+        for query in self.queries:
+            assert ivf.search(query)[0] == exact.search(query)[0]
+    
+    def test_ivf_incremental_add_and_persistence(self):
+        ivf = IVFIndex(nlist=16, nprobe=2, min_train_size=1)
+        ivf.build(self.vectors, self.temp_dir, generation=3)
+        row = ivf.add(self.queries[0] + 5.0)
+        
+        assert ivf.search(self.queries[0] + 5.0)[0] == row
+        
+        reloaded = IVFIndex(nlist=16, nprobe=2, min_train_size=10 ** 6)
+        reloaded.build(self.vectors, self.temp_dir, generation=3)
+        assert reloaded.centroids is not None
+        assert np.allclose(reloaded.centroids, ivf.centroids)
+        
+        stale = IVFIndex(nlist=16, nprobe=2, min_train_size=10 ** 6)
+        stale.build(self.vectors, self.temp_dir, generation=4)
+        assert stale.centroids is None
+    
+    @pytest.mark.parametrize("dtype", ["int8", "float16"])
+    def test_quantized_index_matches_exact(self, dtype):
+        exact = ExactIndex()
+        exact.build(self.vectors)
+        quantized = QuantizedIndex(dtype=dtype)
+        quantized.build(self.vectors)
+        for index in (exact, quantized):
+            index.add(self.queries[1] + 0.001)
+        exclude = np.zeros(len(self.vectors), dtype=bool)
+        exclude[:5] = True
+        
+        for query in self.queries:
+            assert quantized.search(query) == exact.search(query)
+            assert quantized.search(query, exclude) == exact.search(query, exclude)
+        # Kody + norma i błąd kwantyzacji (8 B) na wiersz zamiast 512 B float32
+        assert quantized.memory_bytes() < self.vectors.nbytes * (0.55 if dtype == "float16" else 0.3)
+
+
+class TestAnalysisCache:
+    
+    def setup_method(self):
+        self.now = 0.0
+        self.cache = AnalysisCache(max_entries=2, ttl=10.0, clock=lambda: self.now)
+    
+    def test_hit_miss_and_lru_eviction(self):
+        a, b, c = (self.cache.key(data) for data in (b"a", b"b", b"c"))
+        assert self.cache.get(a) is None
+        self.cache.put(a, {"screen_spoof": None})
+        self.cache.put(b, {"screen_spoof": None})
+        assert self.cache.get(a) is not None
+        
+        # "a" był używany ostatnio, więc wypada "b"
+        self.cache.put(c, {"screen_spoof": None})
+        assert self.cache.get(b) is None
+        assert self.cache.get(a) is not None
+        
+        stats = self.cache.stats()
+        assert (stats["hits"], stats["misses"], stats["evictions"]) == (2, 2, 1)
+    
+    def test_tracked_analysis_has_its_own_key(self):
+        full = self.cache.key(b"frame")
+        tracked = self.cache.key(b"frame", (10, 60, 60, 10))
+        self.cache.put(full, {"screen_spoof": False})
+        
+        assert self.cache.get(tracked) is None
+        assert tracked == self.cache.key(b"frame", tuple(np.array([10, 60, 60, 10])))
+        assert tracked != self.cache.key(b"frame", (12, 60, 60, 10))
+    
+    def test_ttl_and_missing_spoof_verdict(self):
+        key = self.cache.key(b"frame")
+        self.cache.put(key, {"screen_spoof": None})
+        assert self.cache.get(key, check_spoof=True) is None
+        assert self.cache.get(key) is not None
+        
+        self.now = 11.0
+        assert self.cache.get(key) is None
+        assert self.cache.stats()["entries"] == 0
+
+
+
+class TestBadgeCache:
+    
+    def setup_method(self):
+        self.now = 0.0
+        self.cache = BadgeCache(max_entries=8, ttl=10.0, clock=lambda: self.now)
+        self.loads = []
+        self.rows = {
+            "QR1": ResolvedBadge(
+                Badge(id=1, qr_code="QR1", valid_until=date(2030, 1, 1), user_id=7),
+                User(id=7, face_id="F7", first_name="Jan", last_name="Kowalski", is_active=True),
+            ),
+        }
+    
+    async def load(self, qr_code):
+        self.loads.append(qr_code)
+        return self.rows.get(qr_code)
+    
+    def resolve(self, qr_code):
+        return asyncio.run(self.cache.resolve(qr_code, self.load))
+    
+    def test_hot_lookups_skip_loader_and_unknown_codes_are_cached(self):
+        assert self.resolve("QR1").face_id == "F7"
+        assert self.resolve("QR1").face_id == "F7"
+        assert self.resolve("NOPE") is None
+        assert self.resolve("NOPE") is None
+        assert self.loads == ["QR1", "NOPE"]
+        
+        self.now = 11.0
+        self.resolve("QR1")
+        assert self.loads == ["QR1", "NOPE", "QR1"]
+    
+    def test_invalidation_by_code_and_owner(self):
+        self.resolve("QR1")
+        self.resolve("NOPE")
+        
+        # Nowa przepustka dla zapamiętanego jako nieznany kodu
+        self.rows["NOPE"] = self.rows["QR1"]
+        self.cache.invalidate_qr("NOPE")
+        assert self.resolve("NOPE") is not None
+        
+        self.cache.invalidate_user(7)
+        assert self.cache.stats()["entries"] == 0
+        self.resolve("QR1")
+        assert self.loads == ["QR1", "NOPE", "NOPE", "QR1"]
+    
+    def test_read_started_before_invalidation_is_not_cached(self):
+        async def racing_load(qr_code):
+            # Zapis przez API w trakcie odczytu z bazy
+            self.cache.invalidate_user(7)
+            return await self.load(qr_code)
+        
+        asyncio.run(self.cache.resolve("QR1", racing_load))
+        assert self.cache.get("QR1") is None
+    
+    def test_expiry_and_inactive_owner(self):
+        expired = ResolvedBadge(
+            Badge(id=2, qr_code="QR2", valid_until=date.today() - timedelta(days=1), user_id=7),
+            None,
+        )
+        assert expired.error() == "Przepustka wygasła"
+        inactive = ResolvedBadge(Badge(id=3, qr_code="QR3", user_id=8), None)
+        assert inactive.error() == "Użytkownik nieaktywny"
+        assert not inactive.user_exists
+        assert self.rows["QR1"].error() is None
+
+class TestRecognitionPool:
+    
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+    
+    def teardown_method(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+    
+    def test_in_process_pool_runs_pipeline(self):
+        pool = RecognitionPool(workers=0, encodings_dir=self.temp_dir)
+        try:
+            analysis = asyncio.run(
+                pool.analyze_verification([b"not an image"], "UNKNOWN", threshold=0.5)
+            )
+        finally:
+            pool.shutdown()
+        
+        assert analysis == {
+            "liveness_ok": False,
+            "screen_spoof": False,
+            "match_score": None,
+            "fused_score": None,
+            "frame_scores": [None],
+            "gallery_version": "0.0",
+            "probe_encoding": None,
+            "quality_reason": None,
+        }
+    
+    def test_parallel_frame_analysis_matches_single_task(self):
+        images = [b"not an image"] * 3
+        results = []
+        for workers in (0, 2):
+            pool = RecognitionPool(workers=workers, encodings_dir=self.temp_dir)
+            try:
+                pool.start()
+                results.append(asyncio.run(
+                    pool.analyze_verification(images, "UNKNOWN", threshold=0.5)
+                ))
+            finally:
+                pool.shutdown()
+        
+        assert results[0] == results[1]
+        assert results[1]["liveness_ok"] is False
+    
+    def test_pickles_are_migrated_once_before_workers_start(self):
+        rng = np.random.default_rng(0)
+        for face_id in ("ALICE", "BOB"):
+            with open(os.path.join(self.temp_dir, f"{face_id}.pkl"), "wb") as f:
+                pickle.dump(rng.normal(0, 0.1, 128), f)
+        
+        store = EncodingStore(self.temp_dir)
+        pool = RecognitionPool(workers=3, encodings_dir=self.temp_dir)
+        try:
+            assert store.generation() == 1
+            pool.start()
+        finally:
+            pool.shutdown()
+        
+        assert store.generation() == 1
+        assert store.load()[2] == ["ALICE", "BOB"]
+        assert not [name for name in os.listdir(self.temp_dir) if name.endswith(".tmp")]
+    
+    def test_ivf_index_is_trained_once_before_workers_start(self, monkeypatch):
+        store = EncodingStore(self.temp_dir)
+        vectors = np.random.default_rng(0).normal(0, 0.1, (200, 128)).astype(np.float32)
+        store.write_base(vectors, np.arange(200, dtype=np.int32), [f"U{i}" for i in range(200)])
+        
+        pool = RecognitionPool(
+            workers=2, encodings_dir=self.temp_dir,
+            index_backend="ivf", index_options={"nlist": 8, "min_train_size": 1},
+        )
+        try:
+            assert os.path.exists(os.path.join(self.temp_dir, IVFIndex.META_FILE))
+            # Procesy robocze (fork) dziedziczą podmianę – mają tylko wczytać indeks
+            monkeypatch.setattr(IVFIndex, "train", lambda *args, **kwargs: 1 / 0)
+            pool.start()
+        finally:
+            pool.shutdown()
+    
+    def test_cache_skips_repeated_frames(self):
+        pool = RecognitionPool(
+            workers=0, cache=AnalysisCache(), encodings_dir=self.temp_dir
+        )
+        calls = []
+        service = pool.local_service
+        analyze_frame = service.analyze_frame
+        service.analyze_frame = lambda image, check_spoof=False, track_from=None: (
+            calls.append(image) or analyze_frame(image, check_spoof, track_from)
+        )
+        
+        _, buffer = cv2.imencode(".png", np.full((64, 64, 3), 128, dtype=np.uint8))
+        image = buffer.tobytes()
+        try:
+            first = asyncio.run(pool.analyze_verification([image], "UNKNOWN", threshold=0.5))
+            second = asyncio.run(pool.analyze_verification([image], "UNKNOWN", threshold=0.5))
+            # Ta sama klatka śledzona z poprzedniej ramki to inna analiza
+            asyncio.run(pool.analyze_frame(image, True, (8, 40, 40, 8)))
+        finally:
+            pool.shutdown()
+        
+        assert first == second
+        assert len(calls) == 2
+        assert pool.cache.stats()["hits"] == 1
+        # Jednolita szara klatka odpada na bramce ostrości, bez kodowania (obie analizy)
+        assert first["quality_reason"] == "blurry"
+        assert pool.quality_stats.stats()["gates"]["blurry"]["rejected"] == 2
+    
+    def test_confident_frames_skip_remaining_analysis(self):
+        pool = RecognitionPool(workers=0, encodings_dir=self.temp_dir)
+        service = pool.local_service
+        enrolled = np.full(128, 0.05, dtype=np.float32)
+        service.enroll_encoding("ALICE", enrolled)
+        calls = []
+        
+        hints = []
+        
+        def analyze_frame(image, check_spoof=False, track_from=None):
+            calls.append(image)
+            hints.append(track_from)
+            return {
+                "location": (0, 200, 200, 0), "landmarks": None, "encoding": enrolled + 0.01,
+                "ear": 0.3, "screen_spoof": False, "quality": None, "sharpness": 500.0,
+            }
+        service.analyze_frame = analyze_frame
+        scored = []
+        frame_score = service.frame_score
+        service.frame_score = lambda *args: scored.append(args[1]) or frame_score(*args)
+        
+        images = [bytes([i]) for i in range(6)]
+        try:
+            analysis = asyncio.run(pool.analyze_verification(images, "ALICE", threshold=0.5))
+        finally:
+            pool.shutdown()
+        
+        assert analysis["match_score"] == pytest.approx(analysis["fused_score"])
+        assert analysis["fused_score"] > 0.8
+        # Bez procesów klatki idą po jednej; min_frames=2 zgodne klatki wystarczą
+        assert calls == images[:2]
+        # Druga klatka szuka twarzy wokół ramki z pierwszej
+        assert hints == [None, (0, 200, 200, 0)]
+        assert analysis["frame_scores"][2:] == [None] * 4
+        # Wyniki policzone przy ocenie wczesnego zakończenia trafiają do decyzji
+        assert scored == ["ALICE", "ALICE"]
+        stats = pool.fusion_stats.stats()
+        assert stats["early_stops"] == 1
+        assert stats["frames_skipped"] == 4
+    
+    def test_screen_frames_never_contribute_scores(self):
+        pool = RecognitionPool(
+            workers=0, fusion={"early_stop": False}, encodings_dir=self.temp_dir
+        )
+        service = pool.local_service
+        enrolled = np.full(128, 0.05, dtype=np.float32)
+        service.enroll_encoding("ALICE", enrolled)
+        spoof_checks = []
+        
+        # Klatka 0 bez twarzy, kolejne z telefonu z kodowaniem właściciela przepustki
+        def analyze_frame(image, check_spoof=False, track_from=None):
+            spoof_checks.append(check_spoof)
+            screen = image != b"empty"
+            return {
+                "location": None if not screen else (0, 200, 200, 0), "landmarks": None,
+                "encoding": None if not screen else enrolled, "ear": 0.3,
+                "screen_spoof": screen if check_spoof else None,
+                "quality": "no_face" if not screen else None, "sharpness": 500.0,
+            }
+        service.analyze_frame = analyze_frame
+        
+        try:
+            replay = asyncio.run(pool.analyze_verification(
+                [b"empty", b"phone1", b"phone2"], "ALICE", threshold=0.5
+            ))
+            # Dwie klatki – obie analizowane (bez odrzucania drugiej)
+            pair = asyncio.run(pool.analyze_verification(
+                [b"empty", b"phone1"], "ALICE", threshold=0.5
+            ))
+        finally:
+            pool.shutdown()
+        
+        assert spoof_checks == [True] * 5
+        assert replay["match_score"] is None
+        assert replay["frame_scores"] == [None, None, None]
+        assert replay["probe_encoding"] is None
+        assert pair["frame_scores"] == [None, None]
+
+
+class TestScoreFusion:
+    
+    def test_fusion_methods(self):
+        scores = [0.9, None, 0.5]
+        weights = [0.1, 1.0, 0.9]
+        
+        assert fuse_scores(scores, weights, "best") == 0.9
+        assert fuse_scores(scores, weights, "mean") == pytest.approx(0.7)
+        assert fuse_scores(scores, weights, "quality_weighted") == pytest.approx(0.54)
+        assert fuse_scores([None, None], weights, "mean") is None
+        with pytest.raises(ValueError):
+            fuse_scores(scores, weights, "median")
+    
+    def test_frame_weight_prefers_sharp_large_faces(self):
+        encoding = np.zeros(128)
+        sharp = {"encoding": encoding, "sharpness": 300.0, "location": (0, 200, 200, 0)}
+        blurry = {"encoding": encoding, "sharpness": 20.0, "location": (0, 80, 80, 0)}
+        
+        assert frame_weight(sharp) == 1.0
+        assert frame_weight(blurry) == pytest.approx(0.2 * 80 / 150)
+        assert frame_weight({"encoding": None}) == 0.0
+    
+    def test_confident_decision_needs_margin_and_frames(self):
+        assert confident_decision([0.9], None, "mean", 0.5) is None
+        assert confident_decision([0.9, 0.8], None, "mean", 0.5) is True
+        assert confident_decision([0.3, 0.35], None, "mean", 0.5) is False
+        assert confident_decision([0.55, 0.5], None, "mean", 0.5) is None
+        # Maksimum nie może spaść – "best" akceptuje już po jednej klatce
+        assert confident_decision([0.55], None, "best", 0.5) is True
+
+
+class FakeSessionPool:
+    """Pula z gotowymi analizami klatek (klucz = bajty klatki) dla testów sesji."""
+    
+    def __init__(self, analyses, scores, liveness=False):
+        self.analyses = analyses
+        self.scores = scores
+        self.liveness = liveness
+        self.spoof_checks = []
+    
+    async def analyze_frame(self, image, check_spoof=False, track_from=None):
+        self.spoof_checks.append(check_spoof)
+        return dict(self.analyses[image])
+    
+    async def score_encoding(self, encoding, face_id, threshold=0.6):
+        score = self.scores[float(encoding[0])]
+        return {"frame_score": score, "match_score": score, "gallery_version": "v1"}
+    
+    async def blink_liveness(self, analyses):
+        return self.liveness
+
+
+class TestVerificationSession:
+    
+    def setup_method(self):
+        def analysis(code, spoof=False, quality=None):
+            encoding = None if code is None else np.full(128, code)
+            return {"encoding": encoding, "screen_spoof": spoof, "quality": quality, "ear": 0.3}
+        self.analyses = {
+            b"blurry": analysis(None, quality="blurry"),
+            b"weak": analysis(1.0),
+            b"good": analysis(2.0),
+            b"screen": analysis(2.0, spoof=True),
+        }
+        self.scores = {1.0: 0.45, 2.0: 0.8}
+    
+    def run(self, session, frames):
+        async def feed():
+            decision = None
+            for frame in frames:
+                decision = await session.add_frame(frame)
+                if decision is not None:
+                    break
+            return decision
+        return asyncio.run(feed())
+    
+    def test_accepts_on_first_conclusive_frame(self):
+        pool = FakeSessionPool(self.analyses, self.scores)
+        session = VerificationSession(pool, "ALICE")
+        
+        decision = self.run(session, [b"blurry", b"weak", b"good", b"good"])
+        
+        assert decision["result"] == "ACCEPT"
+        assert decision["frames"] == 3
+        assert decision["match_score"] == 0.8
+        assert pool.spoof_checks == [True, True, True]
+        # Kolumny logu jak w /api/verify: wyniki klatek, najlepszy z nich i wersja galerii
+        assert decision["frame_scores"] == [None, 0.45, 0.8]
+        assert decision["fused_score"] == 0.8
+        assert decision["gallery_version"] == "v1"
+    
+    def test_screen_flagged_frames_are_never_matched(self):
+        pool = FakeSessionPool(self.analyses, self.scores)
+        session = VerificationSession(pool, "ALICE", max_frames=3)
+        
+        assert self.run(session, [b"blurry", b"screen", b"screen"])["result"] == "REJECT"
+        assert session.best_score is None
+        
+        session = VerificationSession(pool, "ALICE")
+        decision = self.run(session, [b"blurry", b"screen", b"good"])
+        
+        assert decision["result"] == "ACCEPT"
+        assert decision["frames"] == 3
+    
+    def test_screen_without_blink_is_suspicious_after_full_window(self):
+        pool = FakeSessionPool(self.analyses, self.scores)
+        session = VerificationSession(pool, "ALICE", window=4)
+        
+        decision = self.run(session, [b"screen"] + [b"good"] * 5)
+        
+        assert decision["result"] == "SUSPICIOUS"
+        assert decision["frames"] == 4
+        assert decision["match_score"] is None
+    
+    def test_blink_clears_screen_verdict_without_matching(self):
+        pool = FakeSessionPool(self.analyses, self.scores, liveness=True)
+        session = VerificationSession(pool, "ALICE")
+        
+        decision = self.run(session, [b"screen", b"good", b"good", b"good"])
+        
+        assert decision["result"] == "REJECT"
+        assert decision["frames"] == 3
+        assert decision["match_score"] is None
+    
+    def test_rejects_after_frame_limit_with_best_evidence(self):
+        pool = FakeSessionPool(self.analyses, self.scores)
+        session = VerificationSession(pool, "ALICE", max_frames=3)
+        
+        decision = self.run(session, [b"weak", b"blurry", b"blurry"])
+        
+        assert decision["result"] == "REJECT"
+        assert decision["match_score"] == 0.45
+        assert decision["quality_reason"] is None
+        
+        unfinished = VerificationSession(pool, "ALICE")
+        assert self.run(unfinished, [b"blurry"]) is None
+        assert unfinished.finish()["quality_reason"] == "blurry"
+
+
+class TestAccessLogWriter:
+    
+    def setup_method(self):
+        from database import Base, configure_sqlite
+        self.temp_dir = tempfile.mkdtemp()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.temp_dir, 'logs.db')}")
+        configure_sqlite(self.engine)
+        Base.metadata.create_all(bind=self.engine)
+        self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+    
+    def teardown_method(self):
+        self.engine.dispose()
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+    
+    def test_concurrent_writes_share_commits_and_return_ids(self):
+        writer = AccessLogWriter(self.SessionLocal, max_batch=8, max_delay=0.05)
+        
+        async def gate(i):
+            return await writer.write(
+                timestamp=datetime.now(), result="ACCEPT", match_score=0.9,
+                badge_id=None, user_id=None, image_path=f"{i}.jpg",
+            )
+        
+        async def run():
+            ids = await asyncio.gather(*[gate(i) for i in range(20)])
+            await writer.stop()
+            return ids
+        
+        ids = asyncio.run(run())
+        
+        db = self.SessionLocal()
+        try:
+            paths = {log.id: log.image_path for log in db.query(AccessLog).all()}
+        finally:
+            db.close()
+        assert [paths[log_id] for log_id in ids] == [f"{i}.jpg" for i in range(20)]
+        stats = writer.stats()
+        assert stats["records"] == 20
+        assert stats["batches"] == 3
+        assert stats["largest_batch"] == 8
+        with self.engine.connect() as connection:
+            assert connection.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+    
+    def test_bad_record_fails_only_its_own_handler(self):
+        writer = AccessLogWriter(self.SessionLocal, max_delay=0.05)
+        
+        async def run():
+            # Lista nie jest wartością kolumny – commit partii się nie udaje
+            results = await asyncio.gather(
+                writer.write(result="ACCEPT", image_path="a.jpg"),
+                writer.write(result="REJECT", image_path=["b.jpg"]),
+                writer.write(result="ACCEPT", image_path="c.jpg"),
+                return_exceptions=True,
+            )
+            await writer.stop()
+            return results
+        
+        first, bad, last = asyncio.run(run())
+        
+        assert isinstance(bad, Exception)
+        db = self.SessionLocal()
+        try:
+            paths = {log.id: log.image_path for log in db.query(AccessLog).all()}
+        finally:
+            db.close()
+        assert paths == {first: "a.jpg", last: "c.jpg"}
+        assert writer.stats()["records"] == 2
+    
+    def test_failed_commit_raises_in_every_handler_of_the_batch(self):
+        writer = AccessLogWriter(self.SessionLocal, max_delay=0.05)
+        
+        async def run():
+            with pytest.raises(TypeError):
+                await writer.write(no_such_column=1)
+            # Zapis się nie udaje (brak tabeli) – także pojedynczo, błąd dostaje każdy handler
+            with self.engine.begin() as connection:
+                connection.exec_driver_sql("DROP TABLE access_logs")
+            results = await asyncio.gather(
+                writer.write(result="ACCEPT"), writer.write(result="REJECT"),
+                return_exceptions=True,
+            )
+            await writer.stop()
+            return results
+        
+        results = asyncio.run(run())
+        
+        assert all(isinstance(result, Exception) for result in results)
+        assert writer.stats()["records"] == 0
+
+
+class TestAsyncDatabase:
+
+    def setup_method(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "async.db")
+        from database import Base
+        engine = create_engine(f"sqlite:///{self.path}")
+        Base.metadata.create_all(bind=engine)
+        with sessionmaker(bind=engine)() as db:
+            db.add(User(id=1, face_id="F1", first_name="Jan", last_name="Kowalski"))
+            db.add(Badge(qr_code="QR-ASYNC", valid_until=date(2030, 1, 1), user_id=1))
+            db.commit()
+        engine.dispose()
+
+    def teardown_method(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def test_async_session_reads_with_pool_and_pragmas(self):
+        from sqlalchemy import select
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        from sqlalchemy.pool import AsyncAdaptedQueuePool
+        from database import configure_sqlite
+
+        async def run():
+            engine = create_async_engine(
+                f"sqlite+aiosqlite:///{self.path}",
+                poolclass=AsyncAdaptedQueuePool, pool_size=2, max_overflow=0,
+            )
+            configure_sqlite(engine.sync_engine)
+            AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+
+            async def lookup():
+                async with AsyncSessionLocal() as db:
+                    badge = await db.scalar(select(Badge).where(Badge.qr_code == "QR-ASYNC"))
+                    user = await db.get(User, badge.user_id)
+                    return user.face_id
+
+            try:
+                face_ids = await asyncio.gather(*[lookup() for _ in range(6)])
+                async with engine.connect() as connection:
+                    pragmas = [
+                        (await connection.exec_driver_sql(f"PRAGMA {name}")).scalar()
+                        for name in ("journal_mode", "synchronous")
+                    ]
+                return face_ids, pragmas
+            finally:
+                await engine.dispose()
+
+        face_ids, pragmas = asyncio.run(run())
+
+        assert face_ids == ["F1"] * 6
+        # synchronous=NORMAL to wartość 1
+        assert pragmas == ["wal", 1]
+
+
+
+class TestAccessLogQuery:
+
+    def setup_method(self):
+        from database import Base
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "logs.db")
+        engine = create_engine(f"sqlite:///{self.path}")
+        Base.metadata.create_all(bind=engine)
+        base = datetime(2026, 1, 1, 12, 0, 0)
+        with sessionmaker(bind=engine)() as db:
+            # Po trzy wpisy z tym samym czasem – strona kończy się w środku grupy
+            db.add_all(
+                AccessLog(
+                    timestamp=base - timedelta(seconds=i // 3),
+                    result="REJECT" if i % 4 == 0 else "ACCEPT",
+                    user_id=i % 2,
+                )
+                for i in range(20)
+            )
+            db.commit()
+        engine.dispose()
+
+    def teardown_method(self):
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir)
+
+    def run(self, coroutine_function):
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        async def run():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{self.path}")
+            try:
+                return await coroutine_function(async_sessionmaker(engine))
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(run())
+
+    def test_cursor_round_trip_and_invalid_cursor(self):
+        from access_log_query import decode_cursor, encode_cursor
+        timestamp = datetime(2026, 1, 1, 12, 0, 0, 123456)
+        cursor = encode_cursor(timestamp, 42)
+        assert "=" not in cursor
+        assert decode_cursor(cursor) == (timestamp, 42)
+        with pytest.raises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_keyset_pages_cover_every_row_once(self):
+        from access_log_query import logs_query, next_cursor
+
+        async def paginate(Session, **filters):
+            ids, cursor = [], None
+            async with Session() as db:
+                everything = (await db.execute(logs_query(**filters))).mappings().all()
+                while True:
+                    query = logs_query(cursor=cursor, **filters).limit(4)
+                    rows = (await db.execute(query)).mappings().all()
+                    ids += [row["id"] for row in rows]
+                    cursor = next_cursor(rows, 4)
+                    if cursor is None:
+                        break
+            return ids, [row["id"] for row in everything]
+
+        ids, expected = self.run(paginate)
+        assert ids == expected and len(ids) == 20
+        # Najnowsze pierwsze, przy równym czasie większe id pierwsze
+        assert ids[:3] == [3, 2, 1]
+
+        ids, expected = self.run(lambda Session: paginate(Session, user_id=0, result="REJECT"))
+        assert ids == expected == [1, 5, 9, 13, 17]
+
+    def test_ndjson_stream_in_batches(self):
+        import json
+        from access_log_query import logs_query, stream_ndjson
+
+        async def export(Session):
+            return [chunk async for chunk in stream_ndjson(Session, logs_query(), batch_size=8)]
+
+        chunks = self.run(export)
+        assert len(chunks) == 3
+        lines = b"".join(chunks).decode().splitlines()
+        records = [json.loads(line) for line in lines]
+        assert len(records) == 20
+        assert set(records[0]) == set(AccessLogResponse.model_fields)
+        assert records[0]["timestamp"] == "2026-01-01T12:00:00"
+
 class TestDatabase:
     
     def setup_method(self):
@@ -231,6 +1707,58 @@ class TestDatabase:
             assert badge.user.first_name == "Jan"
         finally:
             db.close()
+    
+    def test_migrate_adds_missing_access_log_columns(self):
+        from database import migrate_db
+        from sqlalchemy import inspect, text
+        engine = create_engine(self.test_db_url, connect_args={"check_same_thread": False})
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE access_logs (id INTEGER PRIMARY KEY, timestamp DATETIME, "
+                "result VARCHAR, match_score FLOAT, badge_id INTEGER, user_id INTEGER, "
+                "image_path VARCHAR)"
+            ))
+        
+        migrate_db(engine)
+        
+        columns = {column["name"] for column in inspect(engine).get_columns("access_logs")}
+        assert {"fused_score", "frame_scores", "gallery_version"} <= columns
+        indexes = {index["name"]: index["column_names"] for index in inspect(engine).get_indexes("access_logs")}
+        assert indexes["ix_access_logs_timestamp"] == ["timestamp"]
+        assert indexes["ix_access_logs_user_id_timestamp"] == ["user_id", "timestamp"]
+        assert indexes["ix_access_logs_result_timestamp"] == ["result", "timestamp"]
+        
+        # Ponowna migracja niczego nie zmienia
+        migrate_db(engine)
+        
+        with engine.connect() as connection:
+            plan = " ".join(row[-1] for row in connection.execute(text(
+                "EXPLAIN QUERY PLAN SELECT * FROM access_logs WHERE user_id = 1 "
+                "ORDER BY timestamp DESC LIMIT 10"
+            )))
+        assert "ix_access_logs_user_id_timestamp" in plan
+        assert "TEMP B-TREE" not in plan
+    
+    def test_badge_with_user_single_query(self):
+        from database import badge_with_user
+        db = self.SessionLocal()
+        try:
+            user = User(first_name="Jan", last_name="Kowalski", face_id="face_join")
+            db.add(user)
+            db.commit()
+            db.add(Badge(qr_code="QR_JOIN", valid_until=date(2030, 1, 1), user_id=user.id))
+            db.add(Badge(qr_code="QR_ORPHAN", valid_until=date(2030, 1, 1), user_id=999))
+            db.commit()
+            
+            badge, owner = db.execute(badge_with_user("QR_JOIN")).first()
+            assert (badge.qr_code, owner.face_id) == ("QR_JOIN", "face_join")
+            
+            badge, owner = db.execute(badge_with_user("QR_ORPHAN")).first()
+            assert badge.user_id == 999 and owner is None
+            
+            assert db.execute(badge_with_user("QR_NONE")).first() is None
+        finally:
+            db.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import time
+from collections import deque
+from typing import Callable, Optional
+
+from recognition_pool import RecognitionPool
+import score_fusion
+
+
+# Wynik 1:1, od którego weryfikacja kończy się akceptacją (jak w /api/verify)
+ACCEPT_SCORE = 0.5
+
+ACCEPT = "ACCEPT"
+REJECT = "REJECT"
+SUSPICIOUS = "SUSPICIOUS"
+
+
+class VerificationSession:
+    """
+    Stan jednej sesji weryfikacji strumieniowej (/ws/verify): kiosk po
+    zeskanowaniu przepustki przesyła kolejne klatki JPEG, a sesja trzyma
+    okno ostatnich analiz (historia EAR do mrugnięcia), najlepsze
+    dopasowanie i werdykt detekcji ekranu klatki głównej.
+
+    Reguły decyzji są takie same jak w /api/verify: każda klatka przechodzi
+    detekcję ekranu, a dopasowanie liczymy tylko dla klatek z czystym
+    werdyktem (score_fusion.matchable). Klatka główna oznaczona jako
+    ekran/zdjęcie wyklucza dopasowanie w całej sesji – bez mrugnięcia
+    wynik to SUSPICIOUS, po mrugnięciu REJECT. Dopasowanie >= ACCEPT_SCORE
+    to ACCEPT. Decyzja zapada przy pierwszej klatce, która ją rozstrzyga,
+    zamiast po zebraniu całej serii. Po `max_frames` klatkach albo `timeout`
+    sekundach bez akceptacji sesja kończy się odrzuceniem.
+
+    Decyzja niesie też kolumny logu jak w /api/verify: wyniki kolejnych klatek
+    (None = klatka bez twarzy lub niedopasowywana), najlepszy z nich jako
+    fused_score (sesja akceptuje po najlepszej klatce) i wersję galerii.
+    """
+
+    def __init__(
+        self,
+        pool: RecognitionPool,
+        face_id: str,
+        threshold: float = ACCEPT_SCORE,
+        window: int = 6,
+        max_frames: int = 15,
+        timeout: float = 10.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.pool = pool
+        self.face_id = face_id
+        self.threshold = threshold
+        self.max_frames = max_frames
+        self.timeout = timeout
+        self._clock = clock
+        self.started_at = clock()
+
+        self.analyses = deque(maxlen=window)
+        self.frames = 0
+        self.screen_spoof = False
+        self.liveness_ok = False
+        self.best_score: Optional[float] = None
+        self.best_encoding = None
+        self.best_frame: Optional[bytes] = None
+        self.primary_frame: Optional[bytes] = None
+        self.quality_reason: Optional[str] = None
+        self.frame_scores: list = []
+        self.gallery_version: Optional[str] = None
+        # Ramka twarzy z ostatniej klatki – kolejna szuka twarzy w jej otoczeniu
+        self.face_location: Optional[tuple] = None
+
+    @property
+    def expired(self) -> bool:
+        return self._clock() - self.started_at > self.timeout
+
+    @property
+    def remaining(self) -> float:
+        """Sekundy do końca sesji (0, gdy czas minął)."""
+        return max(0.0, self.timeout - (self._clock() - self.started_at))
+
+    async def add_frame(self, data: bytes) -> Optional[dict]:
+        """
+        Analizuje klatkę i zwraca decyzję (słownik z polem "result"), gdy
+        dowody są wystarczające, albo None – wtedy sesja czeka na kolejną klatkę.
+        """
+        primary = self.frames == 0
+        self.frames += 1
+        self.frame_scores.append(None)
+        if primary:
+            self.primary_frame = data
+
+        analysis = await self.pool.analyze_frame(
+            data, check_spoof=True, track_from=self.face_location
+        )
+        if analysis is None:
+            return self._final_decision()
+
+        self.analyses.append(analysis)
+        self.quality_reason = analysis["quality"]
+        if analysis.get("location") is not None:
+            self.face_location = analysis["location"]
+        if primary and analysis["screen_spoof"]:
+            self.screen_spoof = True
+
+        if self.screen_spoof and not self.liveness_ok and len(self.analyses) >= 3:
+            self.liveness_ok = await self.pool.blink_liveness(list(self.analyses))
+        if self.screen_spoof and self.liveness_ok:
+            # Mrugnięcie zdejmuje werdykt ekranu, ale nie pozwala dopasować klatek
+            return self._decision(REJECT)
+
+        if not self.screen_spoof and score_fusion.matchable(analysis):
+            scored = await self.pool.score_encoding(
+                analysis["encoding"], self.face_id, self.threshold
+            )
+            self.frame_scores[-1] = scored["frame_score"]
+            self.gallery_version = scored["gallery_version"]
+            score = scored["match_score"]
+            if score is not None and (self.best_score is None or score > self.best_score):
+                self.best_score = score
+                self.best_encoding = analysis["encoding"]
+                self.best_frame = data
+
+        if self.best_score is not None and self.best_score >= ACCEPT_SCORE:
+            return self._decision(ACCEPT)
+        if self.screen_spoof and len(self.analyses) == self.analyses.maxlen:
+            # Pełne okno bez mrugnięcia – werdykt detekcji ekranu zostaje
+            return self._decision(SUSPICIOUS)
+        return self._final_decision()
+
+    def _final_decision(self) -> Optional[dict]:
+        if self.frames < self.max_frames and not self.expired:
+            return None
+        if self.screen_spoof and not self.liveness_ok:
+            return self._decision(SUSPICIOUS)
+        return self._decision(REJECT)
+
+    def finish(self) -> dict:
+        """Decyzja przy przerwaniu sesji (klient kończy strumień przed rozstrzygnięciem)."""
+        return self._final_decision() or self._decision(
+            SUSPICIOUS if self.screen_spoof and not self.liveness_ok else REJECT
+        )
+
+    def _decision(self, result: str) -> dict:
+        return {
+            "result": result,
+            "match_score": self.best_score if result != SUSPICIOUS else None,
+            "probe_encoding": self.best_encoding,
+            "frames": self.frames,
+            "fused_score": score_fusion.fuse_scores(self.frame_scores, method=score_fusion.BEST),
+            "frame_scores": list(self.frame_scores),
+            "gallery_version": self.gallery_version,
+            "quality_reason": self.quality_reason if self.best_score is None else None,
+            "elapsed": self._clock() - self.started_at,
+        }